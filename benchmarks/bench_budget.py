@@ -0,0 +1,54 @@
+"""Compare the estimated and the measured peak memory of match_proteins with --max-memory.
+
+Every budget runs in a fresh process on seeded synthetic proteomes (see bench_stages.py), the
+table lists the planned chunks, the estimate of the plan and the measured peak RSS.
+
+    python benchmarks/bench_budget.py --n 100000 --budgets 512M 1G 4G
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from bench_stages import proteome_files
+
+
+def run_budget(fasta_host, fasta_trap, max_memory, engine="kdtree"):
+    """Match in this process and return the plan and the measured peak RSS."""
+    from pytrapment import budget, entrapment, runmetrics
+
+    plan = budget.MemoryPlan.from_files(max_memory, fasta_host, fasta_trap)
+    result = entrapment.match_proteins(fasta_host, fasta_trap, engine=engine,
+                                       max_memory=max_memory)
+    return {"max_memory": max_memory, "n_chunks": plan.n_chunks,
+            "estimate": plan.peak_bytes, "peak_rss": runmetrics.peak_rss(),
+            "wall_time": sum(stage["wall_time"] for stage in result.metrics.stages.values())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", default=100000, type=int)
+    parser.add_argument("--budgets", default=["512M", "1G", "4G"], nargs="+")
+    parser.add_argument("--engine", default="kdtree")
+    parser.add_argument("--work_dir", default="benchmark_data")
+    parser.add_argument("--run", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    fasta_files = proteome_files(args.work_dir, args.n)
+    if args.run is not None:
+        print(json.dumps(run_budget(*fasta_files, args.run, args.engine)))
+        sys.exit(0)
+
+    print(f"{'budget':>8} {'chunks':>7} {'estimate':>10} {'peak RSS':>10} {'wall [s]':>9}")
+    for max_memory in args.budgets:
+        out = subprocess.run([sys.executable, __file__, "--n", str(args.n), "--engine",
+                              args.engine, "--work_dir", args.work_dir, "--run", max_memory],
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"{max_memory:>8} {out.stderr.strip().splitlines()[-1]}")
+            continue
+        record = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{max_memory:>8} {record['n_chunks']:>7} {record['estimate'] / 2 ** 20:>7.0f} MiB"
+              f" {record['peak_rss'] / 2 ** 20:>6.0f} MiB {record['wall_time']:>9.1f}")
@@ -0,0 +1,56 @@
+"""Benchmark the import and CLI start-up time of pytrapment.
+
+Every command runs in a fresh interpreter, the best of several repeats is reported.
+
+    python benchmarks/bench_import.py --repeats 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# commands timed in a fresh interpreter
+COMMANDS = {"python": [sys.executable, "-c", "pass"],
+            "import pytrapment": [sys.executable, "-c", "import pytrapment"],
+            "import pytrapment.__main__": [sys.executable, "-c", "import pytrapment.__main__"],
+            "pytrapment --version": [sys.executable, "-m", "pytrapment", "--version"],
+            "pytrapment --help": [sys.executable, "-m", "pytrapment", "--help"],
+            "import pytrapment.entrapment": [sys.executable, "-c",
+                                             "import pytrapment.entrapment"]}
+
+
+def time_command(command, repeats):
+    """Return the best wall time of a command in seconds."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, env=env, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def import_profile(module, top=10):
+    """Return the modules with the highest cumulative import time (python -X importtime)."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            check=True, env=env, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", default=5, type=int)
+    args = parser.parse_args()
+    for name, command in COMMANDS.items():
+        print(f"{name:<32} {time_command(command, args.repeats) * 1000:8.1f} ms")
+    print("\nslowest imports of pytrapment.__main__ (cumulative):")
+    for cumulative, name in import_profile("pytrapment.__main__"):
+        print(f"{name:<40} {cumulative / 1000:8.1f} ms")
@@ -0,0 +1,87 @@
+"""Benchmark the pipeline stages on seeded synthetic proteomes of increasing size.
+
+Every size uses a host and an entrapment proteome with n proteins each, the proteomes are
+cached in the work directory. The stage metrics (see pytrapment.runmetrics) are printed per
+size and written as json.
+
+    python benchmarks/bench_stages.py --sizes 1000 10000 100000 1000000 --out stages.json
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the scripts run from a source checkout without installing the package
+sys.path.insert(0, ROOT)
+
+from pytrapment import entrapment, neighbors, qc, runmetrics, synthetic  # noqa: E402
+
+
+def proteome_files(work_dir, n, shared_rate=0.05, random_state=42):
+    """Return the host and entrapment fasta of a size, generated on first use."""
+    prefix = os.path.join(work_dir, f"synthetic_{n}_{shared_rate}_{random_state}")
+    fasta_host, fasta_trap = f"{prefix}_host.fasta", f"{prefix}_trap.fasta"
+    if not (os.path.isfile(fasta_host) and os.path.isfile(fasta_trap)):
+        synthetic.write_proteomes(fasta_host, fasta_trap, n, n, shared_rate=shared_rate,
+                                  random_state=random_state)
+    return fasta_host, fasta_trap
+
+
+def bench_size(fasta_host, fasta_trap, work_dir, engine="kdtree", processes=1):
+    """
+    Run every stage once.
+
+    Returns:
+        RunMetrics, the stage records
+    """
+    metrics = runmetrics.RunMetrics()
+    with metrics.stage("fasta2dataframe") as stage:
+        df_host = entrapment.fasta2dataframe(fasta_host)
+        df_trap = entrapment.fasta2dataframe(fasta_trap)
+        stage["items"] = len(df_host) + len(df_trap)
+    with metrics.stage("compute_composition_df", items=len(df_host) + len(df_trap)):
+        comp_host = entrapment.compute_composition_df(df_host)
+        comp_trap = entrapment.compute_composition_df(df_trap)
+    with metrics.stage("digest_protein_df", items=len(df_host) + len(df_trap)):
+        pep_host = entrapment.digest_protein_df(df_host, processes=processes)
+        pep_trap = entrapment.digest_protein_df(df_trap, processes=processes)
+    with metrics.stage("filter_trap_fasta", items=len(pep_trap)):
+        comp_trap, df_trap = entrapment.filter_trap_fasta(df_trap, comp_trap, pep_trap, pep_host)
+    with metrics.stage("nn_search", items=len(comp_host)):
+        neighbors.get_engine(engine).fit(comp_trap.values).kneighbors(comp_host.values, k=1)
+    with metrics.stage("qc", items=len(pep_host)):
+        summary = qc.summarize_peptides([pep_host], "host")
+        qc.plot_summary(summary, work_dir)
+    del pep_host, pep_trap, df_host, df_trap, comp_host, comp_trap
+    # the streaming pipeline of the CLI with its own stage records
+    with metrics.stage("match_proteins") as stage:
+        result = entrapment.match_proteins(fasta_host, fasta_trap, engine=engine,
+                                           processes=processes)
+        stage["items"] = int((result.proteins["db_type"] == "host").sum())
+    metrics["match_proteins_stages"] = result.metrics.stages
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default=[1000, 10000, 100000], type=int, nargs="+")
+    parser.add_argument("--shared_rate", default=0.05, type=float)
+    parser.add_argument("--seed", default=42, type=int)
+    parser.add_argument("--engine", default="kdtree", choices=sorted(neighbors.ENGINES))
+    parser.add_argument("--processes", default=1, type=int)
+    parser.add_argument("--work_dir", default="benchmark_data")
+    parser.add_argument("--out", default=None, help="json file for the stage metrics")
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    report = {}
+    for n in args.sizes:
+        fasta_files = proteome_files(args.work_dir, n, args.shared_rate, args.seed)
+        metrics = bench_size(*fasta_files, args.work_dir, args.engine, args.processes)
+        report[n] = metrics
+        print(f"\n{n} host and {n} entrapment proteins")
+        print(metrics.report())
+    if args.out is not None:
+        with open(args.out, mode="w") as ofile:
+            json.dump(report, ofile, indent=2)
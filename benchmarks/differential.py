@@ -0,0 +1,190 @@
+"""Differential checks of the fast paths against the reference implementations.
+
+A seeded synthetic proteome is processed by both, every check reports PASS or FAIL and the
+script exits with 1 if a check fails.
+
+    python benchmarks/differential.py --n_host 500 --n_trap 1000
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the scripts run from a source checkout without installing the package
+sys.path.insert(0, ROOT)
+
+import reference  # noqa: E402
+from pytrapment import budget, entrapment, neighbors, qc, synthetic, trapindex  # noqa: E402
+
+
+def pairs(peptides_df):
+    """Return the (protein, sequence) pairs of a peptide table."""
+    return set(zip(peptides_df["protein"], peptides_df["sequence"]))
+
+
+def run_checks(fasta_host, fasta_trap, work_dir):
+    """
+    Compare every fast path with its reference.
+
+    Returns:
+        list of (str, bool, str), name, result and detail of every check
+    """
+    results = []
+
+    def check(name, ok, detail=""):
+        results.append((name, bool(ok), detail))
+        print(f"{'PASS' if ok else 'FAIL'}  {name:<36} {detail}", flush=True)
+
+    # parsing
+    ref_host = reference.fasta2dataframe(fasta_host)
+    ref_trap = reference.fasta2dataframe(fasta_trap)
+    df_host = entrapment.fasta2dataframe(fasta_host)
+    df_trap = entrapment.fasta2dataframe(fasta_trap)
+    check("fasta2dataframe", all(df.index.equals(ref.index)
+                                 and np.all(df["sequence"].values == ref["sequence"].values)
+                                 for df, ref in [(df_host, ref_host), (df_trap, ref_trap)]),
+          f"{len(df_host)} host, {len(df_trap)} trap proteins")
+
+    # composition
+    ref_comp_host = reference.compute_composition_df(ref_host)
+    ref_comp_trap = reference.compute_composition_df(ref_trap)
+    comp_host = entrapment.compute_composition_df(df_host)
+    comp_trap = entrapment.compute_composition_df(df_trap)
+    check("compute_composition_df",
+          np.array_equal(comp_host.values, ref_comp_host.values)
+          and np.array_equal(comp_trap.values, ref_comp_trap.values))
+
+    # digestion
+    ref_pep_host = reference.digest_protein_df(ref_host)
+    ref_pep_trap = reference.digest_protein_df(ref_trap)
+    pep_host = entrapment.digest_protein_df(df_host)
+    pep_trap = entrapment.digest_protein_df(df_trap)
+    check("digest_protein_df", pairs(pep_host) == pairs(ref_pep_host)
+          and pairs(pep_trap) == pairs(ref_pep_trap), f"{len(pep_trap)} trap peptides")
+    check("digest_protein_df processes=2",
+          pairs(entrapment.digest_protein_df(df_trap, processes=2)) == pairs(pep_trap))
+
+    # filtering
+    ref_kept, _ = reference.filter_trap_fasta(ref_trap, ref_comp_trap, ref_pep_trap, ref_pep_host)
+    kept, _ = entrapment.filter_trap_fasta(df_trap, comp_trap, pep_trap, pep_host)
+    kept_bloom, _ = entrapment.filter_trap_fasta(df_trap, comp_trap, pep_trap, pep_host,
+                                                 bloom_fp_rate=0.01)
+    check("filter_trap_fasta", kept.index.equals(ref_kept.index),
+          f"{len(df_trap) - len(kept)} of {len(df_trap)} trap proteins removed")
+    check("filter_trap_fasta bloom", kept_bloom.index.equals(ref_kept.index))
+
+    # nearest neighbor search
+    ref_neighbors, ref_distances = reference.nearest_neighbors(ref_comp_host, ref_kept)
+    for name in ["cdist", "kdtree", "blocked"]:
+        distances, indices = neighbors.get_engine(name).fit(kept.values).kneighbors(
+            comp_host.values, k=1)
+        check(f"nn engine {name}", np.array_equal(kept.index.values[indices[:, 0]],
+                                                  ref_neighbors)
+              and np.allclose(distances[:, 0], ref_distances))
+    _, indices = neighbors.get_engine("ivf").fit(kept.values).kneighbors(comp_host.values, k=1)
+    recall = np.mean(np.isclose(np.linalg.norm(kept.values[indices[:, 0]] - comp_host.values,
+                                               axis=1), ref_distances))
+    check("nn engine ivf (approximate)", recall >= 0.9, f"recall {recall:.3f}")
+
+    # end to end matching, from the fasta files and from a prebuilt index
+    ref_trap_ids = np.array(ref_neighbors)
+    result = entrapment.match_proteins(fasta_host, fasta_trap)
+    trap_rows = result.proteins[result.proteins["db_type"] == "trap"]
+    check("match_proteins", np.array_equal(trap_rows.index.values, ref_trap_ids)
+          and np.array_equal(trap_rows["host_seed"].values, ref_comp_host.index.values))
+    index_dir = os.path.join(work_dir, "index")
+    trapindex.build_index(fasta_trap, index_dir)
+    index_rows = entrapment.get_nearest_neighbor_proteins(fasta_host, index_dir)
+    check("match_proteins prebuilt index",
+          np.array_equal(index_rows[index_rows["db_type"] == "trap"].index.values, ref_trap_ids))
+    check("MatchResult.peptide_df",
+          pairs(result.peptide_df("trap")) == pairs(reference.digest_protein_df(trap_rows)))
+
+    # max_uses, the greedy assignment has no reference, its invariants are checked
+    host_rows = ref_comp_host.loc[trap_rows["host_seed"].values]
+    for max_uses in [1, 2]:
+        unique = entrapment.match_proteins(fasta_host, fasta_trap, max_uses=max_uses).proteins
+        unique_rows = unique[unique["db_type"] == "trap"]
+        distances = np.linalg.norm(ref_kept.loc[unique_rows.index].values
+                                   - ref_comp_host.loc[unique_rows["host_seed"]].values, axis=1)
+        check(f"match_proteins max_uses={max_uses}",
+              unique_rows.index.value_counts().max() <= max_uses
+              and np.array_equal(unique_rows["host_seed"].values, host_rows.index.values)
+              and np.allclose(unique_rows["distance"].values, distances)
+              and np.all(unique_rows["distance"].values >= ref_distances - 1e-9))
+    unlimited = entrapment.get_nearest_neighbor_proteins(fasta_host, fasta_trap,
+                                                         max_uses=len(ref_host))
+    check("match_proteins max_uses unlimited",
+          np.array_equal(unlimited[unlimited["db_type"] == "trap"].index.values, ref_trap_ids))
+
+    # memory budget, the small proteomes are split into several chunks by dropping the fixed
+    # part of the estimate
+    base_bytes, min_chunk_bytes = budget.BASE_BYTES, budget.MIN_CHUNK_BYTES
+    budget.BASE_BYTES, budget.MIN_CHUNK_BYTES = 0, 1
+    try:
+        fixed_bytes = budget.MemoryPlan.from_files(2 ** 40, fasta_host, fasta_trap).fixed_bytes
+        trap_bytes = (budget.CHUNK_BYTES_PER_RESIDUE * int(df_trap["sequence"].str.len().sum())
+                      + budget.CHUNK_BYTES_PER_PROTEIN * len(df_trap))
+        for max_uses in [None, 2]:
+            # the assignment with max_uses holds the compositions of all proteins at once
+            assign_bytes = 0 if max_uses is None else \
+                budget.ASSIGN_BYTES_PER_PROTEIN * len(df_trap)
+            chunked = entrapment.match_proteins(fasta_host, fasta_trap, max_uses=max_uses,
+                                                max_memory=fixed_bytes + trap_bytes // 3
+                                                + assign_bytes)
+            expected = entrapment.match_proteins(fasta_host, fasta_trap,
+                                                 max_uses=max_uses).proteins
+            check(f"match_proteins max_memory max_uses={max_uses}",
+                  chunked.proteins.equals(expected)
+                  and pairs(chunked.peptide_df("trap")) == pairs(
+                      reference.digest_protein_df(expected[expected["db_type"] == "trap"])),
+                  f"{chunked.metrics['memory_plan']['n_chunks']} chunks")
+    finally:
+        budget.BASE_BYTES, budget.MIN_CHUNK_BYTES = base_bytes, min_chunk_bytes
+
+    # qc features and summaries
+    features = qc.compute_sequence_features(pep_host.copy())
+    ref_features = reference.compute_sequence_features(pep_host)
+    counts = ["length", "KR", "aromatic", "acids", "aliphatic", "HGP"]
+    check("compute_sequence_features counts",
+          np.array_equal(features[counts].values, ref_features[counts].values))
+    pi_error = np.abs(features["isoelectric_point"] - ref_features["isoelectric_point"]).max()
+    check("compute_sequence_features pI", pi_error <= 0.01, f"max error {pi_error:.2g}")
+    gravy_error = np.abs(features["gravy"] - ref_features["gravy"]).max()
+    check("compute_sequence_features gravy", gravy_error <= 1e-9, f"max error {gravy_error:.2g}")
+
+    summary = qc.summarize_features(features, "host", chunk_size=1000)
+    rank_errors = []
+    for feature in qc.QC_FEATURES:
+        values = np.sort(features[feature].values)
+        estimates = summary["host", feature].quantile([0.25, 0.5, 0.75])
+        # an estimate is exact if it lies between the values of the neighboring ranks
+        low = np.searchsorted(values, estimates, side="left") / len(values)
+        high = np.searchsorted(values, estimates, side="right") / len(values)
+        qs = np.array([0.25, 0.5, 0.75])
+        rank_errors.append(np.max(np.maximum(0, np.maximum(low - qs, qs - high))))
+    means_ok = all(np.isclose(summary["host", feature].mean, features[feature].mean())
+                   for feature in qc.QC_FEATURES)
+    check("QCSummary", means_ok and max(rank_errors) <= 0.01,
+          f"max quartile rank error {max(rank_errors):.2g}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n_host", default=500, type=int)
+    parser.add_argument("--n_trap", default=1000, type=int)
+    parser.add_argument("--shared_rate", default=0.1, type=float)
+    parser.add_argument("--seed", default=42, type=int)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fasta_files = synthetic.write_proteomes(
+            os.path.join(tmp_dir, "host.fasta"), os.path.join(tmp_dir, "trap.fasta"),
+            args.n_host, args.n_trap, shared_rate=args.shared_rate, random_state=args.seed)
+        checks = run_checks(*fasta_files, tmp_dir)
+    failed = [name for name, ok, _ in checks if not ok]
+    print(f"\n{len(checks) - len(failed)} of {len(checks)} checks passed.")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,76 @@
+"""Reference implementations (the original pandas/pyteomics code) for differential checks.
+
+They are slow on purpose and only serve to verify that the fast paths give the same results.
+"""
+import numpy as np
+import pandas as pd
+from pyteomics import electrochem, fasta, parser
+from scipy.spatial import distance
+
+
+def read_fasta(fasta_file):
+    """Read (description, sequence) pairs with pyteomics."""
+    with open(fasta_file, mode="rt") as ffile:
+        return [(description, sequence) for description, sequence in fasta.FASTA(ffile)]
+
+
+def fasta2dataframe(fasta_file):
+    """Read proteins into a shuffled dataframe (id index, sequence and Type columns)."""
+    records = read_fasta(fasta_file)
+    df = pd.DataFrame([sequence for _, sequence in records], columns=["sequence"])
+    df["Type"] = "Protein"
+    df.index = [description for description, _ in records]
+    return df.sample(frac=1, random_state=42)
+
+
+def compute_composition_df(seq_df):
+    """Count the standard amino acids per protein with pyteomics."""
+    df_seq_comp = pd.DataFrame(
+        list(seq_df["sequence"].apply(parser.amino_acid_composition).values)) * 1.0
+    for aa in parser.std_amino_acids:
+        if aa not in df_seq_comp.columns:
+            df_seq_comp[aa] = 0
+    df_seq_comp = df_seq_comp.fillna(0.0)[parser.std_amino_acids]
+    df_seq_comp.index = seq_df.index
+    return df_seq_comp
+
+
+def digest_protein_df(df_fasta, rule="trypsin", min_length=6):
+    """Digest proteins into the unique peptides per protein with pyteomics."""
+    cleaved = df_fasta["sequence"].apply(parser.cleave, args=(rule,)).explode()
+    cleaved = cleaved[cleaved.apply(len) >= min_length]
+    return cleaved.rename_axis("protein").reset_index()
+
+
+def filter_trap_fasta(df_prot_trap, df_comp_trap, df_peptides_trap, df_peptides_host):
+    """Remove trap proteins sharing an I/L-normalized peptide with the host (pandas join)."""
+    df_peptides_host = df_peptides_host.assign(
+        sequence=df_peptides_host["sequence"].str.replace("I", "L")).set_index("sequence")
+    df_peptides_trap = df_peptides_trap.assign(
+        sequence=df_peptides_trap["sequence"].str.replace("I", "L")).set_index("sequence")
+    df_joined = df_peptides_trap.join(df_peptides_host, rsuffix="_host", lsuffix="_trap",
+                                      how="left")
+    blacklist = df_joined.dropna(subset=["protein_host"])["protein_trap"].unique()
+    return df_comp_trap.drop(blacklist), df_prot_trap.drop(blacklist)
+
+
+def nearest_neighbors(df_comp_host, df_comp_trap):
+    """Find the nearest trap protein per host protein with a cdist loop (first row wins ties)."""
+    neighbor, distances = [], np.zeros(df_comp_host.shape[0])
+    for ii, (_, row) in enumerate(df_comp_host.iterrows()):
+        ary = distance.cdist(df_comp_trap, pd.DataFrame(row).transpose(), metric="euclidean")
+        neighbor.append(df_comp_trap[ary == ary.min()].index.values[0])
+        distances[ii] = ary.min()
+    return neighbor, distances
+
+
+def compute_sequence_features(peptides_df):
+    """Compute the qc features with string counts and pyteomics electrochem."""
+    seq = peptides_df["sequence"]
+    features = pd.DataFrame({"length": seq.apply(len)})
+    for group, residues in {"KR": "KR", "aromatic": "FWY", "acids": "DE",
+                            "aliphatic": "AILMV", "HGP": "GPH"}.items():
+        features[group] = sum(seq.str.count(residue) for residue in residues)
+    features["isoelectric_point"] = [electrochem.pI(x) for x in seq.values]
+    features["gravy"] = [electrochem.gravy(x) for x in seq.values]
+    return features
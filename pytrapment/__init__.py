@@ -1,14 +1,15 @@
-"""Init module for president."""
-import os
-from ._version import get_versions
+"""Init module for pytrapment."""
 
-__version__ = get_versions()['version']
-del get_versions
+__all__ = ["budget", "digest", "entrapment", "fastaio", "features", "neighbors", "peptides",
+           "profiling", "qc", "render", "runmetrics", "sequences", "summaries", "synthetic",
+           "trapindex"]
 
-files = os.listdir(os.path.dirname(__file__))
-files.remove('__init__.py')
-__all__ = [f[:-3] for f in files if f.endswith(".py")]
 
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
+def __getattr__(name):
+    """Resolve the version on first access (static in built packages, from git in checkouts)."""
+    if name == "__version__":
+        from ._version import get_versions
+
+        globals()["__version__"] = get_versions()["version"]
+        return globals()["__version__"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
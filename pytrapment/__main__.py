@@ -6,10 +6,10 @@ import sys
 import time
 from datetime import date
 
-from pyteomics import fasta
-
 from pytrapment import __version__ as xv
-from pytrapment import entrapment, qc
+# the pipeline modules (pandas, scipy, matplotlib) are imported in main, so --help and
+# --version do not pay for them
+from pytrapment import neighbors, profiling, render
 
 
 def arg_parser():  # pragma: not covered
@@ -24,25 +24,164 @@ def arg_parser():  # pragma: not covered
     Entrapment databases are created by sampling for each host fasta protein a similar protein
     from the entrapment database.
 
-    Use --help to see the command line arguments.
+    Use --help to see the command line arguments. 'pytrapment index build' creates a prebuilt
+    index of an entrapment database.
 
     Current Version: {}
     """.format(xv)
     parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--version", action="version", version=xv)
     parser.add_argument("-i", "--fasta_host",
-                        help="Input protein fasta file.",
+                        help="Input protein fasta file (plain, gzip, bz2, xz or zstd).",
                         required=True, action="store", dest="fasta_host")
 
     parser.add_argument("-t", "--fasta_trap",
-                        help="Entrapment proteins.",
+                        help="Entrapment proteins (plain, gzip, bz2, xz or zstd) or an index "
+                             "directory from 'pytrapment index build'.",
                         required=True, action="store", dest="fasta_trap")
 
     parser.add_argument("-o", "--out_dir",
                         help="Directory to store the results",
                         required=True, action="store", dest="out_dir")
+
+    parser.add_argument("-e", "--nn_engine",
+                        help="Nearest neighbor engine used to match host and trap proteins.",
+                        default="kdtree", choices=sorted(neighbors.ENGINES),
+                        action="store", dest="nn_engine")
+
+    parser.add_argument("--n_probe",
+                        help="Number of clusters searched per host protein by the approximate "
+                             "ivf engine, higher values increase recall and runtime.",
+                        default=8, type=int, action="store", dest="n_probe")
+
+    parser.add_argument("--recall_sample",
+                        help="Number of host proteins used to report the recall of the "
+                             "approximate ivf engine against exact search (with --max_uses "
+                             "over the candidate queries of all assignment rounds).",
+                        default=1000, type=int, action="store", dest="recall_sample")
+
+    parser.add_argument("--max_uses",
+                        help="Use each entrapment protein for at most this many host proteins "
+                             "(default: no limit).",
+                        default=None, type=int, action="store", dest="max_uses")
+
+    parser.add_argument("--bloom_fp_rate",
+                        help="Prefilter the entrapment peptides with a bloom filter of the host "
+                             "peptides with this false-positive rate (e.g. 0.01, default: off).",
+                        default=None, type=float, action="store", dest="bloom_fp_rate")
+
+    parser.add_argument("--max_memory", "--max-memory",
+                        help="Memory budget (e.g. 4G or 512M). The entrapment database is "
+                             "processed in chunks that fit into it, runs that cannot fit stop "
+                             "before the matching with an estimate (default: no limit).",
+                        default=None, action="store", dest="max_memory")
+
+    parser.add_argument("--fasta_index_dir",
+                        help="Keep the offset index of a plain entrapment fasta in this "
+                             "directory, later runs load it instead of scanning the fasta "
+                             "(default: the index is not written).",
+                        default=None, action="store", dest="fasta_index_dir")
+
+    parser.add_argument("--compression",
+                        help="Compression of the entrapment fasta (zstd needs zstandard).",
+                        default="none", choices=["none", "gzip", "zstd"],
+                        action="store", dest="compression")
+
+    parser.add_argument("--threads",
+                        help="Number of threads used for compression.",
+                        default=1, type=int, action="store", dest="threads")
+
+    parser.add_argument("--fai",
+                        help="Write a .fai index next to the entrapment fasta. gzip output "
+                             "is written as BGZF with a .gzi index (as bgzip), zstd output "
+                             "cannot be indexed.",
+                        action="store_true", dest="fai")
+
+    parser.add_argument("--processes",
+                        help="Number of processes used to digest the proteins.",
+                        default=1, type=int, action="store", dest="processes")
+
+    parser.add_argument("--qc_plot",
+                        help="Glyphs of the qc plot.",
+                        default="box", choices=render.PLOT_KINDS, action="store", dest="qc_plot")
+
+    parser.add_argument("--qc_format",
+                        help="Output formats of the qc plot.",
+                        default=["png"], nargs="+", choices=render.PLOT_FORMATS,
+                        action="store", dest="qc_format")
+
+    parser.add_argument("--profile",
+                        help="Profile every stage, writes profile_<stage>.pstats (cProfile) and "
+                             "profile_<stage>.collapsed (sampled stacks for flamegraphs) to the "
+                             f"out dir. Also enabled by {profiling.PROFILE_ENV}=1.",
+                        action="store_true", dest="profile")
+    return parser
+
+
+def index_arg_parser():  # pragma: not covered
+    """
+    Parse the arguments of the index subcommand from the CLI.
+
+    Returns:
+        arguments, from parse_args
+    """
+    parser = argparse.ArgumentParser(
+        prog="pytrapment index",
+        description="Build a prebuilt entrapment database index. The index directory can be "
+                    "passed to pytrapment -t to skip parsing, digesting and computing the "
+                    "compositions of the entrapment proteins in every run.")
+    parser.add_argument("action", choices=["build"], help="Index action.")
+    parser.add_argument("-t", "--fasta_trap",
+                        help="Entrapment proteins (plain, gzip, bz2, xz or zstd).",
+                        required=True, action="store", dest="fasta_trap")
+
+    parser.add_argument("-o", "--index_dir",
+                        help="Directory to store the index.",
+                        required=True, action="store", dest="index_dir")
+
+    parser.add_argument("-e", "--nn_engine",
+                        help="Nearest neighbor engine stored in the index.",
+                        default="kdtree", choices=sorted(neighbors.ENGINES),
+                        action="store", dest="nn_engine")
+
+    parser.add_argument("--processes",
+                        help="Number of processes used to digest the proteins.",
+                        default=1, type=int, action="store", dest="processes")
+
+    parser.add_argument("--profile",
+                        help="Profile every stage, the profiles are written to the index "
+                             f"directory. Also enabled by {profiling.PROFILE_ENV}=1.",
+                        action="store_true", dest="profile")
     return parser
 
 
+def main_index(argv):  # pragma: no cover
+    """
+    Execute the index subcommand.
+
+    Args:
+        argv: list, command line arguments after 'index'
+
+    Returns:
+        None
+    """
+    args = index_arg_parser().parse_args(argv)
+    from pytrapment import runmetrics, trapindex
+
+    start_time = time.time()
+    print("Building index.")
+    profiler = profiling.StageProfiler(args.index_dir) \
+        if profiling.profile_enabled(args.profile) else None
+    metrics = runmetrics.RunMetrics(profiler=profiler)
+    trap_index = trapindex.build_index(args.fasta_trap, args.index_dir, engine=args.nn_engine,
+                                       processes=args.processes, metrics=metrics)
+    print(f"Indexed {len(trap_index)} entrapment proteins in {args.index_dir}.")
+    metrics["wall_time"] = time.time() - start_time
+    metrics.write(os.path.join(args.index_dir, "run_metrics.json"))
+    print(metrics.report())
+    print(f"Took {(time.time()-start_time)/60.:.2f} minutes")
+
+
 def main():  # pragma: no cover
     """
     Execute pytrapment.
@@ -50,6 +189,8 @@ def main():  # pragma: no cover
     Returns:
         None
     """
+    if sys.argv[1:2] == ["index"]:
+        return main_index(sys.argv[2:])
     today = date.today().strftime("%Y%m%d")
 
     parser = arg_parser()
@@ -58,34 +199,85 @@ def main():  # pragma: no cover
     except TypeError:
         parser.print_usage()
 
+    from pytrapment import budget, entrapment, fastaio, qc, runmetrics, trapindex
+
+    if args.fai and args.compression == "zstd":
+        parser.error("--fai cannot index zstd output, use --compression gzip (BGZF) or none.")
+    if args.max_memory is not None:
+        try:
+            budget.parse_memory(args.max_memory)
+        except ValueError as err:
+            parser.error(str(err))
+
     # create dir if not there
     if not os.path.exists(args.out_dir):
         os.makedirs(args.out_dir)
 
     start_time = time.time()
     print("Starting pytrapment.")
-    fasta_df = entrapment.get_nearest_neighbor_proteins(args.fasta_host, args.fasta_trap)
+    engine_params = {}
+    if args.nn_engine == "ivf":
+        engine_params = {"n_probe": args.n_probe, "recall_sample": args.recall_sample}
+    nn_engine = neighbors.get_engine(args.nn_engine, **engine_params)
+    profiler = profiling.StageProfiler(args.out_dir) \
+        if profiling.profile_enabled(args.profile) else None
+    metrics = runmetrics.RunMetrics(profiler=profiler)
+    try:
+        result = entrapment.match_proteins(args.fasta_host, args.fasta_trap, engine=nn_engine,
+                                           max_uses=args.max_uses,
+                                           bloom_fp_rate=args.bloom_fp_rate, metrics=metrics,
+                                           processes=args.processes,
+                                           max_memory=args.max_memory,
+                                           fasta_index_dir=args.fasta_index_dir)
+    except budget.MemoryBudgetError as err:
+        sys.exit(f"pytrapment: {err}")
+    fasta_df = result.proteins
     print("Found neighbors.")
+    if "memory_plan" in metrics:
+        plan = metrics["memory_plan"]
+        print(f"Memory budget: {budget.format_bytes(plan['max_bytes'])}, entrapment proteins "
+              f"processed in {plan['n_chunks']} chunks of about "
+              f"{budget.format_bytes(plan['chunk_bytes'])}")
+    if "bloom_bytes" in metrics:
+        print(f"Bloom filter: {metrics['bloom_bytes'] / 2 ** 20:.1f} MiB, "
+              f"{metrics['bloom_hashes']} hashes, measured false-positive rate "
+              f"{metrics['bloom_fp_rate']:.4f}")
+    if hasattr(nn_engine, "recall_"):
+        print(f"Recall of the approximate search: {nn_engine.recall_:.3f}")
     print("Write fasta.")
-    _ = fasta.write(zip(fasta_df.index, fasta_df.sequence),
-                    os.path.join(args.out_dir, f"entrapment_{today}.fasta"),
-                    file_mode="w")
+    compression = None if args.compression == "none" else args.compression
+    out_fasta = os.path.join(args.out_dir,
+                             f"entrapment_{today}.fasta{fastaio.COMPRESSIONS[compression]}")
+    # host and selected trap records are streamed from the fasta files through their index
+    with metrics.stage("write", items=len(fasta_df)), \
+            fastaio.FastaWriter(out_fasta, compression=compression, threads=args.threads,
+                                fai=args.fai) as writer:
+        for db_type, fasta_file in [("host", args.fasta_host), ("trap", args.fasta_trap)]:
+            records = fasta_df.loc[fasta_df["db_type"] == db_type, "fasta_record"].values
+            # with a memory budget the entrapment fasta is streamed, not indexed
+            writer.write_records(trapindex.select_records(
+                fasta_file, records, indexed=db_type == "host" or args.max_memory is None,
+                index_dir=args.fasta_index_dir if db_type == "trap" else None))
 
     end_time = time.time()
     print(f"Took {(end_time-start_time)/60.:.2f} minutes")
 
     # doing qc
     print("Perform qc.")
-    host_peptides = entrapment.digest_protein_df(fasta_df[fasta_df["db_type"] == "host"])
-    trap_peptides = entrapment.digest_protein_df(fasta_df[fasta_df["db_type"] == "trap"])
-
-    features_df_host = qc.compute_sequence_features(host_peptides)
-    features_df_host["Type"] = "host"
-
-    features_df_trap = qc.compute_sequence_features(trap_peptides)
-    features_df_trap["Type"] = "trap"
+    with metrics.stage("qc") as stage:
+        # the proteins were digested for the matching already, the features are summarized
+        # chunk-wise from the peptide buffers
+        summary = qc.summarize_peptide_arrays(result.iter_peptide_arrays("host"), "host")
+        qc.summarize_peptide_arrays(result.iter_peptide_arrays("trap"), "trap", summary)
+        summary.to_frame().to_csv(os.path.join(args.out_dir, "qc_summary.csv"), index=False)
+        qc.plot_summary(summary, args.out_dir, kind=args.qc_plot, formats=args.qc_format)
+        stage["items"] = sum(summary[db_type, "length"].count for db_type in summary.types)
 
-    qc.qc_peptides(features_df_host, features_df_trap, args.out_dir)
+    metrics["wall_time"] = time.time() - start_time
+    metrics.write(os.path.join(args.out_dir, "run_metrics.json"))
+    print(metrics.report())
+    if profiler is not None:
+        print(f"Stage profiles written to {args.out_dir}.")
     print("Done.")
 
 
@@ -0,0 +1,232 @@
+"""Module to plan a run within a memory budget and reduce nearest neighbors over trap chunks."""
+import re
+
+import numpy as np
+
+from pytrapment import fastaio, trapindex
+
+# approximate memory per unit, measured on synthetic proteomes (see benchmarks/bench_budget.py)
+# and rounded up. The base covers the interpreter and the imported libraries.
+BASE_BYTES = 160 * 2 ** 20
+# host proteins and the selected entrapment proteins: sequences, protein table, compositions,
+# peptides and their sorted keys
+HOST_BYTES_PER_RESIDUE = 12
+HOST_BYTES_PER_HEADER_BYTE = 4
+HOST_BYTES_PER_PROTEIN = 1024
+# a chunk of entrapment proteins: sequences, composition, peptides, keys and the fitted engine
+CHUNK_BYTES_PER_RESIDUE = 6
+CHUNK_BYTES_PER_PROTEIN = 768
+# all entrapment proteins: record sizes and shuffled ranks
+TRAP_BYTES_PER_PROTEIN = 40
+# nearest neighbor query temporaries per host protein
+QUERY_BYTES_PER_HOST = 4096
+# max_uses assigns over the compositions of all entrapment proteins at once
+ASSIGN_BYTES_PER_PROTEIN = 768
+
+# smallest chunk worth processing
+MIN_CHUNK_BYTES = 2 ** 22
+
+UNITS = {"": 1, "b": 1, "k": 2 ** 10, "m": 2 ** 20, "g": 2 ** 30, "t": 2 ** 40}
+
+
+def parse_memory(value):
+    """
+    Parse a memory size like 4G, 512MiB, 1.5gb or a plain number of bytes.
+
+    Args:
+        value: str or int, memory size (binary units)
+
+    Returns:
+        int, number of bytes
+    """
+    if isinstance(value, (int, np.integer)):
+        size = int(value)
+    else:
+        match = re.fullmatch(r"\s*(\d+(?:\.\d*)?)\s*([kmgt]?)(?:i?b)?\s*", str(value).lower())
+        if match is None:
+            raise ValueError(f"Cannot parse memory size '{value}', use e.g. 4G or 512M.")
+        size = int(float(match.group(1)) * UNITS[match.group(2)])
+    if size <= 0:
+        raise ValueError(f"Memory size must be positive, got {value}.")
+    return size
+
+
+def format_bytes(size):
+    """Format a number of bytes in MiB or GiB."""
+    if size < 2 ** 30:
+        return f"{size / 2 ** 20:.0f} MiB"
+    return f"{size / 2 ** 30:.2f} GiB"
+
+
+class MemoryBudgetError(ValueError):
+    """A stage does not fit into the memory budget."""
+
+
+class MemoryPlan:
+    """
+    Memory estimate of every stage and the entrapment chunks for a memory budget.
+
+    The host proteins stay in memory, the entrapment proteins are processed in chunks of
+    consecutive records. Chunks are sized so that the host, one chunk and the nearest neighbor
+    queries fit into the budget. The plan raises a MemoryBudgetError before any work is done if
+    a stage cannot fit.
+
+    Args:
+        max_bytes: int, memory budget
+        host_sizes: (ar, ar), residues and header bytes of every host protein
+        trap_sizes: (ar, ar), residues and header bytes of every entrapment protein
+        max_uses: int, the assignment with max_uses holds all entrapment compositions at once
+    """
+
+    def __init__(self, max_bytes, host_sizes, trap_sizes, max_uses=None):
+        """Estimate the stages and split the entrapment proteins into chunks."""
+        self.max_bytes = int(max_bytes)
+        host_lengths, host_headers = host_sizes
+        trap_lengths, _ = trap_sizes
+        self.n_host, self.n_trap = len(host_lengths), len(trap_lengths)
+
+        host_bytes = (HOST_BYTES_PER_RESIDUE * int(host_lengths.sum())
+                      + HOST_BYTES_PER_HEADER_BYTE * int(host_headers.sum())
+                      + HOST_BYTES_PER_PROTEIN * self.n_host)
+        self.fixed_bytes = BASE_BYTES + host_bytes + TRAP_BYTES_PER_PROTEIN * self.n_trap
+        self._check("keeping the host proteins", self.fixed_bytes,
+                    f"{self.n_host} proteins, {int(host_lengths.sum())} residues")
+
+        available = self.max_bytes - self.fixed_bytes
+        self.query_bytes = min(max(self.n_host, 1) * QUERY_BYTES_PER_HOST, available // 4)
+        self.query_rows = max(1, self.query_bytes // QUERY_BYTES_PER_HOST)
+        self.chunk_bytes = available - self.query_bytes
+        protein_bytes = CHUNK_BYTES_PER_RESIDUE * trap_lengths + CHUNK_BYTES_PER_PROTEIN
+        largest = int(protein_bytes.max()) if self.n_trap else 0
+        self._check("the smallest entrapment chunk", self.fixed_bytes + QUERY_BYTES_PER_HOST
+                    + max(largest, MIN_CHUNK_BYTES) * 4 // 3,
+                    f"the longest entrapment protein has {int(trap_lengths.max(initial=0))} "
+                    f"residues")
+        self.ends = self.chunk_ends(protein_bytes, self.chunk_bytes)
+
+        self.assign_bytes = 0
+        if max_uses is not None:
+            self.assign_bytes = ASSIGN_BYTES_PER_PROTEIN * self.n_trap
+            self._check("the assignment with max_uses",
+                        self.fixed_bytes + self.assign_bytes + self.query_bytes,
+                        f"compositions of {self.n_trap} entrapment proteins")
+
+    def _check(self, stage, required, detail):
+        """Raise a MemoryBudgetError if a stage needs more than the budget."""
+        if required > self.max_bytes:
+            raise MemoryBudgetError(
+                f"The memory budget of {format_bytes(self.max_bytes)} is too small: "
+                f"{stage} needs about {format_bytes(required)} ({detail}). Increase the budget "
+                f"to at least {format_bytes(required)}.")
+
+    @staticmethod
+    def chunk_ends(protein_bytes, chunk_bytes):
+        """
+        Split consecutive proteins into chunks of about chunk_bytes.
+
+        Args:
+            protein_bytes: ar, estimated bytes per protein
+            chunk_bytes: int, bytes per chunk (a chunk holds at least one protein)
+
+        Returns:
+            ar, int64 positions that end the chunks
+        """
+        if len(protein_bytes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts = np.cumsum(protein_bytes) - protein_bytes
+        chunk = starts // max(int(chunk_bytes), 1)
+        return np.append(np.flatnonzero(np.diff(chunk)) + 1, len(protein_bytes)).astype(np.int64)
+
+    @property
+    def n_chunks(self):
+        """Return the number of entrapment chunks."""
+        return len(self.ends)
+
+    @property
+    def peak_bytes(self):
+        """Return the estimated peak memory."""
+        return self.fixed_bytes + max(self.chunk_bytes + self.query_bytes,
+                                      self.assign_bytes + self.query_bytes)
+
+    def to_dict(self):
+        """Return the plan for the run metrics."""
+        return {"max_bytes": self.max_bytes, "fixed_bytes": self.fixed_bytes,
+                "chunk_bytes": self.chunk_bytes, "query_bytes": self.query_bytes,
+                "query_rows": self.query_rows, "n_chunks": self.n_chunks,
+                "assign_bytes": self.assign_bytes}
+
+    @classmethod
+    def from_files(cls, max_memory, fasta_host, fasta_trap, max_uses=None):
+        """
+        Plan a run from the host fasta and the entrapment fasta or prebuilt index.
+
+        The files are streamed once to count the residues, nothing else is kept in memory.
+
+        Args:
+            max_memory: str or int, memory budget (see parse_memory)
+            fasta_host: str, location of the host fasta file
+            fasta_trap: str, location of the entrapment fasta file or index directory
+            max_uses: int, maximal number of uses per entrapment protein (None: no limit)
+
+        Returns:
+            MemoryPlan
+        """
+        if trapindex.is_index(fasta_trap):
+            trap_index = trapindex.TrapIndex(fasta_trap)
+            trap_sizes = (np.diff(trap_index.sequence_offsets),
+                          np.diff(trap_index.header_offsets))
+        else:
+            trap_sizes = fastaio.record_sizes(fasta_trap)
+        return cls(parse_memory(max_memory), fastaio.record_sizes(fasta_host), trap_sizes,
+                   max_uses=max_uses)
+
+
+def shuffled_ranks(n, random_state=42):
+    """
+    Return the position of every record in the shuffled order (see SequenceStore.shuffle).
+
+    Args:
+        n: int, number of records
+        random_state: int, seed of the permutation
+
+    Returns:
+        ar, int64 rank of every record
+    """
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[np.random.RandomState(random_state).permutation(n)] = np.arange(n)
+    return ranks
+
+
+class BestNeighbors:
+    """
+    Running nearest entrapment protein of every host protein over chunks.
+
+    Ties are broken by the shuffled rank of the entrapment proteins, so the result equals a
+    single search over all entrapment proteins in shuffled order.
+
+    Args:
+        n_host: int, number of host proteins
+    """
+
+    def __init__(self, n_host):
+        """Start without neighbors."""
+        self.distances = np.full(n_host, np.inf)
+        self.ranks = np.full(n_host, np.iinfo(np.int64).max)
+        self.records = np.full(n_host, -1, dtype=np.int64)
+
+    def update(self, rows, distances, ranks, records):
+        """
+        Keep the closer neighbor (lower rank among ties) for a block of host proteins.
+
+        Args:
+            rows: slice or ar, host positions
+            distances: ar, distance of the chunk neighbor per host protein
+            ranks: ar, shuffled rank of the chunk neighbor
+            records: ar, record position of the chunk neighbor
+        """
+        old_distances, old_ranks = self.distances[rows], self.ranks[rows]
+        better = (distances < old_distances) | ((distances == old_distances)
+                                                & (ranks < old_ranks))
+        self.distances[rows] = np.where(better, distances, old_distances)
+        self.ranks[rows] = np.where(better, ranks, old_ranks)
+        self.records[rows] = np.where(better, records, self.records[rows])
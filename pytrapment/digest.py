@@ -0,0 +1,390 @@
+"""Module to digest proteins into peptide offsets, optionally in parallel processes."""
+import multiprocessing
+import secrets
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from pyteomics import parser
+
+from pytrapment import sequences
+
+# number of chunks per process, smaller chunks balance proteins of different lengths
+CHUNKS_PER_PROCESS = 4
+
+# cleavage rules evaluated on the byte buffer (named as in pyteomics.parser.expasy_rules):
+# "after" maps residues cleaved at their C-terminal side to the residues that block the
+# cleavage when they follow, "before" lists residues cleaved at their N-terminal side and
+# "exceptions" are (previous, residue, next) triplets cleaved despite a blocking residue
+CLEAVAGE_RULES = {
+    "trypsin": {"after": {"K": "P", "R": "P"}, "exceptions": ["WKP", "MRP"]},
+    "lysc": {"after": {"K": ""}},
+    "arg-c": {"after": {"R": ""}},
+    "clostripain": {"after": {"R": ""}},
+    "asp-n": {"before": "D"},
+    "formic acid": {"after": {"D": ""}},
+    "glutamyl endopeptidase": {"after": {"E": ""}},
+    "cnbr": {"after": {"M": ""}},
+    "bnps-skatole": {"after": {"W": ""}},
+    "iodosobenzoic acid": {"after": {"W": ""}},
+    "chymotrypsin high specificity": {"after": {"F": "P", "Y": "P", "W": "MP"}},
+}
+
+
+def _to_shared(array, name=None):
+    """Copy an array into a new shared memory block (with a random name if name is None)."""
+    block = shared_memory.SharedMemory(name=name, create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block
+
+
+def _attach(name, shape, dtype):
+    """Attach to a shared memory block, returns the block and an array view on it."""
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _unlink(name):
+    """Remove a shared memory block by name if it exists."""
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
+def _residues(letters):
+    """Convert residue letters to their byte codes."""
+    return np.frombuffer(letters.encode("ascii"), dtype=np.uint8)
+
+
+def cleavage_sites(buffer, offsets, rule="trypsin"):
+    """
+    Find the cleavage sites of all proteins in a concatenated buffer.
+
+    Args:
+        buffer: ar, uint8 residues of all proteins
+        offsets: ar, int64 protein offsets of length n+1
+        rule: str or dict, name in CLEAVAGE_RULES or a rule with after/before/exceptions
+
+    Returns:
+        ar, int64 buffer offsets of the cuts (protein starts and ends are no sites)
+    """
+    rule = CLEAVAGE_RULES[rule] if isinstance(rule, str) else rule
+    # neighbors across protein borders do not count, the borders themselves are no sites
+    nonempty = np.flatnonzero(np.diff(offsets) > 0)
+    first = np.zeros(len(buffer), dtype=bool)
+    first[offsets[nonempty]] = True
+    last = np.zeros(len(buffer), dtype=bool)
+    last[offsets[nonempty + 1] - 1] = True
+
+    following = np.append(buffer[1:], np.uint8(0))
+    preceding = np.insert(buffer[:-1], 0, np.uint8(0))
+    cut_after = np.zeros(len(buffer), dtype=bool)
+    for residue, blockers in rule.get("after", {}).items():
+        cut_after |= (buffer == ord(residue)) & ~np.isin(following, _residues(blockers))
+    for previous, residue, next_residue in rule.get("exceptions", []):
+        cut_after |= (preceding == ord(previous)) & (buffer == ord(residue)) & \
+            (following == ord(next_residue)) & ~first
+    cut_after &= ~last
+    cut_before = np.isin(buffer, _residues(rule.get("before", ""))) & ~first
+    return np.union1d(np.flatnonzero(cut_after) + 1, np.flatnonzero(cut_before))
+
+
+def enumerate_peptides(buffer, offsets, rule="trypsin", missed_cleavages=0, min_length=6,
+                       max_length=None):
+    """
+    Enumerate the peptides of all proteins as offset pairs without building strings.
+
+    Args:
+        buffer: ar, uint8 residues of all proteins
+        offsets: ar, int64 protein offsets of length n+1
+        rule: str or dict, name in CLEAVAGE_RULES or a rule with after/before/exceptions
+        missed_cleavages: int, maximal number of missed cleavages
+        min_length: int, minimal length for a peptide
+        max_length: int, maximal length for a peptide (None: no limit)
+
+    Returns:
+        (proteins, starts, ends), int64 arrays with the protein position and the peptide
+        start/end offsets in the buffer (every occurrence, sorted by protein and start)
+    """
+    sites = cleavage_sites(buffer, offsets, rule)
+    n_proteins = len(offsets) - 1
+    # protein borders and cleavage sites, sorted by protein and offset
+    borders = np.concatenate([offsets[:-1], sites, offsets[1:]])
+    border_proteins = np.concatenate([np.arange(n_proteins),
+                                      np.searchsorted(offsets, sites, side="right") - 1,
+                                      np.arange(n_proteins)])
+    order = np.lexsort((borders, border_proteins))
+    borders, border_proteins = borders[order], border_proteins[order]
+
+    max_length = np.inf if max_length is None else max_length
+    proteins, starts, ends = [], [], []
+    for missed in range(missed_cleavages + 1):
+        first, last = np.arange(len(borders) - missed - 1), np.arange(missed + 1, len(borders))
+        lengths = borders[last] - borders[first]
+        valid = (border_proteins[first] == border_proteins[last]) & (lengths > 0) & \
+            (lengths >= min_length) & (lengths <= max_length)
+        proteins.append(border_proteins[first[valid]])
+        starts.append(borders[first[valid]])
+        ends.append(borders[last[valid]])
+    proteins, starts, ends = (np.concatenate(values) for values in (proteins, starts, ends))
+    order = np.lexsort((ends, starts, proteins))
+    return proteins[order], starts[order], ends[order]
+
+
+def _regex_offsets(buffer, offsets, rule, missed_cleavages, min_length, max_length):
+    """Enumerate peptide offsets with pyteomics for rules not in CLEAVAGE_RULES."""
+    proteins, starts, ends = [], [], []
+    for position in range(len(offsets) - 1):
+        protein_start = int(offsets[position])
+        sequence = buffer[protein_start:offsets[position + 1]].tobytes().decode("ascii")
+        # the same peptide may be reported twice at the protein end
+        found = {(start, start + len(peptide)) for start, peptide in parser.icleave(
+            sequence, rule, missed_cleavages, min_length, max_length)}
+        for start, end in sorted(found):
+            proteins.append(position)
+            starts.append(protein_start + start)
+            ends.append(protein_start + end)
+    return tuple(np.array(values, dtype=np.int64) for values in (proteins, starts, ends))
+
+
+def cleave_offsets(buffer, offsets, first=0, last=None, rule="trypsin", min_length=6,
+                   missed_cleavages=0, max_length=None):
+    """
+    Digest a range of proteins into peptide offsets.
+
+    Rules in CLEAVAGE_RULES (or given as dict) are evaluated with numpy, all other rules are
+    passed to pyteomics (regular expression or name of a pyteomics rule).
+
+    Args:
+        buffer: ar, uint8 residues of all proteins
+        offsets: ar, int64 protein offsets of length n+1
+        first: int, position of the first protein to digest
+        last: int, position after the last protein to digest (None: all proteins)
+        rule: str or dict, cleavage rule
+        min_length: int, minimal length for a peptide
+        missed_cleavages: int, maximal number of missed cleavages
+        max_length: int, maximal length for a peptide (None: no limit)
+
+    Returns:
+        (proteins, starts, ends), int64 arrays with the protein position and the peptide
+        start/end offsets in the buffer (every occurrence)
+    """
+    last = len(offsets) - 1 if last is None else last
+    range_offsets = offsets[first:last + 1] - offsets[first]
+    range_buffer = buffer[offsets[first]:offsets[last]]
+    if isinstance(rule, dict) or rule in CLEAVAGE_RULES:
+        proteins, starts, ends = enumerate_peptides(range_buffer, range_offsets, rule,
+                                                    missed_cleavages, min_length, max_length)
+    else:
+        proteins, starts, ends = _regex_offsets(range_buffer, range_offsets, rule,
+                                                missed_cleavages, min_length, max_length)
+    return proteins + first, starts + offsets[first], ends + offsets[first]
+
+
+def _digest_chunk(task):
+    """Digest one chunk of proteins in a worker, the result is returned in shared memory."""
+    buffer_name, offsets_name, n_residues, n_proteins, first, last, params, result_name = task
+    buffer_block, buffer = _attach(buffer_name, (n_residues,), np.uint8)
+    offsets_block, offsets = _attach(offsets_name, (n_proteins + 1,), np.int64)
+    try:
+        result = np.stack(cleave_offsets(buffer, offsets, first, last, **params))
+    finally:
+        del buffer, offsets
+        buffer_block.close()
+        offsets_block.close()
+    result_block = _to_shared(result, name=result_name)
+    result_block.close()
+    return result.shape[1]
+
+
+def digest(buffer, offsets, rule="trypsin", min_length=6, processes=1, missed_cleavages=0,
+           max_length=None):
+    """
+    Digest proteins into peptide offsets.
+
+    With several processes the proteins are split into chunks of similar residue counts. The
+    workers read the proteins from shared memory and return their flat offset arrays in shared
+    memory blocks, no python objects are pickled.
+
+    Args:
+        buffer: ar, uint8 residues of all proteins
+        offsets: ar, int64 protein offsets of length n+1
+        rule: str or dict, cleavage rule (see cleave_offsets)
+        min_length: int, minimal length for a peptide
+        processes: int, number of worker processes (1: digest in this process)
+        missed_cleavages: int, maximal number of missed cleavages
+        max_length: int, maximal length for a peptide (None: no limit)
+
+    Returns:
+        (proteins, starts, ends), int64 arrays with the protein position and the peptide
+        start/end offsets in the buffer (every occurrence)
+    """
+    n_proteins = len(offsets) - 1
+    params = {"rule": rule, "min_length": min_length, "missed_cleavages": missed_cleavages,
+              "max_length": max_length}
+    if processes <= 1 or n_proteins < 2:
+        # ranges of proteins bound the temporary arrays of the cleavage kernels
+        bounds = sequences.chunk_bounds(offsets)
+        if len(bounds) <= 2:
+            return cleave_offsets(buffer, offsets, **params)
+        chunks = [cleave_offsets(buffer, offsets, first, last, **params)
+                  for first, last in zip(bounds[:-1], bounds[1:])]
+        return tuple(np.concatenate(columns) for columns in zip(*chunks))
+
+    # chunk borders at (about) equal residue counts
+    n_chunks = min(n_proteins, processes * CHUNKS_PER_PROCESS)
+    bounds = np.unique(np.concatenate([
+        [0], np.searchsorted(offsets[:-1], np.linspace(0, offsets[-1], n_chunks + 1)),
+        [n_proteins]]))
+    # the result blocks are named up front, so the blocks of finished workers can be removed
+    # if another worker fails or the pool is interrupted
+    prefix = f"pt{secrets.token_hex(6)}"
+    result_names = [f"{prefix}_{ii}" for ii in range(len(bounds) - 1)]
+    buffer_block = _to_shared(np.ascontiguousarray(buffer, dtype=np.uint8))
+    offsets_block = _to_shared(np.ascontiguousarray(offsets, dtype=np.int64))
+    tasks = [(buffer_block.name, offsets_block.name, len(buffer), n_proteins, first, last, params,
+              name) for first, last, name in zip(bounds[:-1], bounds[1:], result_names)]
+    try:
+        try:
+            with multiprocessing.Pool(processes) as pool:
+                counts = pool.map(_digest_chunk, tasks)
+        finally:
+            for block in (buffer_block, offsets_block):
+                block.close()
+                block.unlink()
+
+        chunks = []
+        for name, count in zip(result_names, counts):
+            block, result = _attach(name, (3, count), np.int64)
+            chunks.append(result.copy())
+            del result
+            block.close()
+            block.unlink()
+    finally:
+        for name in result_names:
+            _unlink(name)
+    return tuple(np.concatenate(columns) for columns in zip(*chunks))
+
+
+def gather(buffer, starts, ends):
+    """
+    Copy peptides from a protein buffer into a concatenated peptide buffer.
+
+    Args:
+        buffer: ar, uint8 residues of all proteins
+        starts: ar, int64 peptide start offsets
+        ends: ar, int64 peptide end offsets
+
+    Returns:
+        (buffer, offsets), uint8 residues and int64 offsets of the peptides
+    """
+    lengths = ends - starts
+    peptide_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=peptide_offsets[1:])
+    peptide_buffer = np.empty(peptide_offsets[-1], dtype=np.uint8)
+    # ranges of peptides bound the int64 position arrays
+    bounds = sequences.chunk_bounds(peptide_offsets)
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        begin, end = peptide_offsets[first], peptide_offsets[last]
+        positions = np.repeat(starts[first:last] - peptide_offsets[first:last],
+                              lengths[first:last]) + np.arange(begin, end)
+        peptide_buffer[begin:end] = buffer[positions]
+    return peptide_buffer, peptide_offsets
+
+
+def digest_store(store, rule="trypsin", min_length=6, processes=1, missed_cleavages=0,
+                 max_length=None):
+    """
+    Digest the proteins of a sequence store into a concatenated peptide buffer.
+
+    Args:
+        store: SequenceStore, proteins
+        rule: str or dict, cleavage rule (see cleave_offsets)
+        min_length: int, minimal length for a peptide
+        processes: int, number of worker processes
+        missed_cleavages: int, maximal number of missed cleavages
+        max_length: int, maximal length for a peptide (None: no limit)
+
+    Returns:
+        (proteins, buffer, offsets), store position of every peptide and the peptides
+    """
+    buffer, offsets = gather(store.buffer, store.offsets[store.order],
+                             store.offsets[store.order + 1])
+    proteins, starts, ends = digest(buffer, offsets, rule, min_length, processes,
+                                    missed_cleavages, max_length)
+    return (proteins, *gather(buffer, starts, ends))
+
+
+def select_peptides(proteins, offsets, positions):
+    """
+    Look up the peptides of selected proteins in a digest sorted by protein.
+
+    Args:
+        proteins: ar, protein position of every peptide (sorted)
+        offsets: ar, int64 peptide offsets of length n+1
+        positions: ar, selected protein positions (repetitions are allowed)
+
+    Returns:
+        (rows, starts, ends), row in positions and start/end offsets of every selected peptide
+    """
+    first = np.searchsorted(proteins, positions, side="left")
+    counts = np.searchsorted(proteins, positions, side="right") - first
+    rows = np.repeat(np.arange(len(positions)), counts)
+    selected = np.repeat(first - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+    return rows, offsets[selected], offsets[selected + 1]
+
+
+def unique_peptides(buffer, offsets, proteins):
+    """
+    Mark the first occurrence of every peptide per protein (as drop_duplicates on strings).
+
+    Peptides are grouped by protein and 64-bit hash, only peptides that share both are compared
+    residue by residue.
+
+    Args:
+        buffer: ar, uint8 residues of the peptides
+        offsets: ar, int64 peptide offsets of length n+1
+        proteins: ar, protein of every peptide
+
+    Returns:
+        ar, bool mask of the peptides to keep
+    """
+    keep = np.ones(len(proteins), dtype=bool)
+    hashes = sequences.peptide_hashes(buffer, offsets)
+    # stable sort, the first occurrence comes first among equal (protein, hash) pairs
+    order = np.lexsort((hashes, proteins))
+    same = (proteins[order][1:] == proteins[order][:-1]) & (hashes[order][1:] == hashes[order][:-1])
+    group_starts = np.flatnonzero(np.diff(np.concatenate([[False], same, [False]]).astype(np.int8)))
+    for first, last in zip(group_starts[::2], group_starts[1::2]):
+        seen = set()
+        for peptide in order[first:last + 1]:
+            sequence = buffer[offsets[peptide]:offsets[peptide + 1]].tobytes()
+            keep[peptide] = sequence not in seen
+            seen.add(sequence)
+    return keep
+
+
+def peptide_table(buffer, ids, proteins, starts, ends, unique=True):
+    """
+    Build the peptide dataframe from peptide offsets, this creates the peptide strings.
+
+    Args:
+        buffer: ar, uint8 residues of all proteins
+        ids: ar, protein names
+        proteins: ar, protein position of every peptide
+        starts: ar, peptide start offsets
+        ends: ar, peptide end offsets
+        unique: bool, report every peptide once per protein (as parser.cleave)
+
+    Returns:
+        df, with protein and sequence columns
+    """
+    seqs = [buffer[start:end].tobytes().decode("ascii") for start, end in zip(starts, ends)]
+    peptide_df = pd.DataFrame({"protein": proteins, "sequence": seqs})
+    if unique:
+        peptide_df = peptide_df.drop_duplicates(ignore_index=True)
+    peptide_df["protein"] = np.asarray(ids)[peptide_df["protein"].values]
+    return peptide_df
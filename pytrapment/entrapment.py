@@ -1,106 +1,472 @@
 """Module to perform QC on the xiRT performance."""
+import copy
+
 import numpy as np
 import pandas as pd
-from pyteomics import fasta, parser
-from scipy.spatial import distance
 
+from pytrapment import (budget, digest, fastaio, neighbors, peptides, runmetrics, sequences,
+                        trapindex)
+
+# number of proteins per chunk of the peptide tables for the QC
+CHUNK_PROTEINS = 2 ** 14
 
-def compute_composition_df(seq_df):
+
+def compute_composition_df(seq_df, nonstandard="ignore"):
     """
     Compute the composition matrix for all proteins.
 
     Args:
-        seq_df:  df, dataframe with sequences
+        seq_df:  df or SequenceStore, dataframe with sequences
+        nonstandard: str, policy for X/B/Z/U/O (see sequences.composition_matrix)
 
     Returns:
-        df, with the composition of the proteins
+        df, with the composition of the proteins (columns in std_amino_acids order)
     """
-    # get composition table
-    df_seq_comp = pd.DataFrame(
-        list(seq_df["sequence"].apply(parser.amino_acid_composition).values)) * 1.0
-
-    # add column with 0s for amino acids that didnt occur in the protein fasta file
-    for i in parser.std_amino_acids:
-        if i not in df_seq_comp.columns:
-            df_seq_comp[i] = 0
+    if isinstance(seq_df, sequences.SequenceStore):
+        composition, index = seq_df.composition(nonstandard=nonstandard), seq_df.ids
+    else:
+        buffer, offsets = sequences.encode_sequences(seq_df["sequence"].values)
+        composition = sequences.composition_matrix(buffer, offsets, nonstandard=nonstandard)
+        index = seq_df.index
+    return pd.DataFrame(composition, index=index,
+                        columns=sequences.composition_columns(nonstandard))
 
-    df_seq_comp = df_seq_comp.fillna(0.0)
-    df_seq_comp.index = seq_df.index
-    return df_seq_comp
 
-
-def get_nearest_neighbor_proteins(fasta_host, fasta_trap):
+def get_nearest_neighbor_proteins(fasta_host, fasta_trap, engine="kdtree", max_uses=None,
+                                  bloom_fp_rate=None, metrics=None, processes=1,
+                                  max_memory=None, fasta_index_dir=None):
     """
     Retrieve the nearest neighbors for all proteins in the host fasta.
 
     Args:
-        fasta_host:
-        fasta_trap:
+        fasta_host: str, location of the host fasta file (plain or compressed)
+        fasta_trap: str, location of the entrapment fasta file (plain or compressed) or of a
+            prebuilt index directory (see trapindex.build_index)
+        engine: str or engine instance, nearest neighbor engine (see neighbors.ENGINES), a
+            prebuilt index uses its own engine unless max_uses is set
+        max_uses: int, use each trap protein for at most max_uses host proteins (None: no limit)
+        bloom_fp_rate: float, false-positive rate of the bloom filter that prefilters the trap
+            peptides before the exact host peptide lookup (None: no prefilter)
+        metrics: RunMetrics or dict, receives the run metrics (stage timings, bloom filter size
+            and false-positive rate), a RunMetrics is updated in place
+        processes: int, number of processes used for the digestion
+        max_memory: str or int, memory budget, the entrapment proteins are processed in chunks
+            that fit into it (e.g. '4G', None: all at once, see budget.MemoryPlan)
+        fasta_index_dir: str, directory to keep the offset index of a plain entrapment fasta
+            for later runs (None: the index is only held in memory, see fastaio.load_store)
 
     Returns:
         df, dataframe with proteins for host and entrapment database.
     """
+    return match_proteins(fasta_host, fasta_trap, engine=engine, max_uses=max_uses,
+                          bloom_fp_rate=bloom_fp_rate, metrics=metrics, processes=processes,
+                          max_memory=max_memory, fasta_index_dir=fasta_index_dir).proteins
+
+
+def match_proteins(fasta_host, fasta_trap, engine="kdtree", max_uses=None, bloom_fp_rate=None,
+                   metrics=None, processes=1, max_memory=None, fasta_index_dir=None):
+    """
+    Retrieve the nearest neighbors for all proteins in the host fasta and keep the digests.
+
+    Args:
+        fasta_host: str, location of the host fasta file (plain or compressed)
+        fasta_trap: str, location of the entrapment fasta file (plain or compressed) or of a
+            prebuilt index directory (see trapindex.build_index)
+        engine: str or engine instance, nearest neighbor engine (see neighbors.ENGINES), a
+            prebuilt index uses its own engine unless max_uses is set
+        max_uses: int, use each trap protein for at most max_uses host proteins (None: no limit)
+        bloom_fp_rate: float, false-positive rate of the bloom filter that prefilters the trap
+            peptides before the exact host peptide lookup (None: no prefilter)
+        metrics: RunMetrics or dict, receives the run metrics (stage timings, bloom filter size
+            and false-positive rate), a RunMetrics is updated in place
+        processes: int, number of processes used for the digestion
+        max_memory: str or int, memory budget, the entrapment proteins are processed in chunks
+            that fit into it (e.g. '4G', None: all at once, see budget.MemoryPlan). Raises a
+            budget.MemoryBudgetError before the matching if a stage cannot fit.
+        fasta_index_dir: str, directory to keep the offset index of a plain entrapment fasta
+            for later runs (None: the index is only held in memory, see fastaio.load_store)
+
+    Returns:
+        MatchResult, proteins for host and entrapment database with their peptides
+    """
+    run_metrics = metrics if isinstance(metrics, runmetrics.RunMetrics) else \
+        runmetrics.RunMetrics()
+    plan = None
+    if max_memory is not None:
+        # the files are measured first, so a run that cannot fit stops before the matching
+        with run_metrics.stage("plan"):
+            plan = budget.MemoryPlan.from_files(max_memory, fasta_host, fasta_trap,
+                                                max_uses=max_uses)
+        run_metrics["memory_plan"] = plan.to_dict()
     # make nearest neighbor thing
-    # ger protein table
-    df_prot_host = fasta2dataframe(fasta_host)
-    df_comp_host = compute_composition_df(df_prot_host)
-    df_peptides_host = digest_protein_df(df_prot_host)
-
-    df_prot_trap = fasta2dataframe(fasta_trap)
-    df_comp_trap = compute_composition_df(df_prot_trap)
-    df_peptides_trap = digest_protein_df(df_prot_trap)
-
-    # perform the filtering
-    df_comp_trap, df_prot_trap = filter_trap_fasta(df_prot_trap, df_comp_trap,
-                                                   df_peptides_trap, df_peptides_host)
-
-    # get best human protein matching by euclidean distance
-    neighbor = []
-    distances = np.zeros(df_comp_host.shape[0])
-    for ii, row in enumerate(df_comp_host.iterrows()):
-        # compute the distance from the query (current row) to all other proteins in the
-        # trap database
-        ary = distance.cdist(df_comp_trap, pd.DataFrame(row[1]).transpose(), metric='euclidean')
-        # retrieve minimal disance entry here and use the index as neighbor and include
-        # it to the fasta df later
-        neighbor.append(df_comp_trap[ary == ary.min()].index.values[0])
-        distances[ii] = ary.min()
-    # print identifier for id mapping
-    # neighbors = [i.split("|")[1] for i in np.ravel(neighbor)]
-    fasta_df_entrapment = df_prot_trap.loc[neighbor]
+    # ger protein table, the trap proteins stay in a compact sequence store
+    with run_metrics.stage("parse") as stage:
+        store_host = fastaio.load_store(fasta_host).shuffle(random_state=42)
+        df_prot_host = store_host.to_dataframe()
+        # position of the record in the host fasta to write it without parsing
+        df_prot_host["fasta_record"] = store_host.order
+        stage["items"] = len(store_host)
+    with run_metrics.stage("composition", items=len(store_host)):
+        df_comp_host = compute_composition_df(store_host)
+
+    if plan is not None:
+        store_trap, trap_records, distances, indices, host_peptides, trap_peptides = \
+            _match_chunked(store_host, df_comp_host, fasta_trap, plan, engine, max_uses,
+                           bloom_fp_rate, run_metrics, processes)
+        keep = np.arange(len(store_trap))
+    elif trapindex.is_index(fasta_trap):
+        # prebuilt index, the host-specific filter only excludes trap proteins at query time
+        with run_metrics.stage("index_load") as stage:
+            trap_index = trapindex.TrapIndex(fasta_trap)
+            store_trap, trap_records = trap_index.store, trap_index.fasta_record
+            # the memory-mapped matrix, the headers are only decoded for the selected proteins
+            trap_matrix = trap_index.composition
+            stage["items"] = len(trap_index)
+        with run_metrics.stage("digestion", items=len(store_host)):
+            host_peptides = digest.digest_store(store_host, rule=trap_index.meta["rule"],
+                                                min_length=trap_index.meta["min_length"],
+                                                processes=processes)
+        trap_peptides = (trap_index.peptide_proteins, trap_index.peptide_buffer,
+                         trap_index.peptide_offsets)
+        with run_metrics.stage("filtering", items=len(trap_peptides[0])):
+            excluded = trap_index.excluded_by(*host_peptides[1:], bloom_fp_rate=bloom_fp_rate,
+                                              metrics=run_metrics)
+        _check_remaining(len(store_trap) - int(excluded.sum()), len(store_host))
+        keep = np.arange(len(store_trap))
+        nn_engine = trap_index.engine
+    else:
+        # the trap fasta is read through its offset index, store positions are record positions
+        with run_metrics.stage("parse") as stage:
+            store_trap = fastaio.load_store(fasta_trap, index_dir=fasta_index_dir).shuffle(
+                random_state=42)
+            stage["items"] = len(store_trap)
+        # the headers are only decoded for the selected proteins
+        with run_metrics.stage("composition", items=len(store_trap)):
+            trap_matrix = store_trap.composition(nonstandard="ignore")
+        # peptides stay offsets into the protein buffers, no peptide strings are built
+        with run_metrics.stage("digestion", items=len(store_host) + len(store_trap)):
+            host_peptides = digest.digest_store(store_host, processes=processes)
+            trap_peptides = digest.digest_store(store_trap, processes=processes)
+
+        # perform the filtering
+        with run_metrics.stage("filtering", items=len(trap_peptides[0])):
+            shared = peptides.shared_peptides(*trap_peptides[1:], *host_peptides[1:],
+                                              bloom_fp_rate=bloom_fp_rate, metrics=run_metrics)
+            keep = np.flatnonzero(np.bincount(trap_peptides[0][shared],
+                                              minlength=len(store_trap)) == 0)
+            trap_matrix, store_trap = trap_matrix[keep], store_trap.take(keep)
+        _check_remaining(len(store_trap), len(store_host))
+        trap_records, excluded = store_trap.order, None
+        nn_engine = neighbors.get_engine(engine)
+
+    # the chunked matching searched the neighbors chunk by chunk already
+    if plan is None:
+        # get best human protein matching by euclidean distance, the engine is built once
+        # over the trap proteins and queried with all host proteins in one batch
+        with run_metrics.stage("nn_search", items=len(df_comp_host)):
+            if max_uses is not None:
+                allowed = np.arange(len(store_trap)) if excluded is None else \
+                    np.flatnonzero(~excluded)
+                distances, indices = neighbors.assign_unique(df_comp_host.values,
+                                                             trap_matrix[allowed],
+                                                             engine=engine, max_uses=max_uses)
+                indices = allowed[indices]
+            elif excluded is None:
+                nn_engine.fit(trap_matrix)
+                distances, indices = (x[:, 0] for x in nn_engine.kneighbors(
+                    df_comp_host.values, k=1))
+            else:
+                distances, indices = (x[:, 0] for x in neighbors.kneighbors_excluding(
+                    nn_engine, df_comp_host.values, trap_matrix, excluded, k=1))
+    # composition rows and store records share the same order
+    fasta_df_entrapment = store_trap.take(indices).to_dataframe()
     # store seed-neighbor pairs
     fasta_df_entrapment["host_seed"] = df_comp_host.index
+    fasta_df_entrapment["distance"] = distances
+    fasta_df_entrapment["fasta_record"] = trap_records[indices]
 
     final_fasta_df = pd.concat([df_prot_host, fasta_df_entrapment])
     final_fasta_df["db_type"] = ["host"] * len(df_prot_host) + ["trap"] * len(fasta_df_entrapment)
-    return final_fasta_df
+    if metrics is not None and metrics is not run_metrics:
+        metrics.update(run_metrics)
+    # digested trap proteins are addressed by their position before the filtering
+    return MatchResult(final_fasta_df, host_peptides, trap_peptides, keep[indices],
+                       metrics=run_metrics)
+
+
+def _check_remaining(n_trap, n_host):
+    """Raise a ValueError if the peptide filter removed every entrapment protein."""
+    if n_host > 0 and n_trap == 0:
+        raise ValueError("All entrapment proteins share a peptide with the host proteins.")
+
+
+def _trap_chunks(fasta_trap, plan, run_metrics, rule="trypsin", min_length=6, processes=1):
+    """
+    Iterate over the entrapment proteins in the chunks of a memory plan.
+
+    Fasta files are streamed and every chunk is digested, prebuilt indices are read from their
+    memory-mapped arrays.
+
+    Args:
+        fasta_trap: str, location of the entrapment fasta file or index directory
+        plan: MemoryPlan, chunks of the entrapment proteins
+        run_metrics: RunMetrics, receives the stage timings
+        rule: str, pyteomics string identifier for the digestion
+        min_length: int, minimal length for a peptide
+        processes: int, number of processes used for the digestion
+
+    Returns:
+        generator of (ranks, records, composition, peptides), shuffled rank, record position and
+        composition of the chunk proteins and their peptides as (proteins, buffer, offsets,
+        keys)
+    """
+    starts = np.concatenate([[0], plan.ends[:-1]])
+    if trapindex.is_index(fasta_trap):
+        trap_index = trapindex.TrapIndex(fasta_trap)
+        for start, end in zip(starts, plan.ends):
+            with run_metrics.stage("index_load", items=end - start):
+                first, last = np.searchsorted(trap_index.peptide_proteins, [start, end])
+                chunk_peptides = (np.asarray(trap_index.peptide_proteins[first:last]) - start,
+                                  trap_index.peptide_buffer,
+                                  np.asarray(trap_index.peptide_offsets[first:last + 1]),
+                                  np.asarray(trap_index.peptide_keys[first:last]))
+                chunk = (np.arange(start, end), np.asarray(trap_index.fasta_record[start:end]),
+                         np.asarray(trap_index.composition[start:end]), chunk_peptides)
+            yield chunk
+        return
+
+    ranks = budget.shuffled_ranks(plan.n_trap)
+    chunks = fastaio.iter_sequence_chunks(fasta_trap, plan.ends)
+    for start, end in zip(starts, plan.ends):
+        with run_metrics.stage("parse", items=end - start):
+            _, buffer, offsets = next(chunks)
+        with run_metrics.stage("composition", items=end - start):
+            composition = sequences.composition_matrix(buffer, offsets, nonstandard="ignore")
+        with run_metrics.stage("digestion", items=end - start):
+            proteins, pep_starts, pep_ends = digest.digest(buffer, offsets, rule=rule,
+                                                           min_length=min_length,
+                                                           processes=processes)
+            pep_buffer, pep_offsets = digest.gather(buffer, pep_starts, pep_ends)
+            keys = peptides.peptide_keys(pep_buffer, pep_offsets)
+            # only the peptide buffer is kept while the chunk is searched
+            del buffer, pep_starts, pep_ends
+        yield (ranks[start:end], np.arange(start, end), composition,
+               (proteins, pep_buffer, pep_offsets, keys))
+
+
+def _match_chunked(store_host, df_comp_host, fasta_trap, plan, engine, max_uses, bloom_fp_rate,
+                   run_metrics, processes):
+    """
+    Match the host proteins against the entrapment proteins chunk by chunk (see match_proteins).
 
+    Every chunk is filtered against the host peptides and searched, the nearest neighbor of
+    every host protein is reduced over the chunks. Only the selected entrapment proteins are
+    loaded and digested at the end. The chunks are searched with a copy of the engine, the
+    recall of an approximate engine is combined over all chunks and stored as its ``recall_``.
 
-def filter_trap_fasta(df_prot_trap, df_comp_trap, df_peptides_trap, df_peptides_host):
+    Returns:
+        tuple, the selected entrapment proteins (SequenceStore), their record positions, the
+        distance and store position of the neighbor of every host protein, the host and the
+        selected entrapment peptides
+    """
+    rule, min_length = "trypsin", 6
+    if trapindex.is_index(fasta_trap):
+        meta = trapindex.TrapIndex(fasta_trap).meta
+        rule, min_length = meta["rule"], meta["min_length"]
+    with run_metrics.stage("digestion", items=len(store_host)):
+        host_peptides = digest.digest_store(store_host, rule=rule, min_length=min_length,
+                                            processes=processes)
+    # the host keys are sorted once for all chunks
+    lookup = peptides.PeptideLookup(*host_peptides[1:], bloom_fp_rate=bloom_fp_rate)
+    host = df_comp_host.values.astype(np.float64)
+    # the chunks are searched with a copy, the budget of the passed engine is not changed
+    nn_engine = copy.copy(neighbors.get_engine(engine))
+    if hasattr(nn_engine, "memory_budget"):
+        # the distance tiles of the brute-force engines are part of the query budget
+        nn_engine.memory_budget = min(nn_engine.memory_budget, plan.query_bytes)
+    if getattr(nn_engine, "recall_sample", 0) > 0:
+        # every query block samples its share of the host proteins for the recall
+        nn_engine.recall_sample = max(1, -(-nn_engine.recall_sample * plan.query_rows
+                                           // max(len(host), 1)))
+    recall_hits, recall_total = 0, 0
+
+    best, kept, n_allowed = budget.BestNeighbors(len(host)), [], 0
+    for ranks, records, composition, (proteins, buffer, offsets, keys) in _trap_chunks(
+            fasta_trap, plan, run_metrics, rule, min_length, processes):
+        with run_metrics.stage("filtering", items=len(keys)):
+            shared = lookup.shared(buffer, offsets, query_keys=keys)
+            allowed = np.flatnonzero(np.bincount(proteins[shared], minlength=len(ranks)) == 0)
+            # shuffled order, the engines break ties by position
+            allowed = allowed[np.argsort(ranks[allowed])]
+            ranks, records, composition = ranks[allowed], records[allowed], composition[allowed]
+            n_allowed += len(allowed)
+        if max_uses is not None:
+            kept.append((ranks, records, composition))
+        elif len(ranks) > 0:
+            with run_metrics.stage("nn_search", items=len(host)):
+                nn_engine.fit(composition)
+                for start in range(0, len(host), plan.query_rows):
+                    rows = slice(start, start + plan.query_rows)
+                    distances, indices = (x[:, 0] for x in nn_engine.kneighbors(host[rows], k=1))
+                    best.update(rows, distances, ranks[indices], records[indices])
+                    if hasattr(nn_engine, "recall_counts_"):
+                        recall_hits += nn_engine.recall_counts_[0]
+                        recall_total += nn_engine.recall_counts_[1]
+    lookup.update_metrics(run_metrics)
+    _check_remaining(n_allowed, len(host))
+    if recall_total > 0 and not isinstance(engine, str):
+        # recall over the queries of all chunks, not only the last one
+        engine.recall_ = recall_hits / recall_total
+
+    if max_uses is not None and kept:
+        # the assignment is global, it runs once over the remaining proteins of all chunks
+        with run_metrics.stage("nn_search", items=len(host)):
+            ranks, records, composition = (np.concatenate(x) for x in zip(*kept))
+            order = np.argsort(ranks)
+            best.distances, indices = neighbors.assign_unique(host, composition[order],
+                                                              engine=engine, max_uses=max_uses)
+            best.records = records[order][indices]
+
+    with run_metrics.stage("parse") as stage:
+        trap_records, indices = np.unique(best.records, return_inverse=True)
+        selected = list(trapindex.select_records(fasta_trap, trap_records, indexed=False))
+        store_trap = sequences.SequenceStore.from_bytes([header for header, _ in selected],
+                                                        [sequence for _, sequence in selected])
+        stage["items"] = len(store_trap)
+    with run_metrics.stage("digestion", items=len(store_trap)):
+        trap_peptides = digest.digest_store(store_trap, rule=rule, min_length=min_length,
+                                            processes=processes)
+    return store_trap, trap_records, best.distances, indices, host_peptides, trap_peptides
+
+
+class MatchResult:
+    """
+    Matched host and entrapment proteins together with the digests of both databases.
+
+    The peptides are stored as (proteins, buffer, offsets) with the position of the digested
+    protein for every peptide, sorted by protein (see digest.digest_store).
+
+    Args:
+        proteins: df, proteins for host and entrapment database (db_type column)
+        host_peptides: tuple, peptides of the host proteins (in the order of the host rows)
+        trap_peptides: tuple, peptides of the digested entrapment proteins
+        trap_positions: ar, position of every selected entrapment protein in trap_peptides
+        metrics: RunMetrics, stage metrics of the matching
+    """
+
+    def __init__(self, proteins, host_peptides, trap_peptides, trap_positions, metrics=None):
+        """Store the matching result."""
+        self.proteins = proteins
+        self.host_peptides = host_peptides
+        self.trap_peptides = trap_peptides
+        self.trap_positions = trap_positions
+        self.metrics = runmetrics.RunMetrics() if metrics is None else metrics
+
+    def peptide_df(self, db_type="host"):
+        """
+        Return the peptides of the host or of the selected entrapment proteins.
+
+        The result equals digest_protein_df on the protein rows of the db_type, a trap protein
+        selected for several host proteins contributes its peptides for every selection.
+
+        Args:
+            db_type: str, host or trap
+
+        Returns:
+            df, with protein and sequence columns
+        """
+        proteins, buffer, offsets, positions, ids = self._selection(db_type)
+        rows, starts, ends = digest.select_peptides(proteins, offsets, positions)
+        return digest.peptide_table(buffer, ids, rows, starts, ends)
+
+    def iter_peptide_dfs(self, db_type="host", chunk_size=CHUNK_PROTEINS):
+        """
+        Iterate over the peptides of the host or selected entrapment proteins in chunks.
+
+        Only the peptide strings of one chunk of proteins exist at a time.
+
+        Args:
+            db_type: str, host or trap
+            chunk_size: int, number of proteins per chunk
+
+        Returns:
+            generator of df, with protein and sequence columns
+        """
+        proteins, buffer, offsets, positions, ids = self._selection(db_type)
+        for start in range(0, len(positions), chunk_size):
+            rows, starts, ends = digest.select_peptides(proteins, offsets,
+                                                        positions[start:start + chunk_size])
+            yield digest.peptide_table(buffer, ids[start:start + chunk_size], rows, starts, ends)
+
+    def iter_peptide_arrays(self, db_type="host", chunk_size=CHUNK_PROTEINS):
+        """
+        Iterate over the peptides of the host or selected entrapment proteins as residue buffers.
+
+        The peptides are the rows of iter_peptide_dfs (every peptide once per protein), no
+        peptide strings are created.
+
+        Args:
+            db_type: str, host or trap
+            chunk_size: int, number of proteins per chunk
+
+        Returns:
+            generator of (ar, ar), uint8 residues and int64 offsets of the peptides of a chunk
+        """
+        proteins, buffer, offsets, positions, _ = self._selection(db_type)
+        for start in range(0, len(positions), chunk_size):
+            rows, starts, ends = digest.select_peptides(proteins, offsets,
+                                                        positions[start:start + chunk_size])
+            peptide_buffer, peptide_offsets = digest.gather(buffer, starts, ends)
+            keep = digest.unique_peptides(peptide_buffer, peptide_offsets, rows)
+            if not keep.all():
+                peptide_buffer, peptide_offsets = digest.gather(
+                    peptide_buffer, peptide_offsets[:-1][keep], peptide_offsets[1:][keep])
+            yield peptide_buffer, peptide_offsets
+
+    def _selection(self, db_type):
+        """Return the digest, the selected protein positions and their ids for a db_type."""
+        if db_type == "host":
+            (proteins, buffer, offsets), positions = self.host_peptides, None
+        elif db_type == "trap":
+            (proteins, buffer, offsets), positions = self.trap_peptides, self.trap_positions
+        else:
+            raise ValueError(f"db_type must be host or trap, got {db_type}.")
+        ids = self.proteins.index[self.proteins["db_type"].values == db_type]
+        if positions is None:
+            positions = np.arange(len(ids))
+        return proteins, buffer, offsets, positions, ids
+
+
+def filter_trap_fasta(df_prot_trap, df_comp_trap, df_peptides_trap, df_peptides_host,
+                      bloom_fp_rate=None, metrics=None):
     """
     Remove proteins with peptides that also occur in the host database.
 
     Args:
-        df_comp_trap: df, protein entries from the entrapment database (composition)
+        df_comp_trap: df, protein entries from the entrapment database (composition, same row
+            order as df_prot_trap)
         df_peptides_host: df, peptides from the host fasta
         df_peptides_trap: df, peptides from the entrapment fasta
-        df_prot_trap: df, proteins from the entrapment database
+        df_prot_trap: df or SequenceStore, proteins from the entrapment database
+        bloom_fp_rate: float, false-positive rate of the bloom prefilter (None: no prefilter)
+        metrics: dict, receives size and measured false-positive rate of the bloom filter
 
     Returns:
         (df_comp_trap, df_prot_trap), returns a tuple of valid (unique) trapment ids.
     """
-    # make sure I/L witht he same mass doesnt mess with overlapping peptides
-    df_peptides_host["sequence"] = df_peptides_host["sequence"].str.replace("I", "L")
-    df_peptides_trap["sequence"] = df_peptides_trap["sequence"].str.replace("I", "L")
-
-    df_peptides_host = df_peptides_host.set_index("sequence")
-    df_peptides_trap = df_peptides_trap.set_index("sequence")
-    df_joined = df_peptides_trap.join(df_peptides_host, rsuffix="_host", lsuffix="_trap",
-                                      how="left")
-    blacklist_proteins_trap = df_joined.dropna(subset=["protein_host"])["protein_trap"].unique()
+    # compare I/L-normalized peptides (same mass) by their 64-bit keys
+    trap_buffer, trap_offsets = sequences.encode_sequences(df_peptides_trap["sequence"].values)
+    host_buffer, host_offsets = sequences.encode_sequences(df_peptides_host["sequence"].values)
+    shared = peptides.shared_peptides(trap_buffer, trap_offsets, host_buffer, host_offsets,
+                                      bloom_fp_rate=bloom_fp_rate, metrics=metrics)
+    blacklist_proteins_trap = np.unique(df_peptides_trap["protein"].values[shared])
     # drop proteins from dfs
-    df_prot_trap = df_prot_trap.drop(blacklist_proteins_trap)
-    df_comp_trap = df_comp_trap.drop(blacklist_proteins_trap)
+    blacklist = df_comp_trap.index.isin(blacklist_proteins_trap)
+    df_comp_trap = df_comp_trap[~blacklist]
+    if isinstance(df_prot_trap, sequences.SequenceStore):
+        df_prot_trap = df_prot_trap.take(np.flatnonzero(~blacklist))
+    else:
+        df_prot_trap = df_prot_trap[~blacklist]
     return df_comp_trap, df_prot_trap
 
 
@@ -110,43 +476,38 @@ def fasta2dataframe(FASTA):
 
     Parameters
     FASTA : str
-        Location of the FASTA file..
+        Location of the FASTA file (plain or gzip/bz2/xz/zstd compressed).
 
     Returns
         dataframe
     """
-    # store proteins and ids here
-    unique_proteins = []
-    unique_ids = []
-
-    with open(FASTA, mode='rt') as ffile:
-        for description, sequence in fasta.FASTA(ffile):
-            unique_proteins.append(sequence)
-            unique_ids.append(description)
-
-    # convert to dataframe
-    df = pd.DataFrame(unique_proteins)
-    df.columns = ["sequence"]
-    df["Type"] = "Protein"
-    df.index = unique_ids
-
-    # make sure ordering is lost
-    df = df.sample(frac=1, random_state=42)
-    return df
+    # keep sequences in a compact store and make sure ordering is lost
+    return fastaio.load_store(FASTA).shuffle(random_state=42).to_dataframe()
 
 
-def digest_protein_df(df_fasta, rule="trypsin", min_length=6):
+def digest_protein_df(df_fasta, rule="trypsin", min_length=6, processes=1, missed_cleavages=0,
+                      max_length=None):
     """
     Digest a dataframe of proteins into a dataframe with unique  peptides.
 
     Args:
-        df_fasta: df, dataframe with protein, sequence columns
-        rule: str, pyteomics string identifier
+        df_fasta: df or SequenceStore, dataframe with protein, sequence columns
+        rule: str or dict, cleavage rule (see digest.cleave_offsets)
         min_length: int, minimal length for a peptide
+        processes: int, number of worker processes (see digest.digest)
+        missed_cleavages: int, maximal number of missed cleavages
+        max_length: int, maximal length for a peptide (None: no limit)
 
     Returns:
         peptide_df with <protein_name:peptide> entries.
     """
-    # create all peptide sequences first
-    cleaved = df_fasta["sequence"].apply(parser.cleave, args=(rule,)).explode()
-    return cleaved[cleaved.apply(len) >= min_length].rename_axis("protein").reset_index()
+    if isinstance(df_fasta, sequences.SequenceStore):
+        buffer, offsets = digest.gather(df_fasta.buffer, df_fasta.offsets[df_fasta.order],
+                                        df_fasta.offsets[df_fasta.order + 1])
+        ids = df_fasta.ids
+    else:
+        buffer, offsets = sequences.encode_sequences(df_fasta["sequence"].values)
+        ids = df_fasta.index
+    # peptides are found as offsets, strings are built once for the table
+    return digest.peptide_table(buffer, ids, *digest.digest(
+        buffer, offsets, rule, min_length, processes, missed_cleavages, max_length))
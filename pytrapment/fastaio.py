@@ -0,0 +1,732 @@
+"""Module for indexed access to FASTA files, compressed input and streaming FASTA output."""
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import mmap
+import os
+import queue
+import struct
+import threading
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pytrapment import sequences
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# suffix of the sidecar index of a FASTA file
+INDEX_SUFFIX = ".pti"
+
+# version of the sidecar index layout, indices with a different version are rebuilt
+INDEX_VERSION = 1
+
+# bytes that are removed from the sequence lines of a record
+WHITESPACE = b" \t\r\n"
+
+# supported output compressions and their file suffixes
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# uncompressed bytes per BGZF block (as bgzip), a compressed block must stay below 64 KiB
+BGZF_BLOCK_SIZE = 0xff00
+# empty BGZF block that marks the end of a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# magic bytes of the supported input compressions
+MAGIC_BYTES = {b"\x1f\x8b": "gzip", b"BZh": "bz2", b"\xfd7zXZ\x00": "xz",
+               b"\x28\xb5\x2f\xfd": "zstd"}
+
+# size of the blocks read from (compressed) input files
+READ_BLOCK_SIZE = 2 ** 20
+
+
+def detect_compression(fasta_file):
+    """
+    Detect the compression of a file from its magic bytes.
+
+    Args:
+        fasta_file: str, location of the file
+
+    Returns:
+        str, 'gzip', 'bz2', 'xz', 'zstd' or None for uncompressed files
+    """
+    with open(fasta_file, mode="rb") as ffile:
+        head = ffile.read(6)
+    for magic, compression in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def _open_decompressor(fasta_file, compression):
+    """Open a decompressing binary stream."""
+    if compression == "gzip":
+        return gzip.open(fasta_file, mode="rb")
+    if compression == "bz2":
+        return bz2.open(fasta_file, mode="rb")
+    if compression == "xz":
+        return lzma.open(fasta_file, mode="rb")
+    if zstandard is None:  # pragma: no cover
+        raise ImportError("zstd compressed input requires the zstandard package.")
+    return zstandard.ZstdDecompressor().stream_reader(open(fasta_file, mode="rb"),
+                                                      closefd=True)
+
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Read a stream in a background thread through a bounded queue of blocks.
+
+    Used for compressed input, so decompression runs while the consumer parses the previous
+    blocks. The queue holds at most ``queue_size`` blocks.
+
+    Args:
+        raw: binary stream, e.g. a decompressing file object
+        block_size: int, number of bytes read per block
+        queue_size: int, maximal number of blocks waiting in the queue
+    """
+
+    def __init__(self, raw, block_size=READ_BLOCK_SIZE, queue_size=16):
+        """Init the reader and start the background thread."""
+        super().__init__()
+        self._raw = raw
+        self._block_size = block_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._current = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        """Put an item into the queue unless the reader was closed."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fill(self):
+        """Read blocks from the raw stream until it is exhausted."""
+        try:
+            while True:
+                block = self._raw.read(self._block_size)
+                if not self._put(block) or not block:
+                    break
+        except Exception as error:
+            # errors are raised in the consumer thread
+            self._put(error)
+
+    def readable(self):
+        """Return True, the stream is readable."""
+        return True
+
+    def readinto(self, buffer):
+        """Fill a buffer with the next bytes of the stream."""
+        while not self._current and not self._eof:
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            self._eof = not item
+            self._current = memoryview(item)
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+    def close(self):
+        """Stop the background thread and close the raw stream."""
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._raw.close()
+        super().close()
+
+
+def open_fasta(fasta_file, queue_size=16):
+    """
+    Open a plain or compressed (gzip, bz2, xz, zstd) FASTA file as binary stream.
+
+    Compressed files are decompressed in a background thread.
+
+    Args:
+        fasta_file: str, location of the FASTA file
+        queue_size: int, maximal number of decompressed blocks waiting to be parsed
+
+    Returns:
+        binary stream
+    """
+    compression = detect_compression(fasta_file)
+    if compression is None:
+        return open(fasta_file, mode="rb")
+    raw = _open_decompressor(fasta_file, compression)
+    return io.BufferedReader(ThreadedReader(raw, queue_size=queue_size),
+                             buffer_size=READ_BLOCK_SIZE)
+
+
+def _parse_record(raw):
+    """Split a raw record (without '>') into header and sequence."""
+    header_end = raw.find(b"\n")
+    if header_end == -1:
+        return raw.strip(), b""
+    return raw[:header_end].strip(), _clean_sequence(raw[header_end + 1:])
+
+
+def iter_records(stream, block_size=READ_BLOCK_SIZE):
+    """
+    Parse FASTA records from a binary stream block by block.
+
+    Args:
+        stream: binary stream, e.g. from open_fasta
+        block_size: int, number of bytes read per block
+
+    Returns:
+        generator of (bytes, bytes), header and sequence of every record
+    """
+    leftover, started = b"", False
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        data = leftover + block
+        if not started:
+            start = 0 if data[:1] == b">" else data.find(b"\n>")
+            if start == -1:
+                leftover = data[-1:]
+                continue
+            data, started = data[start + 1 if data[:1] == b">" else start + 2:], True
+        records = data.split(b"\n>")
+        leftover = records.pop()
+        for record in records:
+            yield _parse_record(record)
+    if started:
+        yield _parse_record(leftover)
+
+
+def index_location(fasta_file, index_dir):
+    """
+    Return the location of the sidecar index of a FASTA file in an index directory.
+
+    Args:
+        fasta_file: str, location of the FASTA file
+        index_dir: str, directory of the sidecar indices (None: no sidecar index)
+
+    Returns:
+        str or None, the file name holds a digest of the absolute FASTA location, so files with
+        the same name in different directories get different indices
+    """
+    if index_dir is None:
+        return None
+    digest = hashlib.sha1(os.path.abspath(fasta_file).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(index_dir, f"{os.path.basename(fasta_file)}.{digest}{INDEX_SUFFIX}")
+
+
+def load_store(fasta_file, index_dir=None):
+    """
+    Load all records of a plain or compressed FASTA file into a SequenceStore.
+
+    Plain files are read through their offset index (see IndexedFasta), compressed files are
+    parsed from a background decompression stream. In both cases the store positions are the
+    record positions in the file.
+
+    Args:
+        fasta_file: str, location of the FASTA file
+        index_dir: str, directory to keep the offset index of plain files for later runs
+            (None: the index is only held in memory)
+
+    Returns:
+        SequenceStore
+    """
+    if detect_compression(fasta_file) is None:
+        with IndexedFasta(fasta_file, index_file=index_location(fasta_file, index_dir)) as reader:
+            return reader.to_store()
+    headers, seqs = [], []
+    with open_fasta(fasta_file) as stream:
+        for header, sequence in iter_records(stream):
+            headers.append(header)
+            seqs.append(sequence)
+    return sequences.SequenceStore.from_bytes(headers, seqs)
+
+
+def select_records(fasta_file, records, indexed=True, index_dir=None):
+    """
+    Read selected records of a plain or compressed FASTA file.
+
+    Plain files are accessed through their offset index. Compressed files are streamed once,
+    only the selected records are kept in memory.
+
+    Args:
+        fasta_file: str, location of the FASTA file
+        records: ar, positions of the records (repetitions are allowed)
+        indexed: bool, access plain files through their offset index (False: stream them like
+            compressed files, no index is held in memory)
+        index_dir: str, directory to keep the offset index of plain files for later runs
+            (None: the index is only held in memory)
+
+    Returns:
+        generator of (bytes, bytes), header and sequence of every record in the given order
+    """
+    if indexed and detect_compression(fasta_file) is None:
+        with IndexedFasta(fasta_file, index_file=index_location(fasta_file, index_dir)) as reader:
+            yield from reader.records(records)
+        return
+    selected = set(int(record) for record in records)
+    with open_fasta(fasta_file) as stream:
+        found = {ii: record for ii, record in enumerate(iter_records(stream)) if ii in selected}
+    for record in records:
+        yield found[int(record)]
+
+
+def record_sizes(fasta_file):
+    """
+    Stream a plain or compressed FASTA file and count the residues and header bytes per record.
+
+    Only the sizes are kept, so large files can be measured before they are processed.
+
+    Args:
+        fasta_file: str, location of the FASTA file
+
+    Returns:
+        (ar, ar), int64 number of residues and header bytes of every record in file order
+    """
+    lengths, header_lengths = array("q"), array("q")
+    with open_fasta(fasta_file) as stream:
+        for header, sequence in iter_records(stream):
+            lengths.append(len(sequence))
+            header_lengths.append(len(header))
+    return (np.frombuffer(lengths, dtype=np.int64).copy(),
+            np.frombuffer(header_lengths, dtype=np.int64).copy())
+
+
+def _encode_bytes(seqs):
+    """Concatenate encoded sequences into a uint8 buffer with int64 offsets."""
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+    np.cumsum([len(sequence) for sequence in seqs], out=offsets[1:])
+    return np.frombuffer(b"".join(seqs), dtype=np.uint8), offsets
+
+
+def iter_sequence_chunks(fasta_file, ends):
+    """
+    Stream the sequences of a plain or compressed FASTA file in chunks of consecutive records.
+
+    Args:
+        fasta_file: str, location of the FASTA file
+        ends: ar, increasing record positions that end the chunks (the last one is the number
+            of records)
+
+    Returns:
+        generator of (int, ar, ar), first record position, uint8 residues and int64 offsets of
+        every chunk
+    """
+    seqs, first, chunk = [], 0, 0
+    with open_fasta(fasta_file) as stream:
+        for record, (_, sequence) in enumerate(iter_records(stream)):
+            seqs.append(sequence)
+            if record + 1 == ends[chunk]:
+                # the sequence list is released before the chunk is processed
+                buffer, offsets = _encode_bytes(seqs)
+                seqs = []
+                yield first, buffer, offsets
+                first, chunk = record + 1, chunk + 1
+    if seqs:
+        yield (first, *_encode_bytes(seqs))
+
+
+def _file_signature(fasta_file):
+    """Return size and modification time of a file to detect stale indices."""
+    stat = os.stat(fasta_file)
+    return np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def _clean_sequence(raw):
+    """Remove line breaks and the translation stop sign (as pyteomics.fasta.FASTA does)."""
+    sequence = raw.translate(None, WHITESPACE)
+    return sequence[:-1] if sequence.endswith(b"*") else sequence
+
+
+def build_fasta_index(fasta_file):
+    """
+    Scan a FASTA file for the byte offsets of all records.
+
+    Args:
+        fasta_file: str, location of the FASTA file
+
+    Returns:
+        dict, with the header buffer/offsets, the start (header) and end byte of every record,
+        the first byte of every sequence and the number of residues per record
+    """
+    headers, record_start, sequence_start, record_end, lengths = [], [], [], [], []
+    with open(fasta_file, mode="rb") as ffile:
+        size = os.fstat(ffile.fileno()).st_size
+        if size > 0:
+            with mmap.mmap(ffile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = 0 if mm[:1] == b">" else mm.find(b"\n>")
+                pos = pos + 1 if pos > 0 or (pos == 0 and mm[:1] != b">") else pos
+                while pos != -1:
+                    header_end = mm.find(b"\n", pos)
+                    header_end = size if header_end == -1 else header_end
+                    end = mm.find(b"\n>", header_end)
+                    end = size if end == -1 else end + 1
+                    headers.append(mm[pos + 1:header_end].strip().decode("utf-8"))
+                    record_start.append(pos)
+                    sequence_start.append(min(header_end + 1, size))
+                    record_end.append(end)
+                    lengths.append(len(_clean_sequence(mm[sequence_start[-1]:end])))
+                    pos = end if end < size else -1
+    header_buffer, header_offsets = sequences.encode_sequences(headers, encoding="utf-8")
+    return {"header_buffer": header_buffer, "header_offsets": header_offsets,
+            "record_start": np.array(record_start, dtype=np.int64),
+            "sequence_start": np.array(sequence_start, dtype=np.int64),
+            "record_end": np.array(record_end, dtype=np.int64),
+            "lengths": np.array(lengths, dtype=np.int64)}
+
+
+class IndexedFasta:
+    """
+    Random access to the records of a FASTA file through a memory map.
+
+    The record offsets are found by one scan over the file. With an ``index_file`` they are
+    written to a sidecar index on first use and later uses load the index instead of scanning
+    the file (see index_location). Sequences are only read from the memory map when they are
+    requested, and selected records can be copied to another file without parsing them.
+
+    Args:
+        fasta_file: str, location of the FASTA file
+        index_file: str, location of the sidecar index (None: the index is only held in
+            memory), an index that cannot be written is only held in memory as well
+        rebuild: bool, rebuild the index even if an up-to-date index exists
+    """
+
+    def __init__(self, fasta_file, index_file=None, rebuild=False):
+        """Init the reader and load (or build) the index."""
+        if detect_compression(fasta_file) is not None:
+            raise ValueError(f"{fasta_file} is compressed and cannot be memory mapped, use "
+                             f"load_store or select_records instead.")
+        self.fasta_file = fasta_file
+        self.index_file = index_file
+        self.index = None if rebuild or index_file is None else self._load_index()
+        if self.index is None:
+            self.index = build_fasta_index(fasta_file)
+            if index_file is not None:
+                self._save_index()
+        self._file = None
+        self._mm = None
+
+    def _load_index(self):
+        """Load the sidecar index if it exists and matches the FASTA file."""
+        if not os.path.exists(self.index_file):
+            return None
+        with np.load(self.index_file) as npz:
+            if not np.array_equal(npz["signature"], _file_signature(self.fasta_file)):
+                return None
+            return {key: npz[key] for key in npz.files if key != "signature"}
+
+    def _save_index(self):
+        """Write the sidecar index, locations that cannot be written are skipped."""
+        # a temporary file is renamed, so readers never load a partially written index
+        tmp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok=True)
+            with open(tmp_file, mode="wb") as ifile:
+                np.savez(ifile, signature=_file_signature(self.fasta_file), **self.index)
+            os.replace(tmp_file, self.index_file)
+        except OSError:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def _memory_map(self):
+        """Open the memory map on first access."""
+        if self._mm is None:
+            self._file = open(self.fasta_file, mode="rb")
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def close(self):
+        """Close the memory map."""
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm, self._file = None, None
+
+    def __enter__(self):
+        """Use the reader as context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the memory map when leaving the context."""
+        self.close()
+
+    def __len__(self):
+        """Return the number of records."""
+        return len(self.index["record_start"])
+
+    @property
+    def ids(self):
+        """Array with the headers of all records."""
+        buffer, offsets = self.index["header_buffer"], self.index["header_offsets"]
+        return np.array([bytes(buffer[offsets[ii]:offsets[ii + 1]]).decode("utf-8")
+                         for ii in range(len(self))], dtype=object)
+
+    @property
+    def lengths(self):
+        """Array with the number of residues per record."""
+        return self.index["lengths"]
+
+    def sequence_bytes(self, record):
+        """
+        Read the residues of a record.
+
+        Args:
+            record: int, position of the record in the file
+
+        Returns:
+            bytes, the sequence without line breaks
+        """
+        start, end = self.index["sequence_start"][record], self.index["record_end"][record]
+        return _clean_sequence(self._memory_map()[start:end])
+
+    def header_bytes(self, record):
+        """
+        Return the header of a record.
+
+        Args:
+            record: int, position of the record in the file
+
+        Returns:
+            bytes, the header without '>'
+        """
+        offsets = self.index["header_offsets"]
+        return bytes(self.index["header_buffer"][offsets[record]:offsets[record + 1]])
+
+    def records(self, records=None):
+        """
+        Iterate over records without parsing the file.
+
+        Args:
+            records: ar, positions of the records (default: all records in file order)
+
+        Returns:
+            generator of (bytes, bytes), header and sequence of every record
+        """
+        records = range(len(self)) if records is None else records
+        for record in records:
+            yield self.header_bytes(record), self.sequence_bytes(record)
+
+    def sequence(self, record):
+        """
+        Read the sequence of a record.
+
+        Args:
+            record: int, position of the record in the file
+
+        Returns:
+            str, protein sequence
+        """
+        return self.sequence_bytes(record).decode("ascii")
+
+    def to_store(self, records=None):
+        """
+        Load records into a SequenceStore.
+
+        Args:
+            records: ar, positions of the records to load (default: all records in file order)
+
+        Returns:
+            SequenceStore, the order index of a store with all records equals the record
+            positions in the file
+        """
+        records = np.arange(len(self)) if records is None else np.asarray(records)
+        return sequences.SequenceStore.from_bytes([self.header_bytes(ii) for ii in records],
+                                                  [self.sequence_bytes(ii) for ii in records])
+
+    def write_records(self, records, output, file_mode="w"):
+        """
+        Copy records byte by byte to another FASTA file.
+
+        Args:
+            records: ar, positions of the records to copy (repetitions are allowed)
+            output: str, location of the output file
+            file_mode: str, mode to open the output file ('w' or 'a')
+        """
+        mm = self._memory_map() if len(records) > 0 else None
+        with open(output, mode=file_mode + "b") as ffile:
+            for record in records:
+                chunk = mm[self.index["record_start"][record]:self.index["record_end"][record]]
+                ffile.write(chunk if chunk.endswith(b"\n") else chunk + b"\n")
+
+
+def bgzf_compress(data, level=6):
+    """
+    Compress data into BGZF blocks, gzip members with their compressed size in an extra field.
+
+    Args:
+        data: bytes, uncompressed data
+        level: int, deflate compression level
+
+    Returns:
+        list of (bytes, int), every compressed block with its number of uncompressed bytes
+    """
+    blocks = []
+    for start in range(0, len(data), BGZF_BLOCK_SIZE):
+        chunk = data[start:start + BGZF_BLOCK_SIZE]
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        deflated = compressor.compress(chunk) + compressor.flush()
+        # gzip header with the BC subfield, it holds the block size - 1
+        header = struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                             len(deflated) + 25)
+        blocks.append((header + deflated + struct.pack("<II", zlib.crc32(chunk), len(chunk)),
+                       len(chunk)))
+    return blocks
+
+
+class FastaWriter:
+    """
+    Streaming FASTA writer with large buffered writes and optional compression.
+
+    Records are formatted into a write buffer that is flushed every ``buffer_size`` bytes, so
+    memory does not depend on the number of written records. With gzip compression every
+    flushed block is compressed into BGZF blocks on a thread pool (as done by bgzip), the
+    output is a valid gzip file. zstd compression uses the multi-threaded compressor of the
+    optional ``zstandard`` package.
+
+    Optionally a samtools-style ``.fai`` index is written next to the output. Its offsets
+    refer to the uncompressed FASTA stream, for gzip output a ``.gzi`` index maps them to the
+    BGZF blocks (as written by bgzip -i). zstd output cannot be indexed.
+
+    Args:
+        output: str, location of the output file
+        compression: str, None, 'gzip' or 'zstd'
+        threads: int, number of compression threads
+        level: int, compression level (default: 6 for gzip, 3 for zstd)
+        fai: bool, write a .fai index to output + '.fai' (and a .gzi index for gzip)
+        buffer_size: int, number of bytes collected before a block is written
+        line_width: int, residues per sequence line
+    """
+
+    def __init__(self, output, compression=None, threads=1, level=None, fai=False,
+                 buffer_size=2 ** 22, line_width=sequences.FASTA_LINE_WIDTH):
+        """Init the writer and open the output file."""
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}', choose one of "
+                             f"{list(COMPRESSIONS)}.")
+        if compression == "zstd" and zstandard is None:  # pragma: no cover
+            raise ImportError("zstd compression requires the zstandard package.")
+        if compression == "zstd" and fai:
+            raise ValueError("A .fai index cannot be written for zstd output, use gzip (BGZF) "
+                             "or no compression.")
+        self.output = output
+        self.compression = compression
+        self.threads = max(1, threads)
+        self.buffer_size = buffer_size
+        self.line_width = line_width
+        self.fai = [] if fai else None
+
+        self._file = open(output, mode="wb")
+        self._buffer = bytearray()
+        self._offset = 0
+        self._sink = self._file
+        if compression == "gzip":
+            self.level = 6 if level is None else level
+            self._pool = ThreadPoolExecutor(max_workers=self.threads)
+            self._pending = deque()
+            # (compressed, uncompressed) offsets of the BGZF blocks after the first one
+            self.gzi = [] if fai else None
+            self._compressed_offset, self._uncompressed_offset = 0, 0
+        elif compression == "zstd":
+            self.level = 3 if level is None else level
+            compressor = zstandard.ZstdCompressor(level=self.level,
+                                                  threads=self.threads if threads > 1 else 0)
+            self._sink = compressor.stream_writer(self._file, closefd=False)
+
+    def __enter__(self):
+        """Use the writer as context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Flush and close the output when leaving the context."""
+        self.close()
+
+    def write(self, header, sequence):
+        """
+        Write a single record.
+
+        Args:
+            header: str or bytes, record header without '>'
+            sequence: str or bytes, residues of the record
+        """
+        header = header.encode("utf-8") if isinstance(header, str) else header
+        sequence = sequence.encode("ascii") if isinstance(sequence, str) else sequence
+        record = sequences.format_record(header, sequence, self.line_width)
+        if self.fai is not None:
+            line_bases = min(len(sequence), self.line_width)
+            self.fai.append((header.split(maxsplit=1)[0].decode("utf-8") if header else "",
+                             len(sequence), self._offset + len(header) + 2, line_bases,
+                             line_bases + 1))
+        self._offset += len(record)
+        self._buffer += record
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+
+    def write_records(self, records):
+        """
+        Write (header, sequence) pairs, e.g. from IndexedFasta.records or SequenceStore.records.
+
+        Args:
+            records: iterable of (header, sequence) tuples
+        """
+        for header, sequence in records:
+            self.write(header, sequence)
+
+    def _flush(self):
+        """Pass the buffered block to the compressor or file."""
+        block = bytes(self._buffer)
+        self._buffer.clear()
+        if self.compression != "gzip":
+            self._sink.write(block)
+            return
+        self._pending.append(self._pool.submit(bgzf_compress, block, self.level))
+        # keep a bounded number of blocks in flight and write them in order
+        while self._pending and (len(self._pending) > 2 * self.threads
+                                 or self._pending[0].done()):
+            self._write_blocks(self._pending.popleft().result())
+
+    def _write_blocks(self, blocks):
+        """Write compressed BGZF blocks and record their offsets."""
+        for block, size in blocks:
+            if self.gzi is not None and self._compressed_offset > 0:
+                self.gzi.append((self._compressed_offset, self._uncompressed_offset))
+            self._file.write(block)
+            self._compressed_offset += len(block)
+            self._uncompressed_offset += size
+
+    def close(self):
+        """Write all buffered data, the .fai index and close the output."""
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._flush()
+        if self.compression == "gzip":
+            while self._pending:
+                self._write_blocks(self._pending.popleft().result())
+            self._file.write(BGZF_EOF)
+            self._pool.shutdown()
+        elif self.compression == "zstd":
+            self._sink.close()
+        self._file.close()
+        if self.fai is not None:
+            with open(self.output + ".fai", mode="w") as ffile:
+                for entry in self.fai:
+                    ffile.write("\t".join(str(value) for value in entry) + "\n")
+        if self.compression == "gzip" and self.gzi is not None:
+            with open(self.output + ".gzi", mode="wb") as gfile:
+                gfile.write(struct.pack("<Q", len(self.gzi)))
+                gfile.write(np.array(self.gzi, dtype="<u8").tobytes())
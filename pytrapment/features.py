@@ -0,0 +1,266 @@
+"""Module to compute peptide and protein features from residue count matrices."""
+import numpy as np
+import pandas as pd
+from pyteomics import electrochem, parser
+
+from pytrapment import sequences
+
+# feature groups counted for every peptide, a group counts all of its residues (add entries
+# here to compute further groups, no additional pass over the sequences is needed)
+FEATURE_GROUPS = {"KR": "KR", "aromatic": "FWY", "acids": "DE", "aliphatic": "AILMV",
+                  "HGP": "GPH"}
+
+# columns of the residue count matrix
+COUNT_COLUMNS = sequences.composition_columns("separate")
+
+# number of peptides per chunk of the isoelectric point computation
+CHUNK_PEPTIDES = 2 ** 20
+
+# hydropathy scales (residue to value), the average over a sequence is computed with one
+# matrix product, add entries here to compute further scales
+HYDROPATHY_SCALES = {
+    # Kyte and Doolittle, J Mol Biol 1982 (as electrochem.gravy)
+    "gravy": electrochem.hydropathicity_KD,
+    # Hopp and Woods, PNAS 1981
+    "hopp_woods": {"A": -0.5, "R": 3.0, "N": 0.2, "D": 3.0, "C": -1.0, "Q": 0.2, "E": 3.0,
+                   "G": 0.0, "H": -0.5, "I": -1.8, "L": -1.8, "K": 3.0, "M": -1.3, "F": -2.5,
+                   "P": 0.0, "S": 0.3, "T": -0.4, "W": -3.4, "Y": -2.3, "V": -1.5},
+    # Eisenberg et al. normalized consensus, J Mol Biol 1984
+    "eisenberg": {"A": 0.62, "R": -2.53, "N": -0.78, "D": -0.90, "C": 0.29, "Q": -0.85,
+                  "E": -0.74, "G": 0.48, "H": -0.40, "I": 1.38, "L": 1.06, "K": -1.50,
+                  "M": 0.64, "F": 1.19, "P": 0.12, "S": -0.18, "T": -0.05, "W": 0.81,
+                  "Y": 0.26, "V": 1.08},
+}
+
+
+def residue_counts(buffer, offsets):
+    """
+    Count the residues of all peptides in a concatenated buffer in a single pass.
+
+    Args:
+        buffer: ar, uint8 residues of all peptides
+        offsets: ar, int64 offsets of length n+1
+
+    Returns:
+        ar, uint16 matrix (n, len(COUNT_COLUMNS))
+    """
+    return sequences.composition_matrix(buffer, offsets, nonstandard="separate",
+                                        dtype=np.uint16)
+
+
+def group_weights(groups=FEATURE_GROUPS, columns=COUNT_COLUMNS):
+    """
+    Build the residue to feature group weight matrix.
+
+    Args:
+        groups: dict, feature name to residues
+        columns: list, residues of the count matrix
+
+    Returns:
+        ar, float32 matrix (len(columns), len(groups))
+    """
+    weights = np.zeros((len(columns), len(groups)), dtype=np.float32)
+    for jj, (name, residues) in enumerate(groups.items()):
+        for aa in residues:
+            if aa not in columns:
+                raise ValueError(f"Unknown residue '{aa}' in feature group '{name}'.")
+            weights[columns.index(aa), jj] += 1
+    return weights
+
+
+def group_counts(counts, groups=FEATURE_GROUPS, columns=COUNT_COLUMNS):
+    """
+    Compute all feature groups with one matrix product.
+
+    Args:
+        counts: ar, residue count matrix (n, len(columns))
+        groups: dict, feature name to residues
+        columns: list, residues of the count matrix
+
+    Returns:
+        ar, int64 matrix (n, len(groups))
+    """
+    # float32 products of small counts are exact
+    return (counts.astype(np.float32) @ group_weights(groups, columns)).astype(np.int64)
+
+
+def scale_matrix(scales=("gravy",), columns=COUNT_COLUMNS):
+    """
+    Build the residue to scale value matrix.
+
+    Args:
+        scales: list, names in HYDROPATHY_SCALES or dicts with residue values
+        columns: list, residues of the count matrix
+
+    Returns:
+        (values, known), float64 matrix (len(columns), len(scales)) and a bool matrix with the
+        residues that have a value
+    """
+    values = np.zeros((len(columns), len(scales)))
+    known = np.zeros((len(columns), len(scales)), dtype=bool)
+    for jj, scale in enumerate(scales):
+        if isinstance(scale, str):
+            if scale not in HYDROPATHY_SCALES:
+                raise ValueError(f"Unknown hydropathy scale '{scale}', choose one of "
+                                 f"{sorted(HYDROPATHY_SCALES)} or pass a dict.")
+            scale = HYDROPATHY_SCALES[scale]
+        for ii, aa in enumerate(columns):
+            if aa in scale:
+                values[ii, jj], known[ii, jj] = scale[aa], True
+    return values, known
+
+
+def scale_names(scales=("gravy",)):
+    """
+    Name the hydropathy columns of scales.
+
+    Args:
+        scales: list, names in HYDROPATHY_SCALES or dicts with residue values
+
+    Returns:
+        list, the name of a named scale, scale_<i> for the i-th scale given as dict
+    """
+    return [scale if isinstance(scale, str) else f"scale_{ii}" for ii, scale in enumerate(scales)]
+
+
+def hydropathy(counts, scales=("gravy",), columns=COUNT_COLUMNS):
+    """
+    Compute average hydropathy values such as GRAVY from residue counts.
+
+    Args:
+        counts: ar, residue count matrix (n, len(columns))
+        scales: list, names in HYDROPATHY_SCALES or dicts with residue values
+        columns: list, residues of the count matrix
+
+    Returns:
+        ar, float64 matrix (n, len(scales)), NaN for sequences with residues without value
+    """
+    values, known = scale_matrix(scales, columns)
+    counts = counts.astype(np.float64)
+    lengths = counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = counts @ values / lengths
+    averages[(counts @ ~known) > 0] = np.nan
+    return averages
+
+
+def protein_hydropathy(df_comp, scales=("gravy",)):
+    """
+    Compute the average hydropathy of proteins from their composition.
+
+    Args:
+        df_comp: df, composition matrix (see entrapment.compute_composition_df)
+        scales: list, names in HYDROPATHY_SCALES or dicts with residue values
+
+    Returns:
+        df, one column per scale with the proteins as index
+    """
+    return pd.DataFrame(hydropathy(df_comp.values, scales, list(df_comp.columns)),
+                        index=df_comp.index, columns=scale_names(scales))
+
+
+def ionizable_groups(pK=None, columns=COUNT_COLUMNS):
+    """
+    Collect the ionizable groups of a pK scale.
+
+    Args:
+        pK: dict, pK scale as in pyteomics.electrochem (default: pK_lehninger)
+        columns: list, residues of the count matrix
+
+    Returns:
+        (positions, pk_values, charges), count matrix column of every group (-1 for termini)
+    """
+    pK = electrochem.pK_lehninger if pK is None else pK
+    positions, pk_values, charges = [], [], []
+    for label, groups in pK.items():
+        if label in (parser.std_nterm, parser.std_cterm):
+            position = -1
+        elif label in columns:
+            position = columns.index(label)
+        else:
+            # e.g. modified residues, they do not occur in the count matrix
+            continue
+        for pk_value, charge in groups:
+            positions.append(position)
+            pk_values.append(pk_value)
+            charges.append(charge)
+    return np.array(positions), np.array(pk_values), np.array(charges, dtype=np.float64)
+
+
+def isoelectric_points(counts, pK=None, pI_range=(0.0, 14.0), precision_pI=0.01,
+                       columns=COUNT_COLUMNS):
+    """
+    Compute the isoelectric points of many peptides with a batched bisection.
+
+    Follows electrochem.pI: the charge of the termini and ionizable residues is bisected on
+    pI_range until the interval is smaller than precision_pI, all peptides are bisected at once.
+
+    Args:
+        counts: ar, residue count matrix (n, len(columns))
+        pK: dict, pK scale as in pyteomics.electrochem (default: pK_lehninger)
+        pI_range: tuple, range of allowed values
+        precision_pI: float, precision of the isoelectric points
+        columns: list, residues of the count matrix
+
+    Returns:
+        ar, float64 isoelectric points
+    """
+    positions, pk_values, charges = ionizable_groups(pK, columns)
+    residues = np.unique(positions[positions >= 0])
+    # column of every group in the unique count vectors, the termini use an extra column
+    group_columns = np.where(positions >= 0, np.searchsorted(residues, positions), len(residues))
+    result = np.zeros(len(counts))
+    for start in range(0, len(counts), CHUNK_PEPTIDES):
+        # peptides with the same ionizable residues share the isoelectric point
+        ionizable, inverse = _unique_rows(counts[start:start + CHUNK_PEPTIDES][:, residues])
+        result[start:start + len(inverse)] = _bisect_pI(
+            ionizable, group_columns, pk_values, charges, pI_range, precision_pI)[inverse]
+    return result
+
+
+def _unique_rows(values):
+    """Find the unique rows of a small count matrix, returns the rows and the inverse."""
+    values = values.astype(np.int64)
+    radix = values.max(axis=0, initial=0) + 1
+    if np.sum(np.log2(radix)) >= 62:
+        unique, inverse = np.unique(values, axis=0, return_inverse=True)
+        return unique, inverse.ravel()
+    # mixed radix key of every row
+    multipliers = np.cumprod(np.concatenate([[1], radix]))[:-1]
+    keys, first, inverse = np.unique(values @ multipliers, return_index=True,
+                                     return_inverse=True)
+    return values[first], inverse
+
+
+def _bisect_pI(ionizable, group_columns, pk_values, charges, pI_range, precision_pI):
+    """Bisect the charge of all count vectors at once (see isoelectric_points)."""
+    # number of every ionizable group per peptide, every peptide has two termini
+    group_counts = np.hstack([ionizable, np.ones((len(ionizable), 1), dtype=np.int64)])
+    weights = group_counts[:, group_columns] * charges
+    # 10 ** (charge * (pH - pK)) = (10 ** pH) ** charge * 10 ** (-charge * pK), charges are +-1
+    basic = charges > 0
+    scales = 10 ** (-charges * pk_values)
+
+    def charge(ph):
+        power = 10 ** ph[:, None]
+        power = np.where(basic, power, 1. / power) * scales
+        return (weights / (1. + power)).sum(axis=1)
+
+    n_vectors = len(ionizable)
+    left_x = np.full(n_vectors, float(pI_range[0]))
+    right_x = np.full(n_vectors, float(pI_range[1]))
+    left_y, right_y = charge(left_x), charge(right_x)
+    value = np.full(n_vectors, np.nan)
+    active = np.ones(n_vectors, dtype=bool)
+    while (right_x[0] - left_x[0]) > precision_pI and active.any():
+        # no sign change: the closer border is the result
+        same_sign = active & (left_y * right_y > 0)
+        value[same_sign] = np.where(np.abs(left_y) < np.abs(right_y), left_x, right_x)[same_sign]
+        active &= ~same_sign
+        middle_x = (left_x + right_x) / 2.0
+        middle_y = charge(middle_x)
+        lower = middle_y * left_y < 0
+        right_x, right_y = np.where(lower, middle_x, right_x), np.where(lower, middle_y, right_y)
+        left_x, left_y = np.where(lower, left_x, middle_x), np.where(lower, left_y, middle_y)
+    value[active] = ((left_x + right_x) / 2.0)[active]
+    return value
@@ -0,0 +1,617 @@
+"""Nearest neighbor engines to match host and entrapment proteins in composition space.
+
+All engines share the same interface: ``fit`` is called once with the trap composition matrix
+and ``kneighbors`` returns the ``k`` closest trap rows for every host row in one batch.
+
+Tie-breaking rule: neighbors are ordered by ascending Euclidean distance and, among trap
+proteins with the same distance, by their row position in the trap matrix (first row wins).
+This reproduces the ``df_comp_trap[ary == ary.min()].index.values[0]`` selection of the
+original per-row ``cdist`` loop. Composition vectors hold integer counts, so squared distances
+are exact in float64 and ties are detected exactly.
+"""
+import numpy as np
+
+# approximate number of bytes held per host x trap tile element (distance tile, temporaries of
+# the norm expansion and the top-k selection)
+TILE_BYTES_PER_ELEMENT = 32
+
+
+def _as_matrix(matrix):
+    """Return a 2D float64 array from a dataframe or array-like."""
+    return np.atleast_2d(np.asarray(matrix, dtype=np.float64))
+
+
+def _squared_distances(host, trap, indices):
+    """
+    Compute squared Euclidean distances between host rows and selected trap rows.
+
+    Args:
+        host: ar, (n, d) host matrix
+        trap: ar, (m, d) trap matrix
+        indices: ar, (n, c) trap row indices per host row
+
+    Returns:
+        ar, (n, c) squared distances
+    """
+    return ((trap[indices] - host[:, None, :]) ** 2).sum(axis=-1)
+
+
+def _sort_candidates(sqd, indices, k):
+    """
+    Order candidate neighbors by (distance, trap position) and keep the first k.
+
+    Args:
+        sqd: ar, (n, c) squared distances
+        indices: ar, (n, c) trap row indices
+        k: int, number of neighbors to keep
+
+    Returns:
+        (sqd, indices), both with shape (n, k)
+    """
+    order = np.lexsort((indices, sqd), axis=-1)[:, :k]
+    return np.take_along_axis(sqd, order, axis=-1), np.take_along_axis(indices, order, axis=-1)
+
+
+def _tile_topk(sqd, k):
+    """
+    Select the k smallest entries per row of a distance tile, lowest column first among ties.
+
+    Args:
+        sqd: ar, (n, m) squared distances
+        k: int, number of neighbors (k < m)
+
+    Returns:
+        (sqd, columns), both with shape (n, k)
+    """
+    if k == 1:
+        columns = np.argmin(sqd, axis=1)[:, None]
+        return np.take_along_axis(sqd, columns, axis=1), columns
+    columns = np.argpartition(sqd, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(sqd, columns, axis=1)
+    kth = values.max(axis=1, keepdims=True)
+    # rows with more ties at the k-th distance than free slots need the first tied columns
+    ambiguous = np.flatnonzero(np.count_nonzero(sqd <= kth, axis=1) > k)
+    if ambiguous.size > 0:
+        amb_sqd, amb_kth = sqd[ambiguous], kth[ambiguous]
+        below = amb_sqd < amb_kth
+        ties = amb_sqd == amb_kth
+        ties &= np.cumsum(ties, axis=1, dtype=np.int32) <= k - below.sum(axis=1, keepdims=True)
+        columns[ambiguous] = np.nonzero(below | ties)[1].reshape(-1, k)
+        values[ambiguous] = np.take_along_axis(amb_sqd, columns[ambiguous], axis=1)
+    return _sort_candidates(values, columns, k)
+
+
+def _blocked_topk(host, trap, k, memory_budget):
+    """
+    Run the tiled brute-force search and return squared distances.
+
+    Args:
+        host: ar, (n, d) float64 host matrix
+        trap: ar, (m, d) float64 trap matrix
+        k: int, number of neighbors
+        memory_budget: int, approximate number of bytes used for a distance tile
+
+    Returns:
+        (sqd, indices), arrays of shape (n, min(k, m))
+    """
+    n_host, n_trap = host.shape[0], trap.shape[0]
+    k = min(k, n_trap)
+
+    tile = max(1, int(memory_budget) // TILE_BYTES_PER_ELEMENT)
+    host_block = max(1, min(n_host, int(np.sqrt(tile))))
+    trap_block = max(k + 1, min(n_trap, tile // host_block))
+
+    host_norm = np.einsum("ij,ij->i", host, host)
+    trap_norm = np.einsum("ij,ij->i", trap, trap)
+    best_sqd = np.full((n_host, k), np.inf)
+    best_idx = np.zeros((n_host, k), dtype=np.int64)
+    for hs in range(0, n_host, host_block):
+        he = min(hs + host_block, n_host)
+        run_sqd, run_idx = best_sqd[hs:he], best_idx[hs:he]
+        for ts in range(0, n_trap, trap_block):
+            te = min(ts + trap_block, n_trap)
+            sqd = host[hs:he] @ trap[ts:te].T
+            sqd *= -2
+            sqd += host_norm[hs:he, None]
+            sqd += trap_norm[None, ts:te]
+            np.maximum(sqd, 0, out=sqd)
+            if te - ts <= k:
+                columns = np.broadcast_to(np.arange(te - ts), sqd.shape)
+                tile_sqd, tile_idx = _sort_candidates(sqd, columns, k)
+            else:
+                tile_sqd, tile_idx = _tile_topk(sqd, k)
+            # earlier tiles have smaller trap positions and win ties in the merge
+            run_sqd, run_idx = _sort_candidates(np.hstack([run_sqd, tile_sqd]),
+                                                np.hstack([run_idx, tile_idx + ts]), k)
+        best_sqd[hs:he], best_idx[hs:he] = run_sqd, run_idx
+    return best_sqd, best_idx
+
+
+def blocked_kneighbors(host_matrix, trap_matrix, k=1, memory_budget=2 ** 28):
+    """
+    Exact brute-force k nearest neighbor search in memory-bounded tiles.
+
+    Squared distances are computed per tile as |a|^2 + |b|^2 - 2ab with a BLAS matrix product
+    and each tile is reduced right away into a running top-k, so the full host x trap distance
+    matrix is never held in memory.
+
+    Args:
+        host_matrix: ar, (n, d) composition matrix of the host proteins
+        trap_matrix: ar, (m, d) composition matrix of the trap proteins
+        k: int, number of neighbors
+        memory_budget: int, approximate number of bytes used for a distance tile
+
+    Returns:
+        (distances, indices), arrays of shape (n, k)
+    """
+    sqd, indices = _blocked_topk(_as_matrix(host_matrix), _as_matrix(trap_matrix), k,
+                                 memory_budget)
+    return np.sqrt(sqd), indices
+
+
+class CdistEngine:
+    """Reference engine, computes the distances of each host protein to all trap proteins."""
+
+    name = "cdist"
+    fitted_arrays = ()
+
+    def fit(self, trap_matrix):
+        """
+        Store the trap composition matrix.
+
+        Args:
+            trap_matrix: ar, (m, d) composition matrix of the trap proteins
+
+        Returns:
+            self
+        """
+        self.trap_ = _as_matrix(trap_matrix)
+        return self
+
+    def kneighbors(self, host_matrix, k=1):
+        """
+        Find the k nearest trap proteins for each host protein.
+
+        Args:
+            host_matrix: ar, (n, d) composition matrix of the host proteins
+            k: int, number of neighbors
+
+        Returns:
+            (distances, indices), arrays of shape (n, k)
+        """
+        host = _as_matrix(host_matrix)
+        k = min(k, self.trap_.shape[0])
+        positions = np.arange(self.trap_.shape[0])
+        distances = np.zeros((host.shape[0], k))
+        indices = np.zeros((host.shape[0], k), dtype=np.int64)
+        from scipy.spatial import distance
+
+        for ii, row in enumerate(host):
+            ary = distance.cdist(self.trap_, row[None, :], metric="euclidean").ravel()
+            order = np.lexsort((positions, ary))[:k]
+            distances[ii] = ary[order]
+            indices[ii] = order
+        return distances, indices
+
+
+class KDTreeEngine:
+    """
+    Exact engine backed by a KD-tree that is built once over the trap proteins.
+
+    The tree is queried for ``k + candidates`` neighbors per host protein. Candidates are
+    re-ranked with exact squared distances to apply the tie-breaking rule. Host proteins whose
+    ties extend beyond the candidate list are resolved with a radius query.
+
+    Args:
+        leafsize: int, leaf size of the KD-tree
+        candidates: int, number of extra neighbors fetched to resolve ties
+        n_jobs: int, number of workers for the tree queries (-1 uses all cores)
+    """
+
+    name = "kdtree"
+    fitted_arrays = ()
+
+    def __init__(self, leafsize=16, candidates=8, n_jobs=1):
+        """Init the engine."""
+        self.leafsize = leafsize
+        self.candidates = candidates
+        self.n_jobs = n_jobs
+
+    def fit(self, trap_matrix):
+        """
+        Build the KD-tree over the trap composition matrix.
+
+        Args:
+            trap_matrix: ar, (m, d) composition matrix of the trap proteins
+
+        Returns:
+            self
+        """
+        from scipy.spatial import cKDTree
+
+        self.trap_ = _as_matrix(trap_matrix)
+        self.tree_ = cKDTree(self.trap_, leafsize=self.leafsize)
+        return self
+
+    def kneighbors(self, host_matrix, k=1):
+        """
+        Find the k nearest trap proteins for each host protein.
+
+        Args:
+            host_matrix: ar, (n, d) composition matrix of the host proteins
+            k: int, number of neighbors
+
+        Returns:
+            (distances, indices), arrays of shape (n, k)
+        """
+        host = _as_matrix(host_matrix)
+        n_trap = self.trap_.shape[0]
+        k = min(k, n_trap)
+        n_cand = min(k + self.candidates, n_trap)
+
+        _, indices = self.tree_.query(host, k=list(range(1, n_cand + 1)), workers=self.n_jobs)
+        sqd = _squared_distances(host, self.trap_, indices)
+        sqd, indices = _sort_candidates(sqd, indices, n_cand)
+
+        # the k-th distance ties with the last candidate, further ties may be outside the list
+        open_ties = np.flatnonzero(sqd[:, -1] <= sqd[:, k - 1]) if n_cand < n_trap else []
+        sqd, indices = sqd[:, :k].copy(), indices[:, :k].copy()
+        for ii in open_ties:
+            radius = np.sqrt(sqd[ii, -1])
+            ball = np.asarray(self.tree_.query_ball_point(host[ii], radius * (1 + 1e-9) + 1e-9))
+            ball_sqd = _squared_distances(host[ii:ii + 1], self.trap_, ball[None, :])
+            sqd[ii], indices[ii] = (x[0] for x in _sort_candidates(ball_sqd, ball[None, :], k))
+        return np.sqrt(sqd), indices
+
+
+class BlockedEngine:
+    """
+    Exact brute-force engine that scans the trap proteins in memory-bounded tiles.
+
+    Args:
+        memory_budget: int, approximate number of bytes used for a distance tile
+    """
+
+    name = "blocked"
+    fitted_arrays = ()
+
+    def __init__(self, memory_budget=2 ** 28):
+        """Init the engine."""
+        self.memory_budget = memory_budget
+
+    def fit(self, trap_matrix):
+        """
+        Store the trap composition matrix.
+
+        Args:
+            trap_matrix: ar, (m, d) composition matrix of the trap proteins
+
+        Returns:
+            self
+        """
+        self.trap_ = _as_matrix(trap_matrix)
+        return self
+
+    def kneighbors(self, host_matrix, k=1):
+        """
+        Find the k nearest trap proteins for each host protein.
+
+        Args:
+            host_matrix: ar, (n, d) composition matrix of the host proteins
+            k: int, number of neighbors
+
+        Returns:
+            (distances, indices), arrays of shape (n, k)
+        """
+        return blocked_kneighbors(host_matrix, self.trap_, k=k, memory_budget=self.memory_budget)
+
+
+class IVFEngine:
+    """
+    Approximate engine with an inverted file index over k-means clusters of the trap proteins.
+
+    The trap proteins are partitioned by a coarse k-means quantizer. A host protein is only
+    compared to the members of its ``n_probe`` closest clusters, so ``n_probe`` trades recall
+    for speed (``n_probe=n_lists`` is an exact search). When ``recall_sample`` is set, every
+    query also measures recall against exact search on a random sample of host proteins and
+    stores it as ``recall_``, the hits and sampled neighbors as ``recall_counts_`` (to combine
+    the recall of several queries).
+
+    Args:
+        n_lists: int, number of clusters (default: square root of the trap proteins)
+        n_probe: int, number of clusters searched per host protein
+        n_iter: int, number of k-means iterations
+        train_size: int, number of trap proteins sampled per cluster to train the quantizer
+        recall_sample: int, number of host proteins used to measure recall (0 disables it)
+        seed: int, random seed for training and recall sampling
+        memory_budget: int, approximate number of bytes used for a distance tile
+    """
+
+    name = "ivf"
+    fitted_arrays = ("centroids_", "lists_", "list_offsets_")
+
+    def __init__(self, n_lists=None, n_probe=8, n_iter=10, train_size=64, recall_sample=0,
+                 seed=42, memory_budget=2 ** 28):
+        """Init the engine."""
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.train_size = train_size
+        self.recall_sample = recall_sample
+        self.seed = seed
+        self.memory_budget = memory_budget
+
+    def fit(self, trap_matrix):
+        """
+        Train the coarse quantizer and build the inverted lists.
+
+        Args:
+            trap_matrix: ar, (m, d) composition matrix of the trap proteins
+
+        Returns:
+            self
+        """
+        self.trap_ = _as_matrix(trap_matrix)
+        n_trap = self.trap_.shape[0]
+        rng = np.random.RandomState(self.seed)
+        n_lists = min(n_trap, self.n_lists or max(1, int(np.sqrt(n_trap))))
+
+        train = self.trap_[rng.choice(n_trap, min(n_trap, self.train_size * n_lists),
+                                      replace=False)]
+        centroids = train[rng.choice(train.shape[0], n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = _blocked_topk(train, centroids, 1, self.memory_budget)[1][:, 0]
+            counts = np.bincount(assign, minlength=n_lists)
+            sums = np.column_stack([np.bincount(assign, weights=train[:, jj], minlength=n_lists)
+                                    for jj in range(train.shape[1])])
+            # empty clusters keep their previous centroid
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        self.centroids_ = centroids
+
+        # members of each list are stored in ascending trap position
+        assign = _blocked_topk(self.trap_, centroids, 1, self.memory_budget)[1][:, 0]
+        self.lists_ = np.argsort(assign, kind="stable")
+        self.list_offsets_ = np.concatenate([[0], np.cumsum(np.bincount(assign,
+                                                                        minlength=n_lists))])
+        return self
+
+    def _search(self, host, k):
+        """Probe the closest lists for every host row and return squared distances."""
+        n_host = host.shape[0]
+        n_lists = self.centroids_.shape[0]
+        k = min(k, self.trap_.shape[0])
+        probes = _blocked_topk(host, self.centroids_, min(self.n_probe, n_lists),
+                               self.memory_budget)[1]
+
+        best_sqd = np.full((n_host, k), np.inf)
+        best_idx = np.zeros((n_host, k), dtype=np.int64)
+        # group the (host, list) pairs by list to scan every list once
+        pairs = np.argsort(probes.ravel(), kind="stable")
+        pair_lists = probes.ravel()[pairs]
+        pair_hosts = pairs // probes.shape[1]
+        bounds = np.searchsorted(pair_lists, np.arange(n_lists + 1))
+        for ii in range(n_lists):
+            rows = pair_hosts[bounds[ii]:bounds[ii + 1]]
+            members = self.lists_[self.list_offsets_[ii]:self.list_offsets_[ii + 1]]
+            if rows.size == 0 or members.size == 0:
+                continue
+            sqd, indices = _blocked_topk(host[rows], self.trap_[members], k, self.memory_budget)
+            best_sqd[rows], best_idx[rows] = _sort_candidates(
+                np.hstack([best_sqd[rows], sqd]), np.hstack([best_idx[rows], members[indices]]),
+                k)
+
+        # probed lists with less than k members in total fall back to exact search
+        incomplete = np.flatnonzero(np.isinf(best_sqd[:, -1]))
+        if incomplete.size > 0:
+            best_sqd[incomplete], best_idx[incomplete] = _blocked_topk(
+                host[incomplete], self.trap_, k, self.memory_budget)
+        return best_sqd, best_idx
+
+    def kneighbors(self, host_matrix, k=1):
+        """
+        Find approximately the k nearest trap proteins for each host protein.
+
+        Args:
+            host_matrix: ar, (n, d) composition matrix of the host proteins
+            k: int, number of neighbors
+
+        Returns:
+            (distances, indices), arrays of shape (n, k)
+        """
+        host = _as_matrix(host_matrix)
+        sqd, indices = self._search(host, k)
+        if self.recall_sample > 0:
+            self.recall_counts_ = self.recall_counts(host, k=k, sample_size=self.recall_sample,
+                                                     indices=indices)
+            self.recall_ = self.recall_counts_[0] / self.recall_counts_[1]
+        return np.sqrt(sqd), indices
+
+    def measure_recall(self, host_matrix, k=1, sample_size=1000, indices=None):
+        """
+        Measure the recall of the approximate search against exact search on a sample.
+
+        Recall is the fraction of the exact k nearest neighbors (after tie-breaking) that are
+        also returned by the approximate search.
+
+        Args:
+            host_matrix: ar, (n, d) composition matrix of the host proteins
+            k: int, number of neighbors
+            sample_size: int, number of host proteins in the sample
+            indices: ar, (n, k) approximate neighbors of all host rows if already computed
+
+        Returns:
+            float, recall in [0, 1]
+        """
+        hits, total = self.recall_counts(host_matrix, k=k, sample_size=sample_size,
+                                         indices=indices)
+        return hits / total
+
+    def recall_counts(self, host_matrix, k=1, sample_size=1000, indices=None):
+        """
+        Count the exact neighbors of a sample that are found by the approximate search.
+
+        Args:
+            host_matrix: ar, (n, d) composition matrix of the host proteins
+            k: int, number of neighbors
+            sample_size: int, number of host proteins in the sample
+            indices: ar, (n, k) approximate neighbors of all host rows if already computed
+
+        Returns:
+            (int, int), found and sampled exact neighbors (see measure_recall)
+        """
+        host = _as_matrix(host_matrix)
+        rng = np.random.RandomState(self.seed)
+        sample = np.sort(rng.choice(host.shape[0], min(sample_size, host.shape[0]),
+                                    replace=False))
+        approx = self._search(host[sample], k)[1] if indices is None else indices[sample]
+        exact = _blocked_topk(host[sample], self.trap_, k, self.memory_budget)[1]
+        hits = [np.intersect1d(aa, ee).size for aa, ee in zip(approx, exact)]
+        return int(np.sum(hits)), int(exact.size)
+
+
+ENGINES = {engine.name: engine for engine in [CdistEngine, KDTreeEngine, BlockedEngine,
+                                              IVFEngine]}
+
+
+def assign_unique(host_matrix, trap_matrix, engine="kdtree", max_uses=1, k=10):
+    """
+    Assign a trap protein to every host protein while using each trap protein at most N times.
+
+    The assignment is greedy on a sparse candidate graph: the k nearest available trap proteins
+    are retrieved for every unassigned host protein and all candidate edges are processed in
+    ascending distance (ties by host position, then trap position). An edge is accepted if its
+    host protein is still unassigned and its trap protein has capacity left. The engine is
+    fitted once, host proteins without an accepted edge are queried again with twice as many
+    extra candidates per round and the trap proteins without capacity are skipped (see
+    kneighbors_excluding).
+
+    Approximate engines that measure recall (recall_sample > 0) report the recall of the
+    candidate queries of all rounds as ``recall_``: the found exact neighbors summed over the
+    rounds divided by the sampled exact neighbors summed over the rounds.
+
+    Args:
+        host_matrix: ar, (n, d) composition matrix of the host proteins
+        trap_matrix: ar, (m, d) composition matrix of the trap proteins
+        engine: str or engine instance, nearest neighbor engine used for the candidate graph
+        max_uses: int, maximal number of host proteins assigned to the same trap protein
+        k: int, number of candidates per host protein and round
+
+    Returns:
+        (distances, indices), arrays of shape (n,)
+    """
+    host = _as_matrix(host_matrix)
+    trap = _as_matrix(trap_matrix)
+    n_host, n_trap = host.shape[0], trap.shape[0]
+    if n_host > n_trap * max_uses:
+        raise ValueError(f"Cannot assign {n_host} host proteins to {n_trap} trap proteins "
+                         f"with at most {max_uses} uses per trap protein.")
+    nn_engine = get_engine(engine).fit(trap)
+
+    capacity = np.full(n_trap, max_uses)
+    distances = np.zeros(n_host)
+    indices = np.full(n_host, -1, dtype=np.int64)
+    pending = np.arange(n_host)
+    candidates = k
+    recall_hits, recall_total = 0, 0
+    while pending.size > 0:
+        cand_dist, cand_idx = kneighbors_excluding(nn_engine, host[pending], trap, capacity == 0,
+                                                   k=k, candidates=candidates)
+        if getattr(nn_engine, "recall_sample", 0) > 0:
+            recall_hits += nn_engine.recall_counts_[0]
+            recall_total += nn_engine.recall_counts_[1]
+        candidates *= 2
+        cand_host = np.repeat(pending, cand_idx.shape[1])
+        order = np.lexsort((cand_idx.ravel(), cand_host, cand_dist.ravel()))
+        for hh, tt, dd in zip(cand_host[order], cand_idx.ravel()[order],
+                              cand_dist.ravel()[order]):
+            if indices[hh] < 0 and capacity[tt] > 0:
+                indices[hh] = tt
+                distances[hh] = dd
+                capacity[tt] -= 1
+        pending = np.flatnonzero(indices < 0)
+    if recall_total > 0:
+        nn_engine.recall_ = recall_hits / recall_total
+    return distances, indices
+
+
+def kneighbors_excluding(engine, host_matrix, trap_matrix, excluded, k=1, candidates=16):
+    """
+    Query an engine fitted on all trap proteins while skipping excluded trap proteins.
+
+    Used with prebuilt engines, when the trap proteins removed by the host-specific filter are
+    only known at query time. The engine returns ``k + candidates`` neighbors per host protein
+    and the first k that are not excluded are kept. Host proteins without enough allowed
+    candidates are searched exactly among the allowed trap proteins. For exact engines the
+    result equals an engine fitted on the allowed trap proteins only (same tie-breaking).
+
+    Args:
+        engine: fitted engine instance
+        host_matrix: ar, (n, d) composition matrix of the host proteins
+        trap_matrix: ar, (m, d) composition matrix the engine was fitted on
+        excluded: ar, bool mask of length m with the excluded trap proteins
+        k: int, number of neighbors
+        candidates: int, number of extra neighbors fetched per host protein
+
+    Returns:
+        (distances, indices), arrays of shape (n, k) with positions in trap_matrix
+    """
+    host = _as_matrix(host_matrix)
+    allowed = np.flatnonzero(~np.asarray(excluded))
+    k = min(k, allowed.size)
+    distances, indices = engine.kneighbors(host, k=min(k + candidates, len(excluded)))
+    keep = ~excluded[indices]
+    # stable sort moves the allowed candidates to the front and keeps their order
+    order = np.argsort(~keep, axis=1, kind="stable")[:, :k]
+    complete = keep.sum(axis=1) >= k
+    distances = np.take_along_axis(distances, order, axis=1)
+    indices = np.take_along_axis(indices, order, axis=1)
+
+    missing = np.flatnonzero(~complete)
+    if missing.size > 0:
+        fallback_dist, fallback_idx = blocked_kneighbors(host[missing],
+                                                         _as_matrix(trap_matrix)[allowed], k=k)
+        distances[missing], indices[missing] = fallback_dist, allowed[fallback_idx]
+    return distances, indices
+
+
+def restore_engine(engine, trap_matrix, arrays):
+    """
+    Restore a fitted engine from its parameters, trap matrix and stored fitted arrays.
+
+    Engines list the fitted arrays that are expensive to recompute in ``fitted_arrays``.
+    Engines without such arrays are fitted again on the trap matrix.
+
+    Args:
+        engine: engine instance without fitted attributes
+        trap_matrix: ar, (m, d) composition matrix the engine was fitted on
+        arrays: dict, fitted arrays by attribute name (e.g. memory-mapped from an index)
+
+    Returns:
+        engine, the fitted engine
+    """
+    if not engine.fitted_arrays:
+        return engine.fit(trap_matrix)
+    engine.trap_ = _as_matrix(trap_matrix)
+    for name in engine.fitted_arrays:
+        setattr(engine, name, arrays[name])
+    return engine
+
+
+def get_engine(engine="kdtree", **params):
+    """
+    Create a nearest neighbor engine.
+
+    Args:
+        engine: str or engine instance, name from ENGINES or an object with fit/kneighbors
+        params: keyword arguments passed to the engine constructor
+
+    Returns:
+        engine instance
+    """
+    if not isinstance(engine, str):
+        return engine
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown nearest neighbor engine '{engine}', "
+                         f"choose one of {sorted(ENGINES)}.")
+    return ENGINES[engine](**params)
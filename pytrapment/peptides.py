@@ -0,0 +1,281 @@
+"""Module to compare large sets of peptides by 64-bit keys."""
+import numpy as np
+
+from pytrapment import sequences
+
+# peptides up to this length are packed exactly into a key (5 bits per residue)
+PACKED_MAX_LENGTH = 12
+PACKED_BITS = 5
+
+# longer peptides are hashed, the flag keeps hashed and packed keys disjoint
+HASH_FLAG = np.uint64(1 << 63)
+
+# default false-positive rate of the bloom filter prefilter
+BLOOM_FP_RATE = 0.01
+
+
+def peptide_keys(buffer, offsets):
+    """
+    Compute 64-bit keys of I/L-normalized peptides in a concatenated buffer.
+
+    Peptides with up to PACKED_MAX_LENGTH letters are packed exactly (A=1 ... Z=26, 5 bits per
+    residue), equal keys of packed peptides mean equal peptides. All other peptides are hashed
+    with sequences.peptide_hashes and flagged with the highest bit, equal keys of hashed
+    peptides have to be confirmed (see shared_peptides).
+
+    Args:
+        buffer: ar, uint8 residues of all peptides
+        offsets: ar, int64 offsets of length n+1
+
+    Returns:
+        ar, uint64 keys of the n peptides
+    """
+    bounds = sequences.chunk_bounds(offsets)
+    if len(bounds) <= 2:
+        return _peptide_keys(buffer, offsets)
+    # ranges of peptides bound the int64 temporaries of the residue-wise kernels
+    keys = np.zeros(len(offsets) - 1, dtype=np.uint64)
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        keys[first:last] = _peptide_keys(buffer[offsets[first]:offsets[last]],
+                                         offsets[first:last + 1] - offsets[first])
+    return keys
+
+
+def _peptide_keys(buffer, offsets):
+    """Compute the keys of peptides in one range (see peptide_keys)."""
+    lengths = np.diff(offsets)
+    if buffer.size == 0:
+        # only empty peptides, which are packed
+        return np.zeros(len(lengths), dtype=np.uint64)
+    keys = sequences.peptide_hashes(buffer, offsets) | HASH_FLAG
+    codes = sequences.IL_LOOKUP[buffer].astype(np.int64) - (ord("A") - 1)
+    invalid = (codes < 1) | (codes > 26)
+    peptides = np.repeat(np.arange(len(lengths)), lengths)
+    packed = (lengths <= PACKED_MAX_LENGTH) & \
+        (np.bincount(peptides[invalid], minlength=len(lengths)) == 0)
+    # residue i of a peptide ending at e is shifted by PACKED_BITS * (e - 1 - i)
+    shifts = (np.repeat(offsets[1:] - 1, lengths) - np.arange(buffer.size)) * PACKED_BITS
+    shifted = codes.astype(np.uint64) << np.minimum(shifts, 63).astype(np.uint64)
+    # the residues of packed peptides occupy disjoint bits, so the sum is exact, the cumulative
+    # sums wrap around modulo 2^64 and their differences are exact for empty peptides as well
+    sums = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(shifted)])
+    values = sums[offsets[1:]] - sums[offsets[:-1]]
+    keys[packed] = values[packed]
+    return keys
+
+
+def sequences_equal(buffer_a, offsets_a, positions_a, buffer_b, offsets_b, positions_b):
+    """
+    Compare pairs of I/L-normalized peptides from two concatenated buffers.
+
+    Args:
+        buffer_a: ar, uint8 residues of the first peptide set
+        offsets_a: ar, int64 offsets of the first peptide set
+        positions_a: ar, peptide positions in the first set
+        buffer_b: ar, uint8 residues of the second peptide set
+        offsets_b: ar, int64 offsets of the second peptide set
+        positions_b: ar, peptide positions in the second set (same length as positions_a)
+
+    Returns:
+        ar, bool for every pair
+    """
+    starts_a, starts_b = offsets_a[positions_a], offsets_b[positions_b]
+    lengths = offsets_a[positions_a + 1] - starts_a
+    equal = lengths == (offsets_b[positions_b + 1] - starts_b)
+    lengths = np.where(equal, lengths, 0)
+    # residue-wise comparison of all pairs with the same length
+    pairs = np.repeat(np.arange(len(lengths)), lengths)
+    within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    residues_a = sequences.IL_LOOKUP[buffer_a[starts_a[pairs] + within]]
+    residues_b = sequences.IL_LOOKUP[buffer_b[starts_b[pairs] + within]]
+    mismatches = np.bincount(pairs[residues_a != residues_b], minlength=len(lengths))
+    return equal & (mismatches == 0)
+
+
+class BloomFilter:
+    """
+    Bloom filter over 64-bit peptide keys stored in a numpy bit array.
+
+    The probe positions are derived from one mixed 64-bit value per key (double hashing).
+
+    Args:
+        n_items: int, expected number of keys
+        fp_rate: float, target false-positive rate
+    """
+
+    def __init__(self, n_items, fp_rate=BLOOM_FP_RATE):
+        """Allocate an empty filter."""
+        if not 0 < fp_rate < 1:
+            raise ValueError(f"fp_rate must be in (0, 1), got {fp_rate}.")
+        n_items = max(n_items, 1)
+        n_bits = int(np.ceil(-n_items * np.log(fp_rate) / np.log(2) ** 2))
+        self.n_bits = max(64, (n_bits + 63) // 64 * 64)
+        self.n_hashes = max(1, int(round(self.n_bits / n_items * np.log(2))))
+        self.fp_rate = fp_rate
+        self.bits = np.zeros(self.n_bits // 64, dtype=np.uint64)
+
+    @property
+    def nbytes(self):
+        """Return the size of the bit array in bytes."""
+        return self.bits.nbytes
+
+    def _positions(self, keys, probe):
+        """Compute the bit positions of one probe for all keys."""
+        mixed = sequences._splitmix64(np.asarray(keys, dtype=np.uint64))
+        low, high = mixed & np.uint64(0xFFFFFFFF), (mixed >> np.uint64(32)) | np.uint64(1)
+        return (low + np.uint64(probe) * high) % np.uint64(self.n_bits)
+
+    def add(self, keys):
+        """
+        Add keys to the filter.
+
+        Args:
+            keys: ar, uint64 peptide keys
+
+        Returns:
+            BloomFilter, self
+        """
+        for probe in range(self.n_hashes):
+            positions = self._positions(keys, probe)
+            np.bitwise_or.at(self.bits, positions >> np.uint64(6),
+                             np.uint64(1) << (positions & np.uint64(63)))
+        return self
+
+    def contains(self, keys):
+        """
+        Test keys for membership, false positives occur at about fp_rate.
+
+        Args:
+            keys: ar, uint64 peptide keys
+
+        Returns:
+            ar, bool mask (False: the key was never added)
+        """
+        found = np.ones(len(keys), dtype=bool)
+        for probe in range(self.n_hashes):
+            positions = self._positions(keys, probe)
+            words = self.bits[positions >> np.uint64(6)]
+            found &= (words >> (positions & np.uint64(63))) & np.uint64(1) == 1
+        return found
+
+
+class PeptideLookup:
+    """
+    Sorted keys of reference peptides for repeated shared-peptide queries.
+
+    The reference keys are sorted (and the bloom filter is built) once, so the entrapment
+    peptides can be looked up chunk by chunk. The bloom filter statistics are accumulated over
+    all queries.
+
+    Args:
+        ref_buffer: ar, uint8 residues of the reference peptides
+        ref_offsets: ar, int64 offsets of the reference peptides
+        ref_keys: ar, precomputed peptide_keys of the reference peptides (optional)
+        bloom_fp_rate: float, false-positive rate of the bloom prefilter (None: no prefilter)
+    """
+
+    def __init__(self, ref_buffer, ref_offsets, ref_keys=None, bloom_fp_rate=None):
+        """Sort the reference keys."""
+        if ref_keys is None:
+            ref_keys = peptide_keys(ref_buffer, ref_offsets)
+        self.ref_buffer = ref_buffer
+        self.ref_offsets = ref_offsets
+        self.ref_order = np.argsort(ref_keys, kind="stable")
+        self.sorted_keys = ref_keys[self.ref_order]
+        self.bloom = None if bloom_fp_rate is None else \
+            BloomFilter(len(ref_keys), bloom_fp_rate).add(ref_keys)
+        self.n_queries, self.n_candidates, self.n_shared = 0, 0, 0
+
+    @property
+    def nbytes(self):
+        """Return the size of the sorted keys and the bloom filter in bytes."""
+        bloom_bytes = 0 if self.bloom is None else self.bloom.nbytes
+        return self.ref_order.nbytes + self.sorted_keys.nbytes + bloom_bytes
+
+    def shared(self, query_buffer, query_offsets, query_keys=None):
+        """
+        Find the query peptides that also occur (I/L-normalized) in the reference peptides.
+
+        Args:
+            query_buffer: ar, uint8 residues of the query peptides
+            query_offsets: ar, int64 offsets of the query peptides
+            query_keys: ar, precomputed peptide_keys of the query peptides (optional)
+
+        Returns:
+            ar, bool mask over the query peptides
+        """
+        if query_keys is None:
+            query_keys = peptide_keys(query_buffer, query_offsets)
+        if self.bloom is None:
+            candidates = np.arange(len(query_keys))
+        else:
+            candidates = np.flatnonzero(self.bloom.contains(query_keys))
+
+        shared = np.zeros(len(query_keys), dtype=bool)
+        first = np.searchsorted(self.sorted_keys, query_keys[candidates], side="left")
+        last = np.searchsorted(self.sorted_keys, query_keys[candidates], side="right")
+        shared[candidates] = last > first
+        # hits of hashed keys (relative to candidates)
+        hashed = np.flatnonzero((last > first) & (query_keys[candidates] >= HASH_FLAG))
+        if len(hashed) > 0:
+            # compare hashed hits with the first reference peptide with the same key
+            confirmed = sequences_equal(query_buffer, query_offsets, candidates[hashed],
+                                        self.ref_buffer, self.ref_offsets,
+                                        self.ref_order[first[hashed]])
+            shared[candidates[hashed[~confirmed]]] = False
+            # (rare) the first reference peptide was a collision, compare with the others
+            for hit in hashed[~confirmed]:
+                others = self.ref_order[first[hit] + 1:last[hit]]
+                shared[candidates[hit]] = sequences_equal(
+                    query_buffer, query_offsets, np.full(len(others), candidates[hit]),
+                    self.ref_buffer, self.ref_offsets, others).any()
+
+        self.n_queries += len(query_keys)
+        self.n_candidates += len(candidates)
+        self.n_shared += int(shared.sum())
+        return shared
+
+    def update_metrics(self, metrics):
+        """
+        Write size and measured false-positive rate of the bloom filter (if any).
+
+        Args:
+            metrics: dict, receives the bloom filter statistics of all queries so far
+        """
+        if self.bloom is None:
+            return
+        negatives = self.n_queries - self.n_shared
+        metrics.update({"bloom_bytes": self.bloom.nbytes, "bloom_hashes": self.bloom.n_hashes,
+                        "bloom_fp_rate_target": self.bloom.fp_rate,
+                        "bloom_fp_rate": float((self.n_candidates - self.n_shared)
+                                               / max(negatives, 1))})
+
+
+def shared_peptides(query_buffer, query_offsets, ref_buffer, ref_offsets, query_keys=None,
+                    ref_keys=None, bloom_fp_rate=None, metrics=None):
+    """
+    Find the query peptides that also occur (I/L-normalized) in the reference peptides.
+
+    The query keys are looked up in the sorted reference keys, only hits of hashed keys are
+    compared residue by residue to rule out hash collisions. With bloom_fp_rate, a bloom filter
+    over the reference keys rejects most query peptides before the exact lookup.
+
+    Args:
+        query_buffer: ar, uint8 residues of the query peptides
+        query_offsets: ar, int64 offsets of the query peptides
+        ref_buffer: ar, uint8 residues of the reference peptides
+        ref_offsets: ar, int64 offsets of the reference peptides
+        query_keys: ar, precomputed peptide_keys of the query peptides (optional)
+        ref_keys: ar, precomputed peptide_keys of the reference peptides (optional)
+        bloom_fp_rate: float, false-positive rate of the bloom prefilter (None: no prefilter)
+        metrics: dict, receives size and measured false-positive rate of the bloom filter
+
+    Returns:
+        ar, bool mask over the query peptides
+    """
+    lookup = PeptideLookup(ref_buffer, ref_offsets, ref_keys=ref_keys,
+                           bloom_fp_rate=bloom_fp_rate)
+    shared = lookup.shared(query_buffer, query_offsets, query_keys=query_keys)
+    if metrics is not None:
+        lookup.update_metrics(metrics)
+    return shared
@@ -0,0 +1,158 @@
+"""Module to profile pipeline stages with cProfile and a sampling stack profiler."""
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+from contextlib import contextmanager
+
+# environment variable that enables profiling (1, true, yes or on)
+PROFILE_ENV = "PYTRAPMENT_PROFILE"
+
+# seconds between two stack samples
+SAMPLE_INTERVAL = 0.005
+
+
+def profile_enabled(flag=False):
+    """
+    Check if profiling is requested by a flag or the PYTRAPMENT_PROFILE environment variable.
+
+    Args:
+        flag: bool, profiling requested on the command line
+
+    Returns:
+        bool
+    """
+    return flag or os.environ.get(PROFILE_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def frame_name(frame):
+    """Return the name of a frame in collapsed stacks, e.g. cleave_offsets (digest.py:120)."""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Sampling profiler that counts the call stacks of a thread at a fixed interval.
+
+    The samples are taken by a background thread, the profiled code is not instrumented. The
+    counts are stored as collapsed stacks (root;...;leaf), the input format of flamegraph tools.
+
+    Args:
+        interval: float, seconds between two samples
+        thread_id: int, thread to sample (None: the thread that calls start)
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None):
+        """Create a stopped sampler."""
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        """Take samples until stopped."""
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        """
+        Start sampling.
+
+        Returns:
+            StackSampler, self
+        """
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop sampling.
+
+        Returns:
+            StackSampler, self
+        """
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def collapsed(self):
+        """
+        Return the samples as collapsed stacks.
+
+        Returns:
+            str, one 'root;...;leaf count' line per stack
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class StageProfiler:
+    """
+    Profile pipeline stages, every stage writes profile_<stage>.pstats and .collapsed files.
+
+    Repeated stages (e.g. host and trap parsing) are accumulated into the same files.
+
+    Args:
+        out_dir: str, directory of the profile files
+        interval: float, seconds between two stack samples
+    """
+
+    def __init__(self, out_dir, interval=SAMPLE_INTERVAL):
+        """Create the profiler."""
+        self.out_dir = out_dir
+        self.interval = interval
+        self.profiles = {}
+        self.samplers = {}
+
+    def paths(self, name):
+        """
+        Return the locations of the profile files of a stage.
+
+        Args:
+            name: str, name of the stage
+
+        Returns:
+            (str, str), locations of the pstats and the collapsed stacks file
+        """
+        prefix = os.path.join(self.out_dir, f"profile_{name}")
+        return f"{prefix}.pstats", f"{prefix}.collapsed"
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Profile a stage and write its files when the stage ends.
+
+        Args:
+            name: str, name of the stage
+
+        Returns:
+            contextmanager
+        """
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        sampler = self.samplers.setdefault(name, StackSampler(self.interval))
+        sampler.thread_id = threading.get_ident()
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            pstats_file, collapsed_file = self.paths(name)
+            os.makedirs(self.out_dir, exist_ok=True)
+            pstats.Stats(profile).dump_stats(pstats_file)
+            with open(collapsed_file, mode="w") as cfile:
+                cfile.write(sampler.collapsed())
@@ -1,80 +1,175 @@
 """Module to perform QC on the xiRT performance."""
 import os
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import seaborn as sns
-from pyteomics import electrochem
 
-sns.set(context="notebook", style="white", palette="deep", font_scale=1)
+from pytrapment import features, render, sequences, summaries
 
+# features summarized and plotted by the QC
+QC_FEATURES = ["length", "KR", "aromatic", "acids", "aliphatic", "HGP", "isoelectric_point",
+               "gravy"]
 
-def compute_sequence_features(peptides_df):
+# fixed histogram bins of the QC features (integer features are binned per value)
+FEATURE_EDGES = {"length": np.arange(-0.5, 101),
+                 **{group: np.arange(-0.5, 41) for group in features.FEATURE_GROUPS},
+                 "isoelectric_point": np.linspace(0, 14, 141),
+                 "gravy": np.linspace(-4.5, 4.5, 91)}
+
+# number of peptides aggregated at once
+CHUNK_ROWS = 2 ** 20
+
+
+def peptide_features(buffer, offsets, groups=features.FEATURE_GROUPS, scales=("gravy",)):
+    """
+    Compute the QC features of peptides from their residue buffer.
+
+    Args:
+        buffer: ar, uint8 residues of the peptides
+        offsets: ar, int64 offsets of length n+1
+        groups: dict, feature groups counted for every peptide (see features.FEATURE_GROUPS)
+        scales: list, hydropathy scales averaged for every peptide, names in
+            features.HYDROPATHY_SCALES or dicts with residue values (see features.scale_names)
+
+    Returns:
+        df, one column per feature
+    """
+    # all residues are counted in a single pass over the peptide buffer
+    counts = features.residue_counts(buffer, offsets)
+    features_df = pd.DataFrame({"length": np.diff(offsets)})
+
+    # amino acid counts
+    features_df[list(groups)] = features.group_counts(counts, groups)
+
+    # sequence properties
+    features_df["isoelectric_point"] = features.isoelectric_points(counts)
+    features_df[features.scale_names(scales)] = features.hydropathy(counts, scales)
+    return features_df
+
+
+def compute_sequence_features(peptides_df, groups=features.FEATURE_GROUPS, scales=("gravy",)):
     """
     Compute features to evaluate database.
 
     Parameters:
         peptides_df : df
             dataframe with peptides.
+        groups : dict
+            feature groups counted for every peptide (see features.FEATURE_GROUPS).
+        scales : list
+            hydropathy scales averaged for every peptide, names in features.HYDROPATHY_SCALES
+            or dicts with residue values (see features.scale_names).
 
     Returns:
         None.
     """
-    # features
-    seq = "sequence"
-    peptides_df["length"] = peptides_df["sequence"].apply(len)
+    features_df = peptide_features(*sequences.encode_sequences(peptides_df["sequence"].values),
+                                   groups=groups, scales=scales)
+    for column in features_df.columns:
+        peptides_df[column] = features_df[column].values
+    return peptides_df
 
-    # amino acid counts
-    peptides_df["KR"] = peptides_df[seq].str.count("K") + peptides_df[seq].str.count("R")
-    peptides_df["aromatic"] = peptides_df[seq].str.count("F") + peptides_df[seq].str.count("W") + \
-        peptides_df[seq].str.count("Y")
-    peptides_df["acids"] = peptides_df[seq].str.count("D") + peptides_df[seq].str.count("E")
-    peptides_df["aliphatic"] = peptides_df[seq].str.count("A") + peptides_df[seq].str.count("I") + \
-        peptides_df[seq].str.count("L") + peptides_df[seq].str.count("M") + \
-        peptides_df[seq].str.count("V")
-    peptides_df["HGP"] = peptides_df[seq].str.count("G") + peptides_df[seq].str.count("P") + \
-        peptides_df[seq].str.count("H")
 
-    # sequence properties
-    peptides_df["isoelectric_point"] = [electrochem.pI(x) for x in peptides_df["sequence"].values]
-    peptides_df["gravy"] = [electrochem.gravy(x) for x in peptides_df["sequence"].values]
-    return peptides_df
+def summarize_features(features_df, db_type, summary=None, chunk_size=CHUNK_ROWS):
+    """
+    Add peptides with features to the streaming QC summary.
 
+    Args:
+        features_df: df, peptides with features (see compute_sequence_features)
+        db_type: str, database type of the peptides (host or trap)
+        summary: QCSummary, summary to update (None: new summary over QC_FEATURES)
+        chunk_size: int, number of peptides aggregated at once
 
-def qc_peptides(features_df_host, features_df_trap, out_dir):
+    Returns:
+        QCSummary, the updated summary
+    """
+    if summary is None:
+        summary = summaries.QCSummary(FEATURE_EDGES)
+    for start in range(0, len(features_df), chunk_size):
+        summary.update(features_df.iloc[start:start + chunk_size], db_type)
+    return summary
+
+
+def summarize_peptides(peptide_dfs, db_type, summary=None):
+    """
+    Compute the features of peptide chunks and add them to the streaming QC summary.
+
+    Only the features of a single chunk are kept in memory.
+
+    Args:
+        peptide_dfs: iterable of df, peptide chunks (e.g. MatchResult.iter_peptide_dfs)
+        db_type: str, database type of the peptides (host or trap)
+        summary: QCSummary, summary to update (None: new summary over QC_FEATURES)
+
+    Returns:
+        QCSummary, the updated summary
+    """
+    if summary is None:
+        summary = summaries.QCSummary(FEATURE_EDGES)
+    for peptides_df in peptide_dfs:
+        summarize_features(compute_sequence_features(peptides_df), db_type, summary)
+    return summary
+
+
+def summarize_peptide_arrays(peptide_chunks, db_type, summary=None):
+    """
+    Compute the features of peptide buffers and add them to the streaming QC summary.
+
+    The features are computed from the residues directly, no peptide strings are created.
+
+    Args:
+        peptide_chunks: iterable of (ar, ar), uint8 residues and int64 offsets of peptides
+            (e.g. MatchResult.iter_peptide_arrays)
+        db_type: str, database type of the peptides (host or trap)
+        summary: QCSummary, summary to update (None: new summary over QC_FEATURES)
+
+    Returns:
+        QCSummary, the updated summary
+    """
+    if summary is None:
+        summary = summaries.QCSummary(FEATURE_EDGES)
+    for buffer, offsets in peptide_chunks:
+        summarize_features(peptide_features(buffer, offsets), db_type, summary)
+    return summary
+
+
+def plot_summary(summary, out_dir, kind="box", formats=("png",)):
+    """
+    Plot the peptide features of a QC summary.
+
+    Args:
+        summary: QCSummary, summarized peptide features
+        out_dir: str, path to store qc data
+        kind: str, box or violin (see render.PLOT_KINDS)
+        formats: list, output formats (see render.PLOT_FORMATS)
+
+    Returns:
+        list, locations of the plots
+    """
+    features = [feature for feature in QC_FEATURES if feature in summary.features]
+    return [render.render_summary(summary, os.path.join(out_dir, f"qc_plot.{plot_format}"),
+                                  features=features, kind=kind)
+            for plot_format in formats]
+
+
+def qc_peptides(features_df_host, features_df_trap, out_dir, kind="box", formats=("png",)):
     """
     Plot a boxplot for the different peptide features.
 
+    The features are aggregated chunk-wise into streaming summaries (quantile sketches,
+    moments and histograms), the plot is rendered from the summaries.
+
     Args:
         features_df_host: df, host peptides with features
         features_df_trap: df, trap peptides with features
         out_dir: str, path to store qc data
+        kind: str, box or violin (see render.PLOT_KINDS)
+        formats: list, output formats (see render.PLOT_FORMATS)
 
     Returns:
-        None
+        QCSummary, summarized peptide features
     """
-    # make single df
-    features_df = pd.concat([features_df_host, features_df_trap])
-
-    # melt for easier plotting
-    features_melt = features_df.melt(id_vars=["Type", "sequence"],
-                                     value_vars=['length', 'KR', 'aromatic', 'acids', 'aliphatic',
-                                                 'HGP', 'isoelectric_point', 'gravy'])
-
-    # some log-values
-    features_melt["log_value"] = np.log2(features_melt["value"])
-
-    # peptides
-    g = sns.FacetGrid(features_melt, col='variable', sharey=False, col_wrap=4)
-    g.map_dataframe(sns.boxplot, x='Type', y='value', color="darkgrey")
-    g.map_dataframe(sns.boxplot, x='Type', y='value', color="darkgrey")
-    g.axes[4].set(xlabel="Peptide Properties")
-    g.axes[7].set(xlabel="Peptide Properties")
-    g.axes[5].set(xlabel="Peptide Properties")
-    g.axes[6].set(xlabel="Peptide Properties")
-    g.axes[0].set(ylabel="counts / value")
-    g.axes[4].set(ylabel="counts / value")
-    plt.tight_layout()
-
-    g.savefig(os.path.join(out_dir, "qc_plot.png"))
+    summary = summarize_features(features_df_host, "host")
+    summarize_features(features_df_trap, "trap", summary)
+    plot_summary(summary, out_dir, kind=kind, formats=formats)
+    return summary
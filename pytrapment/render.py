@@ -0,0 +1,167 @@
+"""Module to render QC plots from feature summaries on the headless Agg canvas."""
+import os
+
+import numpy as np
+
+# glyphs drawn per database type and feature
+PLOT_KINDS = ["box", "violin"]
+
+# supported output formats
+PLOT_FORMATS = ["png", "svg", "pdf"]
+
+# fill color of the glyphs
+GLYPH_COLOR = "darkgrey"
+
+
+def box_stats(feature_summary, label):
+    """
+    Compute the box plot statistics of a feature summary.
+
+    Whiskers extend to 1.5 times the interquartile range, clipped to the observed range.
+
+    Args:
+        feature_summary: FeatureSummary, summary of a feature
+        label: str, label of the box
+
+    Returns:
+        dict, statistics for matplotlib bxp
+    """
+    q1, med, q3 = feature_summary.quantile([0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    return {"label": label, "med": med, "q1": q1, "q3": q3, "fliers": [],
+            "whislo": max(feature_summary.min, q1 - 1.5 * iqr),
+            "whishi": min(feature_summary.max, q3 + 1.5 * iqr)}
+
+
+def violin_outline(feature_summary, width=0.8):
+    """
+    Compute the outline of a violin from the histogram of a feature summary.
+
+    The outline follows the bin densities, empty bins at both ends are trimmed and the widest
+    bin spans the given width. Values below or above the histogram edges are drawn as one
+    extra bin that extends to the observed minimum or maximum.
+
+    Args:
+        feature_summary: FeatureSummary, summary of a feature
+        width: float, maximal width of the violin
+
+    Returns:
+        (ar, ar), positions and half widths of the outline
+    """
+    edges, counts = feature_summary.edges, feature_summary.histogram
+    if feature_summary.underflow > 0 and feature_summary.min < edges[0]:
+        edges = np.concatenate([[feature_summary.min], edges])
+        counts = np.concatenate([[feature_summary.underflow], counts])
+    if feature_summary.overflow > 0 and feature_summary.max > edges[-1]:
+        edges = np.concatenate([edges, [feature_summary.max]])
+        counts = np.concatenate([counts, [feature_summary.overflow]])
+    filled = np.flatnonzero(counts)
+    if len(filled) == 0:
+        return np.zeros(0), np.zeros(0)
+    first, last = filled[0], filled[-1] + 1
+    density = counts[first:last] / np.diff(edges)[first:last]
+    # step outline, every bin contributes its lower and upper edge
+    positions = np.repeat(edges[first:last + 1], 2)[1:-1]
+    half_widths = np.repeat(density / density.max() * width / 2., 2)
+    return positions, half_widths
+
+
+def draw_box(ax, stats):
+    """
+    Draw box glyphs.
+
+    Args:
+        ax: matplotlib axes
+        stats: list of dict, box_stats per glyph
+
+    Returns:
+        None
+    """
+    ax.bxp(stats, patch_artist=True, boxprops={"facecolor": GLYPH_COLOR},
+           medianprops={"color": "black"})
+
+
+def draw_violin(ax, summaries, stats):
+    """
+    Draw violin glyphs with the quartiles and median marked inside.
+
+    Args:
+        ax: matplotlib axes
+        summaries: list of FeatureSummary, summary per glyph
+        stats: list of dict, box_stats per glyph
+
+    Returns:
+        None
+    """
+    for position, (feature_summary, box) in enumerate(zip(summaries, stats), start=1):
+        values, half_widths = violin_outline(feature_summary)
+        ax.fill_betweenx(values, position - half_widths, position + half_widths,
+                         facecolor=GLYPH_COLOR, edgecolor="black", linewidth=0.8)
+        ax.vlines(position, box["whislo"], box["whishi"], color="black", linewidth=0.8)
+        ax.vlines(position, box["q1"], box["q3"], color="black", linewidth=4)
+        ax.plot(position, box["med"], marker="o", color="white", markersize=3)
+        # values outside the histogram edges are spread thinly, their number is labeled
+        if feature_summary.overflow > 0:
+            ax.text(position, feature_summary.max, f"{feature_summary.overflow} > "
+                    f"{feature_summary.edges[-1]:g}", ha="center", va="bottom", fontsize=7)
+        if feature_summary.underflow > 0:
+            ax.text(position, feature_summary.min, f"{feature_summary.underflow} < "
+                    f"{feature_summary.edges[0]:g}", ha="center", va="top", fontsize=7)
+    ax.set_xticks(range(1, len(stats) + 1))
+    ax.set_xticklabels([box["label"] for box in stats])
+
+
+def render_summary(summary, out_file, features=None, kind="box", ncols=4, dpi=100):
+    """
+    Render the QC plot of a summary into a png, svg or pdf file.
+
+    Only the precomputed quantiles and histograms are drawn, the time does not depend on the
+    number of summarized peptides. No pyplot state is used.
+
+    Args:
+        summary: QCSummary, summarized peptide features
+        out_file: str, location of the plot, the extension selects the format
+        features: list, features to plot (None: all features of the summary)
+        kind: str, box or violin
+        ncols: int, number of panels per row
+        dpi: int, resolution of raster output
+
+    Returns:
+        str, location of the plot
+    """
+    if kind not in PLOT_KINDS:
+        raise ValueError(f"kind must be one of {PLOT_KINDS}, got {kind}.")
+    plot_format = os.path.splitext(out_file)[1].lstrip(".").lower()
+    if plot_format not in PLOT_FORMATS:
+        raise ValueError(f"Plot format must be one of {PLOT_FORMATS}, got {out_file}.")
+    # matplotlib is only imported when a plot is rendered
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    features = summary.features if features is None else features
+    nrows = int(np.ceil(len(features) / ncols))
+
+    fig = Figure(figsize=(3 * ncols, 3 * nrows))
+    FigureCanvasAgg(fig)
+    axes = np.atleast_2d(fig.subplots(nrows, ncols, squeeze=False))
+    for ax, feature in zip(axes.flat, features):
+        types = [db_type for db_type in summary.types if summary[db_type, feature].count > 0]
+        summaries = [summary[db_type, feature] for db_type in types]
+        stats = [box_stats(feature_summary, db_type)
+                 for feature_summary, db_type in zip(summaries, types)]
+        if kind == "box" and stats:
+            draw_box(ax, stats)
+        elif stats:
+            draw_violin(ax, summaries, stats)
+        ax.set_title(f"variable = {feature}")
+        ax.spines["top"].set_visible(False)
+        ax.spines["right"].set_visible(False)
+    for ax in axes.flat[len(features):]:
+        ax.set_visible(False)
+    for ax in axes[-1]:
+        ax.set_xlabel("Peptide Properties")
+    for ax in axes[:, 0]:
+        ax.set_ylabel("counts / value")
+    fig.tight_layout()
+    fig.savefig(out_file, format=plot_format, dpi=dpi)
+    return out_file
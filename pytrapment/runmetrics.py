@@ -0,0 +1,135 @@
+"""Module to record per-stage timing and throughput metrics of a run."""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of the process in bytes.
+
+    Returns:
+        int, peak RSS (None if the platform does not report it)
+    """
+    if resource is None:  # pragma: no cover
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def cpu_time():
+    """
+    Return the CPU time of the process and its finished child processes in seconds.
+
+    Returns:
+        float, user and system time
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class RunMetrics(dict):
+    """
+    Run metrics: scalar values (e.g. of the bloom filter) and a record per pipeline stage.
+
+    Every stage record holds the wall time, the CPU time (including finished child processes),
+    the number of processed items, the throughput and the growth of the peak RSS. Stages that
+    run several times (e.g. chunks) are accumulated.
+
+    Args:
+        profiler: StageProfiler, profiles every stage (None: no profiling)
+    """
+
+    def __init__(self, *args, profiler=None, **kwargs):
+        """Create empty metrics."""
+        super().__init__(*args, **kwargs)
+        self.setdefault("stages", {})
+        self.profiler = profiler
+
+    @property
+    def stages(self):
+        """Return the stage records by stage name."""
+        return self["stages"]
+
+    @contextmanager
+    def stage(self, name, items=None):
+        """
+        Measure a stage, the yielded record may be updated (e.g. with the number of items).
+
+        Args:
+            name: str, name of the stage
+            items: int, number of items processed by the stage
+
+        Returns:
+            contextmanager yielding dict, the record of this run of the stage
+        """
+        record = {"items": items}
+        profile = nullcontext() if self.profiler is None else self.profiler.profile(name)
+        start_wall, start_cpu, start_rss = time.perf_counter(), cpu_time(), peak_rss()
+        try:
+            with profile:
+                yield record
+        finally:
+            record["wall_time"] = time.perf_counter() - start_wall
+            record["cpu_time"] = cpu_time() - start_cpu
+            end_rss = peak_rss()
+            record["peak_rss"] = end_rss
+            record["peak_rss_delta"] = None if end_rss is None else end_rss - start_rss
+            self._add(name, record)
+
+    def _add(self, name, record):
+        """Add a record to the stage, repeated runs are summed up."""
+        stage = self.stages.setdefault(name, {"calls": 0, "wall_time": 0., "cpu_time": 0.,
+                                              "items": None, "peak_rss": None,
+                                              "peak_rss_delta": None})
+        stage["calls"] += 1
+        stage["wall_time"] += record["wall_time"]
+        stage["cpu_time"] += record["cpu_time"]
+        if record["items"] is not None:
+            stage["items"] = (stage["items"] or 0) + int(record["items"])
+        if record["peak_rss"] is not None:
+            stage["peak_rss"] = record["peak_rss"]
+            stage["peak_rss_delta"] = (stage["peak_rss_delta"] or 0) + record["peak_rss_delta"]
+        stage["items_per_second"] = None if stage["items"] is None or stage["wall_time"] == 0 \
+            else stage["items"] / stage["wall_time"]
+
+    def report(self):
+        """
+        Format the stage records as text table.
+
+        Returns:
+            str, one line per stage
+        """
+        width = max([14] + [len(name) + 2 for name in self.stages])
+        lines = [f"{'stage':<{width}}{'wall [s]':>10}{'cpu [s]':>10}{'items':>12}{'items/s':>12}"
+                 f"{'peak RSS +MiB':>15}"]
+        for name, stage in self.stages.items():
+            items = "" if stage["items"] is None else stage["items"]
+            rate = "" if stage["items_per_second"] is None else f"{stage['items_per_second']:.0f}"
+            rss = "" if stage["peak_rss_delta"] is None else \
+                f"{stage['peak_rss_delta'] / 2 ** 20:.1f}"
+            lines.append(f"{name:<{width}}{stage['wall_time']:>10.2f}{stage['cpu_time']:>10.2f}"
+                         f"{items:>12}{rate:>12}{rss:>15}")
+        return "\n".join(lines)
+
+    def write(self, path):
+        """
+        Write the metrics as json.
+
+        Args:
+            path: str, location of the json file
+
+        Returns:
+            str, location of the json file
+        """
+        with open(path, mode="w") as mfile:
+            json.dump(self, mfile, indent=2)
+        return path
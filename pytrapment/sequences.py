@@ -0,0 +1,387 @@
+"""Module with byte-level kernels on concatenated protein sequences."""
+import numpy as np
+import pandas as pd
+from pyteomics import fasta, parser
+
+# ambiguous (X, B, Z) and rare (U, O) amino acids, counted after the standard amino acids
+NONSTANDARD_AMINO_ACIDS = ["X", "B", "Z", "U", "O"]
+
+# policies for nonstandard amino acids in the composition kernel
+NONSTANDARD_POLICIES = ["separate", "ignore", "raise"]
+
+# number of residues processed at once by the kernels, bounds their temporary arrays
+CHUNK_RESIDUES = 2 ** 18
+
+# residues per line in written fasta files (same as pyteomics.fasta.write)
+FASTA_LINE_WIDTH = 70
+
+# base of the polynomial peptide hash (64-bit FNV prime)
+HASH_BASE = np.uint64(0x100000001B3)
+
+# byte lookup that maps I to L (same mass) and keeps all other bytes
+IL_LOOKUP = np.arange(256, dtype=np.uint8)
+IL_LOOKUP[ord("I")] = ord("L")
+
+
+def encode_sequences(sequences, encoding="ascii"):
+    """
+    Concatenate sequences into a single uint8 buffer with an offsets array.
+
+    Args:
+        sequences: iterable of str, protein sequences
+        encoding: str, text encoding of the strings
+
+    Returns:
+        (buffer, offsets), uint8 residues and int64 offsets of length n+1, sequence i is
+        buffer[offsets[i]:offsets[i+1]]
+    """
+    encoded = [sequence.encode(encoding) for sequence in sequences]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(sequence) for sequence in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def chunk_bounds(offsets, chunk_residues=None):
+    """
+    Split consecutive sequences into ranges of about chunk_residues residues.
+
+    Args:
+        offsets: ar, int64 offsets of length n+1
+        chunk_residues: int, residues per range, a range holds at least one sequence (default:
+            CHUNK_RESIDUES)
+
+    Returns:
+        ar, int64 range borders from 0 to n (range i is bounds[i]:bounds[i+1])
+    """
+    chunk_residues = CHUNK_RESIDUES if chunk_residues is None else chunk_residues
+    n_seqs = len(offsets) - 1
+    starts = np.searchsorted(offsets[:-1], np.arange(offsets[0], offsets[-1], chunk_residues))
+    return np.unique(np.concatenate([[0], starts, [n_seqs]]).astype(np.int64))
+
+
+def composition_columns(nonstandard="separate"):
+    """
+    Return the column labels of the composition matrix.
+
+    Args:
+        nonstandard: str, policy for nonstandard amino acids (see composition_matrix)
+
+    Returns:
+        list, std_amino_acids order followed by the nonstandard amino acids if separate
+    """
+    if nonstandard not in NONSTANDARD_POLICIES:
+        raise ValueError(f"Unknown policy '{nonstandard}' for nonstandard amino acids, "
+                         f"choose one of {NONSTANDARD_POLICIES}.")
+    if nonstandard == "separate":
+        return parser.std_amino_acids + NONSTANDARD_AMINO_ACIDS
+    return list(parser.std_amino_acids)
+
+
+def residue_lookup(columns):
+    """
+    Build a lookup table from byte values to column positions.
+
+    Upper and lower case letters map to the same column, all other bytes map to len(columns).
+
+    Args:
+        columns: list, one-letter amino acid codes
+
+    Returns:
+        ar, uint8 array with 256 entries
+    """
+    lookup = np.full(256, len(columns), dtype=np.uint8)
+    for ii, aa in enumerate(columns):
+        lookup[ord(aa)] = ii
+        lookup[ord(aa.lower())] = ii
+    return lookup
+
+
+def composition_matrix(buffer, offsets, nonstandard="separate", dtype=np.float32):
+    """
+    Count the amino acids of all sequences in a concatenated buffer.
+
+    Nonstandard amino acids (X, B, Z, U, O) are handled by an explicit policy:
+    'separate' counts them in extra columns after the standard amino acids, 'ignore' drops
+    them and 'raise' raises a ValueError if any of them occurs. Other characters are not
+    counted ('raise' rejects them as well).
+
+    Args:
+        buffer: ar, uint8 residues of all sequences
+        offsets: ar, int64 offsets of length n+1
+        nonstandard: str, policy for nonstandard amino acids
+        dtype: numpy dtype of the counts (e.g. uint16 for peptides)
+
+    Returns:
+        ar, matrix (n, len(composition_columns(nonstandard)))
+    """
+    columns = composition_columns(nonstandard)
+    n_cols = len(columns)
+    codes = residue_lookup(columns)[buffer]
+    if nonstandard == "raise" and np.any(codes == n_cols):
+        invalid = sorted(set(bytes(buffer[codes == n_cols]).decode("ascii", "replace")))
+        raise ValueError(f"Sequences contain nonstandard amino acids: {invalid}.")
+
+    n_seqs = len(offsets) - 1
+    counts = np.zeros((n_seqs, n_cols), dtype=dtype)
+    start = 0
+    while start < n_seqs:
+        # proteins in a chunk are counted with a single bincount over (protein, residue) keys
+        stop = np.searchsorted(offsets, offsets[start] + CHUNK_RESIDUES, side="right") - 1
+        stop = min(max(stop, start + 1), n_seqs)
+        lengths = np.diff(offsets[start:stop + 1])
+        keys = np.repeat(np.arange(stop - start, dtype=np.int64) * (n_cols + 1), lengths)
+        keys += codes[offsets[start]:offsets[stop]]
+        chunk = np.bincount(keys, minlength=(stop - start) * (n_cols + 1))
+        counts[start:stop] = chunk.reshape(stop - start, n_cols + 1)[:, :n_cols]
+        start = stop
+    return counts
+
+
+def format_record(header, sequence, line_width=FASTA_LINE_WIDTH):
+    """
+    Format a FASTA record with the sequence wrapped to a fixed line width.
+
+    Args:
+        header: bytes, record header without '>'
+        sequence: bytes, residues of the record
+        line_width: int, residues per line
+
+    Returns:
+        bytes, the formatted record
+    """
+    lines = [sequence[start:start + line_width] for start in range(0, len(sequence), line_width)]
+    return b">" + header + b"\n" + b"".join(line + b"\n" for line in lines)
+
+
+def _splitmix64(values):
+    """Finalize 64-bit hashes with the splitmix64 mixer (uint64 arithmetic wraps around)."""
+    values = values ^ (values >> np.uint64(30))
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def peptide_hashes(buffer, offsets):
+    """
+    Compute 64-bit hashes of I/L-normalized peptides in a concatenated buffer.
+
+    I and L have the same mass, so both are hashed as L. The hash is a polynomial hash over
+    the residues modulo 2^64, computed for all peptides at once, followed by a bit mixer.
+
+    Args:
+        buffer: ar, uint8 residues of all peptides
+        offsets: ar, int64 offsets of length n+1
+
+    Returns:
+        ar, uint64 hashes of the n peptides
+    """
+    lengths = np.diff(offsets)
+    if buffer.size == 0:
+        return _splitmix64(lengths.astype(np.uint64))
+    codes = IL_LOOKUP[buffer].astype(np.uint64)
+    # residue i of a peptide ending at e is weighted with HASH_BASE^(e - 1 - i)
+    powers = np.cumprod(np.full(lengths.max(), HASH_BASE, dtype=np.uint64))
+    powers = np.concatenate([[np.uint64(1)], powers[:-1]])
+    exponents = np.repeat(offsets[1:] - 1, lengths) - np.arange(buffer.size)
+    codes *= powers[exponents]
+    # differences of the wrapping cumulative sums are the sums modulo 2^64 (0 for empty peptides)
+    sums = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(codes)])
+    hashes = sums[offsets[1:]] - sums[offsets[:-1]]
+    return _splitmix64(hashes ^ lengths.astype(np.uint64))
+
+
+class SequenceStore:
+    """
+    Columnar store for protein sequences and their headers.
+
+    Sequences are kept in one contiguous uint8 buffer with an int64 offsets array, headers in a
+    second buffer with their own offsets. Records are addressed through an ``order`` index, so
+    shuffling and subsetting return a new view with a permuted index instead of copying the
+    sequences.
+
+    Args:
+        buffer: ar, uint8 residues of all records
+        offsets: ar, int64 sequence offsets of length n+1
+        header_buffer: ar, uint8 headers of all records
+        header_offsets: ar, int64 header offsets of length n+1
+        order: ar, int64 record positions in store order (default: all records)
+    """
+
+    def __init__(self, buffer, offsets, header_buffer, header_offsets, order=None):
+        """Init the store."""
+        self.buffer = buffer
+        self.offsets = offsets
+        self.header_buffer = header_buffer
+        self.header_offsets = header_offsets
+        self.order = np.arange(len(offsets) - 1) if order is None else np.asarray(order)
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Create a store from (header, sequence) pairs.
+
+        Args:
+            records: iterable of (str, str) tuples
+
+        Returns:
+            SequenceStore
+        """
+        headers, seqs = [], []
+        for header, sequence in records:
+            headers.append(header)
+            seqs.append(sequence)
+        buffer, offsets = encode_sequences(seqs)
+        header_buffer, header_offsets = encode_sequences(headers, encoding="utf-8")
+        return cls(buffer, offsets, header_buffer, header_offsets)
+
+    @classmethod
+    def from_bytes(cls, headers, seqs):
+        """
+        Create a store from encoded headers and sequences.
+
+        Args:
+            headers: list of bytes, headers without '>'
+            seqs: list of bytes, sequences
+
+        Returns:
+            SequenceStore
+        """
+        offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+        np.cumsum([len(sequence) for sequence in seqs], out=offsets[1:])
+        header_offsets = np.zeros(len(headers) + 1, dtype=np.int64)
+        np.cumsum([len(header) for header in headers], out=header_offsets[1:])
+        return cls(np.frombuffer(b"".join(seqs), dtype=np.uint8), offsets,
+                   np.frombuffer(b"".join(headers), dtype=np.uint8), header_offsets)
+
+    @classmethod
+    def from_fasta(cls, fasta_file):
+        """
+        Read all records of a FASTA file into a store.
+
+        Args:
+            fasta_file: str, location of the FASTA file
+
+        Returns:
+            SequenceStore
+        """
+        with open(fasta_file, mode="rt") as ffile:
+            return cls.from_records(fasta.FASTA(ffile))
+
+    def __len__(self):
+        """Return the number of records in the store."""
+        return len(self.order)
+
+    def _view(self, order):
+        """Return a store that shares the buffers with a new order index."""
+        return SequenceStore(self.buffer, self.offsets, self.header_buffer, self.header_offsets,
+                             order)
+
+    @property
+    def ids(self):
+        """Array with the headers in store order."""
+        return np.array([bytes(self.header_buffer[self.header_offsets[ii]:
+                                                  self.header_offsets[ii + 1]]).decode("utf-8")
+                         for ii in self.order], dtype=object)
+
+    def sequence(self, position):
+        """
+        Return the sequence at a position in store order.
+
+        Args:
+            position: int, position in the store
+
+        Returns:
+            str, protein sequence
+        """
+        record = self.order[position]
+        return bytes(self.buffer[self.offsets[record]:self.offsets[record + 1]]).decode("ascii")
+
+    def sequences(self):
+        """Return a list with all sequences in store order."""
+        return [self.sequence(ii) for ii in range(len(self))]
+
+    def shuffle(self, random_state=42):
+        """
+        Shuffle the records without copying them.
+
+        Uses the same permutation as ``DataFrame.sample(frac=1, random_state=random_state)``.
+
+        Args:
+            random_state: int, seed of the permutation
+
+        Returns:
+            SequenceStore
+        """
+        return self._view(self.order[np.random.RandomState(random_state).permutation(len(self))])
+
+    def take(self, positions):
+        """
+        Select records by position (repetitions are allowed).
+
+        Args:
+            positions: ar, positions in store order
+
+        Returns:
+            SequenceStore
+        """
+        return self._view(self.order[np.asarray(positions, dtype=np.int64)])
+
+    def drop(self, ids):
+        """
+        Remove all records with the given headers.
+
+        Args:
+            ids: iterable of str, headers to remove
+
+        Returns:
+            SequenceStore
+        """
+        return self.take(np.flatnonzero(~np.isin(self.ids, list(ids))))
+
+    def composition(self, nonstandard="separate"):
+        """
+        Count the amino acids of all records.
+
+        Args:
+            nonstandard: str, policy for nonstandard amino acids (see composition_matrix)
+
+        Returns:
+            ar, float32 matrix with one row per record in store order
+        """
+        return composition_matrix(self.buffer, self.offsets, nonstandard=nonstandard)[self.order]
+
+    def to_dataframe(self):
+        """
+        Convert the store to a protein dataframe (same layout as fasta2dataframe).
+
+        Returns:
+            df, with sequence and Type columns and the headers as index
+        """
+        df = pd.DataFrame({"sequence": self.sequences()}, index=self.ids)
+        df["Type"] = "Protein"
+        return df
+
+    def write_fasta(self, output, file_mode="w"):
+        """
+        Write the records in store order to a FASTA file.
+
+        Args:
+            output: str, location of the FASTA file
+            file_mode: str, mode to open the file ('w' or 'a')
+        """
+        with open(output, mode=file_mode + "b") as ffile:
+            for header, sequence in self.records():
+                ffile.write(format_record(header, sequence))
+
+    def records(self):
+        """
+        Iterate over the records in store order.
+
+        Returns:
+            generator of (bytes, bytes), header and sequence of every record
+        """
+        for record in self.order:
+            yield (bytes(self.header_buffer[self.header_offsets[record]:
+                                            self.header_offsets[record + 1]]),
+                   bytes(self.buffer[self.offsets[record]:self.offsets[record + 1]]))
@@ -0,0 +1,284 @@
+"""Module to aggregate QC features chunk by chunk into compact summaries."""
+import numpy as np
+import pandas as pd
+
+# quantiles reported for every feature (box plots use the inner three)
+SUMMARY_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch (compactor hierarchy as in KLL/MRL sketches).
+
+    Every level holds at most k values, a full level is sorted and every second value is
+    promoted to the next level with twice the weight. The rank error is about log2(n / k) / k.
+
+    Args:
+        k: int, capacity of a level
+        random_state: int, seed for the choice of the promoted values
+    """
+
+    def __init__(self, k=2048, random_state=42):
+        """Create an empty sketch."""
+        self.k = k
+        self.count = 0
+        self.levels = []
+        self._rng = np.random.RandomState(random_state)
+
+    def _insert(self, level, values):
+        """Add values with weight 2^level and compact full levels."""
+        while len(values) > 0:
+            if len(self.levels) <= level:
+                self.levels.append(np.zeros(0))
+            values = np.concatenate([self.levels[level], values])
+            if len(values) <= self.k:
+                self.levels[level] = values
+                return
+            values.sort()
+            if len(values) % 2:
+                # an odd value stays on its level, the others are halved
+                leftover = self._rng.randint(len(values))
+                self.levels[level] = values[leftover:leftover + 1]
+                values = np.delete(values, leftover)
+            else:
+                self.levels[level] = np.zeros(0)
+            values = values[self._rng.randint(2)::2]
+            level += 1
+
+    def update(self, values):
+        """
+        Add values to the sketch (NaN values are skipped).
+
+        Args:
+            values: ar, values
+
+        Returns:
+            QuantileSketch, self
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self._insert(0, values)
+        return self
+
+    def merge(self, other):
+        """
+        Add all values of another sketch.
+
+        Args:
+            other: QuantileSketch
+
+        Returns:
+            QuantileSketch, self
+        """
+        for level, values in enumerate(other.levels):
+            self._insert(level, values.copy())
+        self.count += other.count
+        return self
+
+    def quantile(self, qs):
+        """
+        Estimate quantiles.
+
+        Args:
+            qs: ar, quantiles in [0, 1]
+
+        Returns:
+            ar, estimated values (NaN for an empty sketch)
+        """
+        qs = np.asarray(qs, dtype=np.float64)
+        if self.count == 0:
+            return np.full(qs.shape, np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_values), 2. ** level)
+                                  for level, level_values in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, weights = values[order], weights[order]
+        # every value represents the center of its weight
+        centers = np.cumsum(weights) - weights / 2.
+        return np.interp(qs * weights.sum(), centers, values)
+
+
+class FeatureSummary:
+    """
+    Streaming summary of one feature: count, min/max, mean/variance, histogram and quantiles.
+
+    Args:
+        edges: ar, fixed histogram bin edges (values outside are counted as under-/overflow)
+        k: int, capacity of the quantile sketch levels
+    """
+
+    def __init__(self, edges, k=2048):
+        """Create an empty summary."""
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.histogram = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+        self.count = 0
+        self.missing = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = 0.
+        self.m2 = 0.
+        self.sketch = QuantileSketch(k=k)
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        """Combine the moments with the moments of another set of values (Chan et al.)."""
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min, self.max = min(self.min, minimum), max(self.max, maximum)
+
+    def update(self, values):
+        """
+        Add a chunk of values.
+
+        Args:
+            values: ar, feature values (NaN values are counted as missing)
+
+        Returns:
+            FeatureSummary, self
+        """
+        values = np.asarray(values, dtype=np.float64)
+        valid = values[~np.isnan(values)]
+        self.missing += len(values) - len(valid)
+        if len(valid) == 0:
+            return self
+        self._combine(len(valid), valid.mean(), ((valid - valid.mean()) ** 2).sum(),
+                      valid.min(), valid.max())
+        self.histogram += np.histogram(valid, bins=self.edges)[0]
+        self.underflow += int((valid < self.edges[0]).sum())
+        self.overflow += int((valid > self.edges[-1]).sum())
+        self.sketch.update(valid)
+        return self
+
+    def merge(self, other):
+        """
+        Add the values of another summary with the same edges.
+
+        Args:
+            other: FeatureSummary
+
+        Returns:
+            FeatureSummary, self
+        """
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        self.missing += other.missing
+        self.histogram += other.histogram
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def variance(self):
+        """Return the sample variance."""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    def quantile(self, qs):
+        """
+        Estimate quantiles, clipped to the observed range.
+
+        Args:
+            qs: ar, quantiles in [0, 1]
+
+        Returns:
+            ar, estimated values
+        """
+        return np.clip(self.sketch.quantile(qs), self.min, self.max)
+
+    def to_dict(self):
+        """
+        Return the summary as json-serializable dict.
+
+        Returns:
+            dict
+        """
+        stats = {"count": int(self.count), "missing": int(self.missing),
+                 "min": float(self.min) if self.count else None,
+                 "max": float(self.max) if self.count else None,
+                 "mean": float(self.mean) if self.count else None,
+                 "std": float(np.sqrt(self.variance)) if self.count > 1 else None}
+        stats.update({f"q{int(q * 100):02d}": float(value) if self.count else None
+                      for q, value in zip(SUMMARY_QUANTILES, self.quantile(SUMMARY_QUANTILES))})
+        stats["histogram"] = {"edges": self.edges.tolist(), "counts": self.histogram.tolist(),
+                              "underflow": int(self.underflow), "overflow": int(self.overflow)}
+        return stats
+
+
+class QCSummary:
+    """
+    Feature summaries per database type (e.g. host and trap).
+
+    Args:
+        feature_edges: dict, feature name to histogram bin edges
+        k: int, capacity of the quantile sketch levels
+    """
+
+    def __init__(self, feature_edges, k=2048):
+        """Create empty summaries."""
+        self.feature_edges = feature_edges
+        self.k = k
+        self.summaries = {}
+
+    @property
+    def types(self):
+        """Return the summarized database types."""
+        return list(self.summaries)
+
+    @property
+    def features(self):
+        """Return the summarized features."""
+        return list(self.feature_edges)
+
+    def update(self, features_df, db_type):
+        """
+        Add a chunk of peptides with their features.
+
+        Args:
+            features_df: df, one column per feature
+            db_type: str, database type of the peptides
+
+        Returns:
+            QCSummary, self
+        """
+        if db_type not in self.summaries:
+            self.summaries[db_type] = {feature: FeatureSummary(edges, k=self.k)
+                                       for feature, edges in self.feature_edges.items()}
+        for feature, summary in self.summaries[db_type].items():
+            summary.update(features_df[feature].values)
+        return self
+
+    def __getitem__(self, key):
+        """Return the FeatureSummary of a (db_type, feature) pair."""
+        db_type, feature = key
+        return self.summaries[db_type][feature]
+
+    def to_frame(self):
+        """
+        Return the statistics of all summaries as table.
+
+        Returns:
+            df, one row per database type and feature
+        """
+        rows = []
+        for db_type, summaries in self.summaries.items():
+            for feature, summary in summaries.items():
+                stats = summary.to_dict()
+                del stats["histogram"]
+                rows.append(dict(Type=db_type, feature=feature, **stats))
+        return pd.DataFrame(rows)
+
+    def to_dict(self):
+        """
+        Return all summaries as json-serializable dict.
+
+        Returns:
+            dict, db_type -> feature -> statistics
+        """
+        return {db_type: {feature: summary.to_dict() for feature, summary in summaries.items()}
+                for db_type, summaries in self.summaries.items()}
@@ -0,0 +1,258 @@
+"""Module to generate seeded synthetic proteomes for benchmarks and tests."""
+import numpy as np
+
+from pytrapment import digest, fastaio, peptides
+
+# residue frequencies (percent) of UniProtKB/Swiss-Prot
+RESIDUE_FREQUENCIES = {"A": 8.25, "R": 5.53, "N": 4.06, "D": 5.45, "C": 1.37, "Q": 3.93,
+                       "E": 6.75, "G": 7.07, "H": 2.27, "I": 5.96, "L": 9.66, "K": 5.84,
+                       "M": 2.42, "F": 3.86, "P": 4.70, "S": 6.56, "T": 5.34, "W": 1.08,
+                       "Y": 2.92, "V": 6.87}
+
+# protein lengths follow a log-normal distribution with about the Swiss-Prot median
+LENGTH_MEDIAN = 300
+LENGTH_SIGMA = 0.7
+LENGTH_RANGE = (30, 10000)
+
+# proteins generated per random stream, the output does not depend on how records are consumed
+CHUNK_PROTEINS = 2 ** 14
+
+# length range of the host peptides that are spiked into entrapment proteins
+SPIKE_LENGTH_RANGE = (7, 25)
+
+
+def _chunk_rng(random_state, stream, chunk):
+    """Return the random generator of a chunk of a stream."""
+    return np.random.RandomState([random_state, stream, chunk])
+
+
+def protein_lengths(n, rng, median=LENGTH_MEDIAN, sigma=LENGTH_SIGMA, length_range=LENGTH_RANGE):
+    """
+    Draw protein lengths.
+
+    Args:
+        n: int, number of proteins
+        rng: RandomState, random generator
+        median: float, median length
+        sigma: float, shape of the log-normal distribution
+        length_range: tuple, minimal and maximal length
+
+    Returns:
+        ar, int64 lengths
+    """
+    lengths = rng.lognormal(np.log(median), sigma, size=n).round().astype(np.int64)
+    return np.clip(lengths, *length_range)
+
+
+def random_sequences(lengths, rng, frequencies=RESIDUE_FREQUENCIES):
+    """
+    Draw protein sequences with the given residue frequencies, every protein starts with M.
+
+    Args:
+        lengths: ar, protein lengths
+        rng: RandomState, random generator
+        frequencies: dict, residue to relative frequency
+
+    Returns:
+        list of bytes, sequences
+    """
+    letters = np.frombuffer("".join(frequencies).encode("ascii"), dtype=np.uint8)
+    weights = np.array(list(frequencies.values()), dtype=np.float64)
+    buffer = letters[rng.choice(len(letters), size=int(lengths.sum()), p=weights / weights.sum())]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    buffer[offsets[:-1]] = ord("M")
+    data = buffer.tobytes()
+    return [data[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def spike_peptides(seqs, pool, rate, rng):
+    """
+    Insert a peptide from a pool as tryptic peptide into a random subset of sequences.
+
+    The residue before the peptide becomes K and a P after it is replaced, so the peptide is
+    cleaved out by trypsin.
+
+    Args:
+        seqs: list of bytes, sequences (modified in place)
+        pool: list of bytes, tryptic peptides ending with K or R
+        rate: float, fraction of sequences that receive a peptide
+        rng: RandomState, random generator
+
+    Returns:
+        ar, bool mask of the sequences with a peptide
+    """
+    if not pool:
+        return np.zeros(len(seqs), dtype=bool)
+    spiked = rng.random_sample(len(seqs)) < rate
+    for position in np.flatnonzero(spiked):
+        sequence, peptide = seqs[position], pool[rng.randint(len(pool))]
+        # the start methionine is kept
+        split = rng.randint(2, len(sequence) + 1)
+        tail = sequence[split:]
+        if tail[:1] == b"P":
+            tail = b"A" + tail[1:]
+        seqs[position] = sequence[:split - 1] + b"K" + peptide + tail
+    return spiked
+
+
+def peptide_pool(seqs, length_range=SPIKE_LENGTH_RANGE):
+    """
+    Collect the distinct tryptic peptides ending with K or R from sequences.
+
+    Args:
+        seqs: list of bytes, sequences
+        length_range: tuple, minimal and maximal peptide length
+
+    Returns:
+        list of bytes, peptides
+    """
+    data = b"".join(seqs)
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    offsets = np.concatenate([[0], np.cumsum([len(sequence) for sequence in seqs])])
+    _, starts, ends = digest.digest(buffer, offsets, min_length=length_range[0],
+                                    max_length=length_range[1])
+    peptide_set = {data[start:end] for start, end in zip(starts, ends)}
+    return sorted(peptide for peptide in peptide_set if peptide[-1:] in (b"K", b"R"))
+
+
+def _encode(seqs):
+    """Return the residues and offsets of sequences."""
+    buffer = np.frombuffer(b"".join(seqs), dtype=np.uint8).copy()
+    return buffer, np.concatenate([[0], np.cumsum([len(sequence) for sequence in seqs])])
+
+
+def tryptic_keys(seqs, min_length=6):
+    """
+    Compute the peptide keys of the tryptic peptides of sequences (as used by the filtering).
+
+    Args:
+        seqs: list of bytes, sequences
+        min_length: int, minimal peptide length
+
+    Returns:
+        ar, uint64 keys (see peptides.peptide_keys)
+    """
+    buffer, offsets = _encode(seqs)
+    _, starts, ends = digest.digest(buffer, offsets, min_length=min_length)
+    return peptides.peptide_keys(*digest.gather(buffer, starts, ends))
+
+
+def remove_shared(seqs, host_keys, rng, min_length=6, max_rounds=20):
+    """
+    Mutate sequences until none of their tryptic peptides occurs in the host.
+
+    Random proteomes share many short peptides by chance. One residue (not K, R or P, so the
+    cleavage sites stay) of every shared peptide is replaced until no peptide key matches.
+
+    Args:
+        seqs: list of bytes, sequences (modified in place)
+        host_keys: ar, sorted uint64 keys of the host peptides (see tryptic_keys)
+        rng: RandomState, random generator
+        min_length: int, minimal peptide length
+        max_rounds: int, maximal number of mutation rounds
+
+    Returns:
+        int, number of mutated residues
+    """
+    buffer, offsets = _encode(seqs)
+    substitutes = np.frombuffer(b"ACDEFGHMNQSTVWY", dtype=np.uint8)
+    # only proteins mutated in the previous round are digested again
+    active = np.arange(len(seqs))
+    mutated = 0
+    for _ in range(max_rounds):
+        sub_buffer, sub_offsets = digest.gather(buffer, offsets[active], offsets[active + 1])
+        proteins, starts, ends = digest.digest(sub_buffer, sub_offsets, min_length=min_length)
+        keys = peptides.peptide_keys(*digest.gather(sub_buffer, starts, ends))
+        found = np.searchsorted(host_keys, keys).clip(max=max(len(host_keys) - 1, 0))
+        shared = np.flatnonzero(host_keys[found] == keys) if len(host_keys) else []
+        if len(shared) == 0:
+            break
+        # any residue but the C-terminal one, I/L are replaced by a residue of another mass
+        shift = (offsets[active] - sub_offsets[:-1])[proteins[shared]]
+        positions = starts[shared] + shift + (rng.random_sample(len(shared)) * (
+            ends[shared] - starts[shared] - 1)).astype(np.int64)
+        buffer[positions] = substitutes[rng.randint(len(substitutes), size=len(shared))]
+        mutated += len(shared)
+        active = np.unique(active[proteins[shared]])
+    data = buffer.tobytes()
+    seqs[:] = [data[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    return mutated
+
+
+def _chunks(n, random_state, stream):
+    """Generate the sequences of a stream chunk by chunk."""
+    for chunk, first in enumerate(range(0, n, CHUNK_PROTEINS)):
+        rng = _chunk_rng(random_state, stream, chunk)
+        yield first, random_sequences(protein_lengths(min(CHUNK_PROTEINS, n - first), rng),
+                                      rng), rng
+
+
+def _records(seqs, first, prefix):
+    """Return uniprot-style records of sequences."""
+    for ii, sequence in enumerate(seqs, start=first):
+        accession = f"{prefix}{ii:07d}"
+        yield (f"sp|{accession}|{accession}_SYNTH Synthetic protein {ii}".encode("ascii"),
+               sequence)
+
+
+def generate_records(n, random_state=42, prefix="SYN", stream=0, host_keys=None, pool=None,
+                     shared_rate=0.):
+    """
+    Generate synthetic protein records.
+
+    Records are generated in chunks of CHUNK_PROTEINS proteins from independent seeded
+    streams, the same arguments always give the same records.
+
+    Args:
+        n: int, number of proteins
+        random_state: int, seed
+        prefix: str, prefix of the protein accessions
+        stream: int, random stream (different streams give different proteomes)
+        host_keys: ar, sorted host peptide keys, chance matches are removed (see remove_shared)
+        pool: list of bytes, peptides spiked into the proteins (see peptide_pool)
+        shared_rate: float, fraction of proteins that receive a peptide from the pool
+
+    Returns:
+        generator of (bytes, bytes), header and sequence of every record
+    """
+    for first, seqs, rng in _chunks(n, random_state, stream):
+        if host_keys is not None:
+            remove_shared(seqs, host_keys, rng)
+        if pool is not None and shared_rate > 0:
+            spike_peptides(seqs, pool, shared_rate, rng)
+        yield from _records(seqs, first, prefix)
+
+
+def write_proteomes(fasta_host, fasta_trap, n_host, n_trap, shared_rate=0.05, random_state=42,
+                    compression=None):
+    """
+    Write a synthetic host and entrapment proteome with a controlled shared-peptide rate.
+
+    Chance matches of tryptic peptides are removed from the entrapment proteins, then a
+    fraction shared_rate of them receives a tryptic peptide of the first host chunk. The
+    sorted keys of all host peptides are kept in memory while the entrapment is generated.
+
+    Args:
+        fasta_host: str, location of the host fasta
+        fasta_trap: str, location of the entrapment fasta
+        n_host: int, number of host proteins
+        n_trap: int, number of entrapment proteins
+        shared_rate: float, fraction of entrapment proteins that share a peptide with the host
+        random_state: int, seed
+        compression: str, None, 'gzip' or 'zstd' (see fastaio.FastaWriter)
+
+    Returns:
+        (str, str), locations of the host and entrapment fasta
+    """
+    host_keys, pool = [], None
+    with fastaio.FastaWriter(fasta_host, compression=compression) as writer:
+        for first, seqs, _ in _chunks(n_host, random_state, stream=0):
+            writer.write_records(_records(seqs, first, "HOST"))
+            host_keys.append(np.unique(tryptic_keys(seqs)))
+            pool = peptide_pool(seqs) if pool is None else pool
+    host_keys = np.unique(np.concatenate(host_keys)) if host_keys else np.zeros(0, np.uint64)
+    trap_records = generate_records(n_trap, random_state, prefix="TRAP", stream=1,
+                                    host_keys=host_keys, pool=pool, shared_rate=shared_rate)
+    with fastaio.FastaWriter(fasta_trap, compression=compression) as writer:
+        writer.write_records(trap_records)
+    return fasta_host, fasta_trap
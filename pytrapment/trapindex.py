@@ -0,0 +1,227 @@
+"""Module to build and load prebuilt entrapment database indices."""
+import copy
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import pytrapment
+from pytrapment import digest, fastaio, neighbors, peptides, runmetrics, sequences
+
+# version of the on-disk layout, indices with another version have to be rebuilt
+INDEX_FORMAT_VERSION = 3
+
+# arrays stored in an index directory (loaded with memory mapping)
+INDEX_ARRAYS = ["sequence_buffer", "sequence_offsets", "header_buffer", "header_offsets",
+                "fasta_record", "composition", "peptide_buffer", "peptide_offsets",
+                "peptide_proteins", "peptide_keys"]
+
+
+def is_index(path):
+    """
+    Check if a path is a prebuilt index directory.
+
+    Args:
+        path: str, location of a fasta file or index directory
+
+    Returns:
+        bool
+    """
+    return os.path.isfile(os.path.join(path, "meta.json"))
+
+
+def build_index(fasta_trap, index_dir, engine="kdtree", rule="trypsin", min_length=6,
+                random_state=42, processes=1, metrics=None):
+    """
+    Build a prebuilt index for an entrapment database.
+
+    The index holds the trap proteins (shuffled as in get_nearest_neighbor_proteins), their
+    float32 composition matrix, the tryptic peptides per protein with their 64-bit keys and the
+    nearest neighbor engine (its parameters and the fitted arrays that are expensive to
+    recompute, the rest is rebuilt from the composition matrix on load).
+
+    Args:
+        fasta_trap: str, location of the entrapment fasta file
+        index_dir: str, directory to store the index
+        engine: str or engine instance, nearest neighbor engine (see neighbors.ENGINES)
+        rule: str, pyteomics string identifier for the digestion
+        min_length: int, minimal length for a peptide
+        random_state: int, seed of the shuffling
+        processes: int, number of processes used for the digestion
+        metrics: RunMetrics, receives the stage timings (parse, composition, digestion,
+            index_build)
+
+    Returns:
+        TrapIndex, the loaded index
+    """
+    metrics = runmetrics.RunMetrics() if metrics is None else metrics
+    with metrics.stage("parse") as stage:
+        shuffled = fastaio.load_store(fasta_trap).shuffle(random_state=random_state)
+        # compact copy in shuffled order, so index positions are store positions
+        headers, seqs = [], []
+        for header, sequence in shuffled.records():
+            headers.append(header)
+            seqs.append(sequence)
+        store = sequences.SequenceStore.from_bytes(headers, seqs)
+        stage["items"] = len(store)
+    with metrics.stage("composition", items=len(store)):
+        composition = store.composition(nonstandard="ignore")
+    with metrics.stage("digestion", items=len(store)):
+        peptide_proteins, peptide_buffer, peptide_offsets = digest.digest_store(
+            store, rule, min_length, processes)
+
+    with metrics.stage("index_build", items=len(store)):
+        nn_engine = neighbors.get_engine(engine).fit(composition)
+        os.makedirs(index_dir, exist_ok=True)
+        arrays = {"sequence_buffer": store.buffer, "sequence_offsets": store.offsets,
+                  "header_buffer": store.header_buffer, "header_offsets": store.header_offsets,
+                  "fasta_record": shuffled.order, "composition": composition,
+                  "peptide_buffer": peptide_buffer, "peptide_offsets": peptide_offsets,
+                  "peptide_proteins": peptide_proteins,
+                  "peptide_keys": peptides.peptide_keys(peptide_buffer, peptide_offsets)}
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(index_dir, f"{name}.npy"), arrays[name])
+        # the engine is stored without its fitted state, restored from the composition and the
+        # memory-mapped fitted arrays (custom engines without fitted_arrays are pickled as is)
+        engine_arrays = getattr(nn_engine, "fitted_arrays", None)
+        params = nn_engine
+        if engine_arrays is not None:
+            params = copy.copy(nn_engine)
+            for name in [name for name in vars(params) if name.endswith("_")]:
+                delattr(params, name)
+            for name in engine_arrays:
+                np.save(os.path.join(index_dir, f"engine_{name.rstrip('_')}.npy"),
+                        getattr(nn_engine, name))
+        with open(os.path.join(index_dir, "engine.pkl"), mode="wb") as efile:
+            pickle.dump(params, efile, protocol=pickle.HIGHEST_PROTOCOL)
+
+        meta = {"format_version": INDEX_FORMAT_VERSION,
+                "pytrapment_version": pytrapment.__version__,
+                "source": os.path.abspath(fasta_trap), "n_proteins": len(store),
+                "engine": nn_engine.name, "rule": rule, "min_length": min_length,
+                "random_state": random_state,
+                "engine_arrays": None if engine_arrays is None else list(engine_arrays),
+                "columns": sequences.composition_columns("ignore")}
+        with open(os.path.join(index_dir, "meta.json"), mode="w") as mfile:
+            json.dump(meta, mfile, indent=2)
+    return TrapIndex(index_dir)
+
+
+class TrapIndex:
+    """
+    Prebuilt entrapment database index, arrays are loaded with memory mapping.
+
+    Args:
+        index_dir: str, directory of the index
+        mmap_mode: str, numpy memory map mode (None loads the arrays into memory)
+    """
+
+    def __init__(self, index_dir, mmap_mode="r"):
+        """Load the index."""
+        with open(os.path.join(index_dir, "meta.json")) as mfile:
+            self.meta = json.load(mfile)
+        if self.meta["format_version"] != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Index {index_dir} has format version "
+                             f"{self.meta['format_version']}, expected {INDEX_FORMAT_VERSION}. "
+                             f"Rebuild it with 'pytrapment index build'.")
+        self.index_dir = index_dir
+        self.mmap_mode = mmap_mode
+        for name in INDEX_ARRAYS:
+            setattr(self, name, np.load(os.path.join(index_dir, f"{name}.npy"),
+                                        mmap_mode=mmap_mode))
+        self.store = sequences.SequenceStore(self.sequence_buffer, self.sequence_offsets,
+                                             self.header_buffer, self.header_offsets)
+        self._engine = None
+
+    def __len__(self):
+        """Return the number of trap proteins."""
+        return len(self.store)
+
+    @property
+    def engine(self):
+        """Return the fitted nearest neighbor engine, restored on first access."""
+        if self._engine is None:
+            with open(os.path.join(self.index_dir, "engine.pkl"), mode="rb") as efile:
+                nn_engine = pickle.load(efile)
+            if self.meta["engine_arrays"] is not None:
+                arrays = {name: np.load(os.path.join(self.index_dir,
+                                                     f"engine_{name.rstrip('_')}.npy"),
+                                        mmap_mode=self.mmap_mode)
+                          for name in self.meta["engine_arrays"]}
+                nn_engine = neighbors.restore_engine(nn_engine, self.composition, arrays)
+            self._engine = nn_engine
+        return self._engine
+
+    def composition_df(self, positions=None):
+        """
+        Return the composition matrix as dataframe.
+
+        Only the headers of the returned rows are decoded, use the memory-mapped composition
+        array to work on all trap proteins.
+
+        Args:
+            positions: ar, store positions of the rows (None: all trap proteins)
+
+        Returns:
+            df, composition of the trap proteins with the headers as index
+        """
+        if positions is None:
+            return pd.DataFrame(self.composition, index=self.store.ids,
+                                columns=self.meta["columns"])
+        positions = np.asarray(positions, dtype=np.int64)
+        return pd.DataFrame(self.composition[positions], index=self.store.take(positions).ids,
+                            columns=self.meta["columns"])
+
+    def excluded_by(self, host_buffer, host_offsets, bloom_fp_rate=None, metrics=None):
+        """
+        Find trap proteins that share a peptide with the host.
+
+        Args:
+            host_buffer: ar, uint8 residues of the host peptides
+            host_offsets: ar, int64 offsets of the host peptides
+            bloom_fp_rate: float, false-positive rate of the bloom prefilter (None: no prefilter)
+            metrics: dict, receives size and measured false-positive rate of the bloom filter
+
+        Returns:
+            ar, bool mask over the trap proteins
+        """
+        shared = peptides.shared_peptides(self.peptide_buffer, self.peptide_offsets, host_buffer,
+                                          host_offsets, query_keys=self.peptide_keys,
+                                          bloom_fp_rate=bloom_fp_rate, metrics=metrics)
+        return np.bincount(self.peptide_proteins[shared], minlength=len(self)) > 0
+
+    def records(self, records):
+        """
+        Return trap records by their position in the source fasta.
+
+        Args:
+            records: ar, positions in the source fasta (repetitions are allowed)
+
+        Returns:
+            generator of (bytes, bytes), header and sequence of every record
+        """
+        positions = np.zeros(len(self), dtype=np.int64)
+        positions[self.fasta_record] = np.arange(len(self))
+        return self.store.take(positions[np.asarray(records, dtype=np.int64)]).records()
+
+
+def select_records(source, records, indexed=True, index_dir=None):
+    """
+    Read selected records from a fasta file (plain or compressed) or a prebuilt index.
+
+    Args:
+        source: str, location of a fasta file or index directory
+        records: ar, positions of the records in the (source) fasta file
+        indexed: bool, access plain fasta files through their offset index (False: stream
+            them, see fastaio.select_records)
+        index_dir: str, directory to keep the offset index of a plain fasta file for later runs
+            (None: the index is only held in memory)
+
+    Returns:
+        generator of (bytes, bytes), header and sequence of every record in the given order
+    """
+    if is_index(source):
+        return TrapIndex(source).records(records)
+    return fastaio.select_records(source, records, indexed=indexed, index_dir=index_dir)
@@ -24,11 +24,11 @@ AUTHOR = 'Sven Giese'
 REQUIRES_PYTHON = '>=3.8.0'
 KEYWORDS = ["Proteomics", "machine learning", "uniprot", "fasta"]
 # What packages are required for this module to be executed?
-REQUIRED = ['numpy', 'pyteomics', 'matplotlib', 'seaborn', 'scipy']
+REQUIRED = ['numpy', 'pyteomics', 'matplotlib', 'scipy']
 
 # What packages are optional?
 # 'fancy feature': ['django'],}
-EXTRAS = {}
+EXTRAS = {"zstd": ["zstandard"]}
 
 # The rest you shouldn't have to touch too much :)
 # ------------------------------------------------
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+from pytrapment import budget, sequences
+
+# fixtures is used to store files used for the tests only
+fixtures_loc = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_parse_memory():
+    assert budget.parse_memory("4G") == 4 * 2 ** 30
+    assert budget.parse_memory("512MiB") == 512 * 2 ** 20
+    assert budget.parse_memory("1.5gb") == 3 * 2 ** 29
+    assert budget.parse_memory(1000) == budget.parse_memory("1000") == 1000
+    for value in ["many", "4X", "0", -1]:
+        with pytest.raises(ValueError):
+            budget.parse_memory(value)
+
+
+def test_memory_plan_chunks(monkeypatch):
+    monkeypatch.setattr(budget, "BASE_BYTES", 0)
+    monkeypatch.setattr(budget, "MIN_CHUNK_BYTES", 1)
+    host_sizes = (np.full(10, 100), np.full(10, 20))
+    trap_sizes = (np.arange(1, 101) * 10, np.full(100, 20))
+    plan = budget.MemoryPlan(200000, host_sizes, trap_sizes)
+
+    # the chunks cover all entrapment proteins in order and fit into the budget
+    assert plan.n_chunks > 1
+    assert plan.ends[-1] == 100
+    assert np.all(np.diff(plan.ends) > 0)
+    assert plan.peak_bytes <= plan.max_bytes
+    assert plan.to_dict()["n_chunks"] == plan.n_chunks
+    # a chunk holds at least one protein
+    assert list(budget.MemoryPlan.chunk_ends(np.array([20, 50, 5]), 10)) == [1, 2, 3]
+    assert len(budget.MemoryPlan.chunk_ends(np.array([]), 10)) == 0
+
+
+def test_memory_plan_too_small(monkeypatch):
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    with pytest.raises(budget.MemoryBudgetError, match="Increase the budget"):
+        budget.MemoryPlan.from_files("64M", fasta_host, fasta_trap)
+
+    monkeypatch.setattr(budget, "BASE_BYTES", 0)
+    monkeypatch.setattr(budget, "MIN_CHUNK_BYTES", 1)
+    monkeypatch.setattr(budget, "ASSIGN_BYTES_PER_PROTEIN", 2 ** 20)
+    assert budget.MemoryPlan.from_files("100K", fasta_host, fasta_trap).n_chunks == 3
+    with pytest.raises(budget.MemoryBudgetError, match="max_uses"):
+        budget.MemoryPlan.from_files("100K", fasta_host, fasta_trap, max_uses=1)
+
+
+def test_shuffled_ranks():
+    store = sequences.SequenceStore.from_bytes([b"P%d" % i for i in range(50)],
+                                               [b"PEPTIDE"] * 50)
+    ranks = budget.shuffled_ranks(len(store), random_state=7)
+    assert np.all(ranks[store.shuffle(random_state=7).order] == np.arange(50))
+
+
+def test_best_neighbors():
+    best = budget.BestNeighbors(4)
+    best.update(slice(0, 4), np.array([1.0, 2.0, 3.0, 4.0]), np.array([5, 5, 5, 5]),
+                np.array([10, 11, 12, 13]))
+    # closer neighbors replace the previous ones, ties go to the lower rank
+    best.update(np.array([0, 1, 2]), np.array([0.5, 2.0, 3.0]), np.array([9, 2, 8]),
+                np.array([20, 21, 22]))
+    assert list(best.distances) == [0.5, 2.0, 3.0, 4.0]
+    assert list(best.ranks) == [9, 2, 5, 5]
+    assert list(best.records) == [20, 21, 12, 13]
@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+from pyteomics import parser
+
+from pytrapment import digest, entrapment, sequences
+
+# fixtures is used to store files used for the tests only
+fixtures_loc = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def mock_proteins(n=200, seed=0):
+    rng = np.random.RandomState(seed)
+    # enriched in residues that take part in cleavage rules
+    residues = np.array(list("ACDEFGHIKLMNPQRSTVWYKRPDWM"))
+    return ["".join(rng.choice(residues, size=rng.randint(0, 400))) for _ in range(n)] + \
+        ["K", "KP", "WKPK", "RR", ""]
+
+
+def offsets_to_peptides(buffer, offsets, proteins, starts, ends):
+    return {(protein, start - offsets[protein], buffer[start:end].tobytes().decode())
+            for protein, start, end in zip(proteins, starts, ends)}
+
+
+@pytest.mark.parametrize("rule", ["trypsin", "asp-n", "chymotrypsin high specificity",
+                                  "caspase 1"])
+@pytest.mark.parametrize("missed_cleavages,min_length,max_length", [(0, 1, None), (2, 6, 30)])
+def test_cleave_offsets(rule, missed_cleavages, min_length, max_length):
+    seqs = mock_proteins()
+    buffer, offsets = sequences.encode_sequences(seqs)
+    observed = offsets_to_peptides(buffer, offsets, *digest.cleave_offsets(
+        buffer, offsets, rule=rule, min_length=min_length, missed_cleavages=missed_cleavages,
+        max_length=max_length))
+
+    expected = {(protein, start, peptide) for protein, sequence in enumerate(seqs)
+                for start, peptide in parser.icleave(sequence, rule, missed_cleavages,
+                                                     min_length, max_length)}
+    assert observed == expected
+
+
+def test_cleavage_sites_custom_rule():
+    buffer, offsets = sequences.encode_sequences(["AAKPAARAA", "KAAK"])
+    # trypsin/p, cuts after K and R also before P
+    rule = {"after": {"K": "", "R": ""}}
+    assert list(digest.cleavage_sites(buffer, offsets, rule)) == [3, 7, 10]
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_digest(processes):
+    seqs = mock_proteins()
+    buffer, offsets = sequences.encode_sequences(seqs)
+    proteins, starts, ends = digest.digest(buffer, offsets, min_length=6, processes=processes,
+                                           missed_cleavages=1)
+
+    assert offsets_to_peptides(buffer, offsets, proteins, starts, ends) == \
+        offsets_to_peptides(buffer, offsets, *digest.enumerate_peptides(
+            buffer, offsets, min_length=6, missed_cleavages=1))
+    peptide_buffer, peptide_offsets = digest.gather(buffer, starts, ends)
+    assert np.all(np.diff(peptide_offsets) == ends - starts)
+    assert peptide_buffer[peptide_offsets[1]:peptide_offsets[2]].tobytes() == \
+        buffer[starts[1]:ends[1]].tobytes()
+
+
+def test_digest_chunks(monkeypatch):
+    buffer, offsets = sequences.encode_sequences(mock_proteins())
+    expected = digest.digest(buffer, offsets, min_length=6, missed_cleavages=1)
+    expected_peptides = digest.gather(buffer, *expected[1:])
+
+    # the kernels process a few proteins at once, results are unchanged
+    monkeypatch.setattr(sequences, "CHUNK_RESIDUES", 500)
+    observed = digest.digest(buffer, offsets, min_length=6, missed_cleavages=1)
+    for observed_array, expected_array in zip(observed, expected):
+        assert np.all(observed_array == expected_array)
+    for observed_array, expected_array in zip(digest.gather(buffer, *observed[1:]),
+                                              expected_peptides):
+        assert np.all(observed_array == expected_array)
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs /dev/shm")
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(),
+                    reason="needs the fork start method")
+def test_digest_failed_worker_releases_shared_memory(monkeypatch):
+    buffer, offsets = sequences.encode_sequences(mock_proteins())
+    cleave_offsets = digest.cleave_offsets
+    # the patched function only reaches the workers when they are forked
+    monkeypatch.setattr(multiprocessing, "Pool", multiprocessing.get_context("fork").Pool)
+
+    def fail_late_chunks(buffer, offsets, first=0, last=None, **params):
+        if first > 100:
+            raise RuntimeError("worker failed")
+        return cleave_offsets(buffer, offsets, first, last, **params)
+
+    monkeypatch.setattr(digest, "cleave_offsets", fail_late_chunks)
+    before = set(os.listdir("/dev/shm"))
+    with pytest.raises(RuntimeError):
+        digest.digest(buffer, offsets, processes=2)
+    # the blocks of the finished workers are removed as well
+    assert set(os.listdir("/dev/shm")) - before == set()
+
+
+def test_digest_protein_df_processes():
+    proteins_df = entrapment.fasta2dataframe(os.path.join(fixtures_loc,
+                                                          "multiple_sequences.fasta"))
+    serial_df = entrapment.digest_protein_df(proteins_df)
+    parallel_df = entrapment.digest_protein_df(proteins_df, processes=2)
+
+    # one row per protein and peptide as with parser.cleave
+    expected = {(protein, peptide) for protein, sequence in proteins_df["sequence"].items()
+                for peptide in parser.cleave(sequence, "trypsin") if len(peptide) >= 6}
+    assert list(parallel_df.columns) == ["protein", "sequence"]
+    assert len(serial_df) == len(expected)
+    assert set(map(tuple, serial_df.values)) == expected
+    assert sorted(map(tuple, serial_df.values)) == sorted(map(tuple, parallel_df.values))
+
+
+def test_unique_peptides():
+    seqs = ["PEPTIDEK", "PEPTLDEK", "PEPTIDEK", "AAK", "PEPTIDEK", "AAK"]
+    proteins = np.array([0, 0, 0, 0, 1, 1])
+    buffer, offsets = sequences.encode_sequences(seqs)
+
+    # I/L variants share a hash but are different peptides
+    keep = digest.unique_peptides(buffer, offsets, proteins)
+    assert list(keep) == [True, True, False, True, True, True]
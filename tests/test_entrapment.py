@@ -2,8 +2,9 @@ import os
 
 import numpy as np
 import pandas as pd
+import pytest
 
-from pytrapment import entrapment
+from pytrapment import entrapment, sequences
 
 # fixtures is used to store files used for the tests only
 fixtures_loc = os.path.join(os.path.dirname(__file__), 'fixtures')
@@ -63,3 +64,136 @@ def test_filter_trap_fasta():
 
     assert df_comp_trap.shape[0] == 1
     assert df_prot_trap.index[0] == "D"
+
+
+def test_filter_trap_fasta_store():
+    host_store = sequences.SequenceStore.from_records([("A", "ELVISKLIVESR"),
+                                                       ("B", "PEPTIDERLEPTIDEK")])
+    trap_store = sequences.SequenceStore.from_records([("C", "ELVLSKSVEN"),
+                                                       ("D", "RANDEMPEPTIDE")]).shuffle()
+    df_peptides_host = entrapment.digest_protein_df(host_store)
+    df_peptides_trap = entrapment.digest_protein_df(trap_store)
+    df_comp_trap = entrapment.compute_composition_df(trap_store)
+
+    df_comp_trap, store_trap = \
+        entrapment.filter_trap_fasta(trap_store, df_comp_trap, df_peptides_trap, df_peptides_host)
+    assert list(df_comp_trap.index) == ["D"]
+    assert list(store_trap.ids) == ["D"]
+
+
+def test_match_proteins_peptides():
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    result = entrapment.match_proteins(fasta_host, fasta_trap)
+    final_df = result.proteins
+
+    # the digests of the matching are reused instead of digesting the proteins again
+    for db_type in ["host", "trap"]:
+        expected = entrapment.digest_protein_df(final_df[final_df["db_type"] == db_type])
+        observed = result.peptide_df(db_type)
+        assert sorted(map(tuple, observed.values)) == sorted(map(tuple, expected.values))
+        chunks = pd.concat(result.iter_peptide_dfs(db_type, chunk_size=3))
+        assert list(map(tuple, chunks.values)) == list(map(tuple, observed.values))
+
+    with pytest.raises(ValueError):
+        result.peptide_df("contaminant")
+
+    # the matching reports its stages
+    assert list(result.metrics.stages) == ["parse", "composition", "digestion", "filtering",
+                                           "nn_search"]
+    assert result.metrics.stages["parse"]["items"] == \
+        result.metrics.stages["composition"]["items"]
+    assert result.metrics.stages["nn_search"]["items"] == (final_df["db_type"] == "host").sum()
+    metrics = {}
+    entrapment.match_proteins(fasta_host, fasta_trap, metrics=metrics)
+    assert "nn_search" in metrics["stages"]
+
+
+def test_match_proteins_decodes_selected_headers(monkeypatch):
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    n_trap = len(entrapment.fasta2dataframe(fasta_trap))
+    decoded = []
+    ids = sequences.SequenceStore.ids
+
+    def count_ids(store):
+        decoded.append(len(store))
+        return ids.fget(store)
+
+    # the trap headers are decoded for the selected proteins only, not for the composition
+    monkeypatch.setattr(sequences.SequenceStore, "ids", property(count_ids))
+    entrapment.match_proteins(fasta_host, fasta_trap)
+    assert decoded and n_trap not in decoded
+
+
+@pytest.mark.parametrize("engine,max_uses,indexed",
+                         [("kdtree", None, False), ("blocked", 2, False), ("kdtree", 1, True)])
+def test_match_proteins_max_memory(tmpdir, monkeypatch, engine, max_uses, indexed):
+    from pytrapment import budget, trapindex
+
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    if indexed:
+        fasta_trap = trapindex.build_index(fasta_trap, str(tmpdir.join("index"))).index_dir
+    expected = entrapment.match_proteins(fasta_host, fasta_trap, engine=engine,
+                                         max_uses=max_uses)
+
+    # shrink the estimates so the small fixtures are split into several chunks
+    monkeypatch.setattr(budget, "BASE_BYTES", 0)
+    monkeypatch.setattr(budget, "MIN_CHUNK_BYTES", 1)
+    result = entrapment.match_proteins(fasta_host, fasta_trap, engine=engine,
+                                       max_uses=max_uses, max_memory="100K")
+    assert result.metrics["memory_plan"]["n_chunks"] == 3
+    assert "plan" in result.metrics.stages
+
+    # chunking does not change the matching or the digests
+    pd.testing.assert_frame_equal(result.proteins, expected.proteins)
+    for db_type in ["host", "trap"]:
+        observed = result.peptide_df(db_type)
+        assert list(map(tuple, observed.values)) == \
+            list(map(tuple, expected.peptide_df(db_type).values))
+
+    with pytest.raises(budget.MemoryBudgetError):
+        entrapment.match_proteins(fasta_host, fasta_trap, max_memory="10K")
+
+
+def test_match_proteins_max_memory_engine(monkeypatch):
+    from pytrapment import budget, neighbors
+
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    monkeypatch.setattr(budget, "BASE_BYTES", 0)
+    monkeypatch.setattr(budget, "MIN_CHUNK_BYTES", 1)
+    engine = neighbors.IVFEngine(n_lists=2, n_probe=1, recall_sample=8)
+    counts = []
+    kneighbors = neighbors.IVFEngine.kneighbors
+
+    def record_counts(self, host_matrix, k=1):
+        result = kneighbors(self, host_matrix, k=k)
+        counts.append(self.recall_counts_)
+        return result
+
+    monkeypatch.setattr(neighbors.IVFEngine, "kneighbors", record_counts)
+    entrapment.match_proteins(fasta_host, fasta_trap, engine=engine, max_memory="100K")
+
+    # the passed engine keeps its settings, the recall covers the queries of all chunks
+    assert engine.memory_budget == 2 ** 28
+    assert engine.recall_sample == 8
+    assert len(counts) > 3
+    assert engine.recall_ == sum(hits for hits, _ in counts) / sum(total for _, total in counts)
+
+
+@pytest.mark.parametrize("source", ["fasta", "index", "chunked"])
+def test_match_proteins_all_trap_removed(tmpdir, source):
+    from pytrapment import trapindex
+
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    # the host proteins as entrapment database, every trap protein shares a peptide
+    fasta_trap = fasta_host
+    if source == "index":
+        fasta_trap = trapindex.build_index(fasta_host, str(tmpdir.join("index"))).index_dir
+    max_memory = "1G" if source == "chunked" else None
+    with pytest.raises(ValueError, match="All entrapment proteins share a peptide"):
+        entrapment.match_proteins(fasta_host, fasta_trap, max_memory=max_memory)
+    with pytest.raises(ValueError, match="All entrapment proteins share a peptide"):
+        entrapment.match_proteins(fasta_host, fasta_trap, max_uses=2, max_memory=max_memory)
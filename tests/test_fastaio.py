@@ -0,0 +1,266 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pytrapment import entrapment, fastaio, sequences
+
+# fixtures is used to store files used for the tests only
+fixtures_loc = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_indexed_fasta_matches_parser(tmpdir):
+    fasta_file = os.path.join(fixtures_loc, "UP000321567.fasta")
+    index_file = str(tmpdir.join("trap.pti"))
+    store = sequences.SequenceStore.from_fasta(fasta_file)
+
+    with fastaio.IndexedFasta(fasta_file, index_file=index_file) as trap_fasta:
+        assert len(trap_fasta) == len(store)
+        assert np.all(trap_fasta.ids == store.ids)
+        assert trap_fasta.sequence(10) == store.sequence(10)
+        assert np.all(trap_fasta.lengths == np.diff(store.offsets))
+        assert trap_fasta.to_store([5, 1]).sequences() == store.take([5, 1]).sequences()
+
+    # the second reader loads the sidecar index
+    assert os.path.exists(index_file)
+    reloaded = fastaio.IndexedFasta(fasta_file, index_file=index_file)
+    assert np.all(reloaded.index["record_start"] == trap_fasta.index["record_start"])
+
+
+def test_indexed_fasta_stale_index(tmpdir):
+    fasta_file = str(tmpdir.join("mock.fasta"))
+    index_file = str(tmpdir.join("mock.pti"))
+    with open(fasta_file, "w") as ffile:
+        ffile.write(">a\nPEPT\nIDE*\n>b desc\r\nKR\n")
+    assert fastaio.IndexedFasta(fasta_file, index_file=index_file).sequence(0) == "PEPTIDE"
+
+    with open(fasta_file, "w") as ffile:
+        ffile.write("\n>c\nELVISK")
+    reader = fastaio.IndexedFasta(fasta_file, index_file=index_file)
+    assert reader.ids.tolist() == ["c"]
+    assert reader.sequence(0) == "ELVISK"
+
+
+def test_indexed_fasta_sidecar_opt_in(tmpdir):
+    fasta_dir = tmpdir.mkdir("fasta")
+    fasta_file = str(fasta_dir.join("eight.fasta"))
+    with open(os.path.join(fixtures_loc, "eight_sequences.fasta"), "rb") as ffile:
+        fasta_dir.join("eight.fasta").write_binary(ffile.read())
+
+    # without an index directory nothing is written next to the fasta file
+    store = fastaio.load_store(fasta_file)
+    assert list(fastaio.select_records(fasta_file, [3])) == list(store.take([3]).records())
+    assert os.listdir(str(fasta_dir)) == ["eight.fasta"]
+
+    index_dir = str(tmpdir.join("cache"))
+    index_file = fastaio.index_location(fasta_file, index_dir)
+    assert index_file != fastaio.index_location(str(tmpdir.join("eight.fasta")), index_dir)
+    assert fastaio.load_store(fasta_file, index_dir=index_dir).sequences() == store.sequences()
+    assert os.path.exists(index_file)
+    assert os.listdir(str(fasta_dir)) == ["eight.fasta"]
+
+    # an index location that cannot be written keeps the index in memory
+    blocked = str(fasta_dir.join("eight.fasta", "eight.pti"))
+    with fastaio.IndexedFasta(fasta_file, index_file=blocked) as reader:
+        assert reader.sequence(3) == store.sequence(3)
+    assert os.listdir(str(fasta_dir)) == ["eight.fasta"]
+
+
+def test_write_records(tmpdir):
+    fasta_file = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    out_file = str(tmpdir.join("out.fasta"))
+    with fastaio.IndexedFasta(fasta_file, index_file=str(tmpdir.join("eight.pti"))) as reader:
+        reader.write_records([], out_file)
+        reader.write_records([7, 2, 2], out_file, file_mode="a")
+        written = sequences.SequenceStore.from_fasta(out_file)
+        assert written.ids.tolist() == reader.ids[[7, 2, 2]].tolist()
+        assert written.sequences() == [reader.sequence(ii) for ii in [7, 2, 2]]
+
+
+def test_empty_fasta(tmpdir):
+    fasta_file = str(tmpdir.join("empty.fasta"))
+    open(fasta_file, "w").close()
+    assert len(fastaio.IndexedFasta(fasta_file)) == 0
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_fasta_writer(tmpdir, compression):
+    if compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+    fasta_file = os.path.join(fixtures_loc, "UP000321567.fasta")
+    reader = fastaio.IndexedFasta(fasta_file, index_file=str(tmpdir.join("trap.pti")))
+    out_file = str(tmpdir.join("out.fasta"))
+    # a small buffer writes (and compresses) many blocks
+    # zstd output cannot be indexed
+    with fastaio.FastaWriter(out_file, compression=compression, threads=2,
+                             fai=compression != "zstd", buffer_size=4096) as writer:
+        writer.write("host protein", "PEPTIDEK")
+        writer.write_records(reader.records(range(100)))
+
+    with open(out_file, "rb") as ffile:
+        content = ffile.read()
+    if compression == "gzip":
+        content = gzip.decompress(content)
+    elif compression == "zstd":
+        content = zstandard.ZstdDecompressor().decompressobj().decompress(content)
+    plain_file = str(tmpdir.join("plain.fasta"))
+    with open(plain_file, "wb") as ffile:
+        ffile.write(content)
+
+    written = sequences.SequenceStore.from_fasta(plain_file)
+    assert written.ids.tolist() == ["host protein"] + reader.ids[:100].tolist()
+    assert written.sequences()[1:] == [reader.sequence(ii) for ii in range(100)]
+
+    if compression == "zstd":
+        with pytest.raises(ValueError):
+            fastaio.FastaWriter(str(tmpdir.join("out2.fasta")), compression="zstd", fai=True)
+        return
+    # fai offsets point to the first residue of every record in the uncompressed file
+    fai = pd.read_csv(out_file + ".fai", sep="\t", header=None)
+    assert fai[0].tolist()[0] == "host"
+    assert np.all(fai[1].values == [8] + reader.lengths[:100].tolist())
+    for offset, seq in zip(fai[2].values, written.sequences()):
+        assert content[offset:offset + min(len(seq), 70)].decode() == seq[:70]
+
+
+def test_fasta_writer_bgzf(tmpdir):
+    out_file = str(tmpdir.join("out.fasta.gz"))
+    rng = np.random.RandomState(0)
+    with fastaio.FastaWriter(out_file, compression="gzip", threads=2, fai=True,
+                             buffer_size=100000) as writer:
+        for ii in range(300):
+            writer.write(f"protein{ii}", "".join(rng.choice(list("ACDEFGHIKLMNPQRSTVWY"), 900)))
+    with open(out_file, "rb") as ffile:
+        compressed = ffile.read()
+    content = gzip.decompress(compressed)
+
+    # BGZF blocks: BC extra field with the block size, at most BGZF_BLOCK_SIZE bytes each,
+    # the file ends with the empty EOF block
+    assert compressed.endswith(fastaio.BGZF_EOF)
+    offset, starts = 0, []
+    while offset < len(compressed):
+        assert compressed[offset + 12:offset + 14] == b"BC"
+        starts.append(offset)
+        offset += int.from_bytes(compressed[offset + 16:offset + 18], "little") + 1
+    assert offset == len(compressed)
+
+    # the .gzi maps every block after the first to its uncompressed offset
+    with open(out_file + ".gzi", "rb") as gfile:
+        gzi = np.frombuffer(gfile.read(), dtype="<u8")
+    assert gzi[0] == len(starts) - 2
+    entries = gzi[1:].reshape(-1, 2)
+    assert entries[:, 0].tolist() == starts[1:-1]
+    for compressed_offset, uncompressed_offset in entries:
+        block = zlib.decompressobj(31).decompress(compressed[compressed_offset:])
+        assert block == content[uncompressed_offset:uncompressed_offset + len(block)]
+        assert len(block) <= fastaio.BGZF_BLOCK_SIZE
+
+
+def test_fasta_writer_unknown_compression(tmpdir):
+    with pytest.raises(ValueError):
+        fastaio.FastaWriter(str(tmpdir.join("out.fasta")), compression="lz4")
+
+
+def compress_fixture(tmpdir, compression, name="UP000321567.fasta"):
+    with open(os.path.join(fixtures_loc, name), "rb") as ffile:
+        content = ffile.read()
+    if compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        content = zstandard.ZstdCompressor().compress(content)
+    else:
+        content = {"gzip": gzip, "bz2": bz2, "xz": lzma}[compression].compress(content)
+    out_file = str(tmpdir.join(f"{name}.{compression}"))
+    with open(out_file, "wb") as ffile:
+        ffile.write(content)
+    return out_file
+
+
+@pytest.mark.parametrize("compression", ["gzip", "bz2", "xz", "zstd"])
+def test_load_store_compressed(tmpdir, compression):
+    fasta_file = os.path.join(fixtures_loc, "UP000321567.fasta")
+    compressed_file = compress_fixture(tmpdir, compression)
+    assert fastaio.detect_compression(compressed_file) == compression
+
+    plain = sequences.SequenceStore.from_fasta(fasta_file)
+    store = fastaio.load_store(compressed_file)
+    assert np.all(store.ids == plain.ids)
+    assert store.sequences() == plain.sequences()
+
+    selected = list(fastaio.select_records(compressed_file, [20, 3, 20]))
+    assert [header.decode() for header, _ in selected] == plain.ids[[20, 3, 20]].tolist()
+    with pytest.raises(ValueError):
+        fastaio.IndexedFasta(compressed_file)
+
+
+def test_iter_records_small_blocks():
+    fasta_file = os.path.join(fixtures_loc, "UP000321567.fasta")
+    plain = sequences.SequenceStore.from_fasta(fasta_file)
+    with open(fasta_file, "rb") as stream:
+        records = list(fastaio.iter_records(stream, block_size=7))
+
+    assert [header.decode() for header, _ in records] == plain.ids.tolist()
+    assert [sequence.decode() for _, sequence in records] == plain.sequences()
+    assert list(fastaio.iter_records(io.BytesIO(b"no records"), block_size=3)) == []
+    assert list(fastaio.iter_records(io.BytesIO(b"x\n>a"))) == [(b"a", b"")]
+
+
+def test_threaded_reader_error(tmpdir):
+    broken_file = str(tmpdir.join("broken.fasta.gz"))
+    with open(broken_file, "wb") as ffile:
+        ffile.write(gzip.compress(b">a\nPEPTIDE\n")[:-10])
+    with pytest.raises(EOFError):
+        with fastaio.open_fasta(broken_file) as stream:
+            stream.read()
+
+
+def test_get_nearest_neighbor_proteins_compressed(tmpdir):
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    ref_df = entrapment.get_nearest_neighbor_proteins(fasta_host, fasta_trap)
+    test_df = entrapment.get_nearest_neighbor_proteins(
+        compress_fixture(tmpdir, "gzip", "eight_sequences.fasta"),
+        compress_fixture(tmpdir, "xz", "multiple_sequences.fasta"))
+
+    assert np.all(ref_df.index == test_df.index)
+    assert np.all(ref_df["fasta_record"] == test_df["fasta_record"])
+
+
+def test_open_fasta_early_close(tmpdir):
+    fasta_file = os.path.join(fixtures_loc, "UP000321567.fasta")
+    with fastaio.open_fasta(fasta_file) as stream:
+        assert stream.read(1) == b">"
+    # closing before the end stops the background decompression thread
+    stream = fastaio.open_fasta(compress_fixture(tmpdir, "gzip"), queue_size=1)
+    assert stream.read(1) == b">"
+    stream.close()
+
+    selected = list(fastaio.select_records(fasta_file, [1, 0]))
+    assert selected[0][0] == fastaio.IndexedFasta(fasta_file).header_bytes(1)
+
+
+def test_record_sizes_and_sequence_chunks(tmpdir):
+    fasta_file = compress_fixture(tmpdir, "gzip", "multiple_sequences.fasta")
+    store = sequences.SequenceStore.from_fasta(os.path.join(fixtures_loc,
+                                                            "multiple_sequences.fasta"))
+    lengths, header_lengths = fastaio.record_sizes(fasta_file)
+    assert np.all(lengths == np.diff(store.offsets))
+    assert np.all(header_lengths == np.diff(store.header_offsets))
+
+    ends = np.array([4, 5, len(store)])
+    chunks = list(fastaio.iter_sequence_chunks(fasta_file, ends))
+    assert [first for first, _, _ in chunks] == [0, 4, 5]
+    for (first, buffer, offsets), end in zip(chunks, ends):
+        chunk = sequences.SequenceStore(buffer, offsets, np.zeros(0, dtype=np.uint8),
+                                        np.zeros(len(offsets), dtype=np.int64))
+        assert chunk.sequences() == store.take(np.arange(first, end)).sequences()
+
+    # streaming and the offset index return the same records
+    records = np.array([7, 0, 7, 3])
+    assert list(fastaio.select_records(fasta_file, records, indexed=False)) == \
+        list(store.take(records).records())
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pytest
+from pyteomics import electrochem, parser
+
+from pytrapment import entrapment, features, sequences
+
+# fixtures is used to store files used for the tests only
+fixtures_loc = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_residue_counts():
+    seqs = ["PEPTIDEK", "KRRAWF", "XBACE", ""]
+    counts = features.residue_counts(*sequences.encode_sequences(seqs))
+
+    assert counts.dtype == np.uint16
+    for ii, sequence in enumerate(seqs):
+        assert list(counts[ii]) == [sequence.count(aa) for aa in features.COUNT_COLUMNS]
+
+
+def test_group_counts():
+    seqs = ["PEPTIDEK", "KRRAWF", "XBACE", ""]
+    counts = features.residue_counts(*sequences.encode_sequences(seqs))
+    groups = dict(features.FEATURE_GROUPS, sulfur="CM", unknown="X")
+    grouped = features.group_counts(counts, groups)
+
+    assert grouped.shape == (4, 7)
+    for jj, residues in enumerate(groups.values()):
+        assert list(grouped[:, jj]) == [sum(sequence.count(aa) for aa in residues)
+                                        for sequence in seqs]
+
+    with pytest.raises(ValueError):
+        features.group_weights({"invalid": "K1"})
+
+
+@pytest.mark.parametrize("pK", [None, electrochem.pK_sillero])
+def test_isoelectric_points(pK):
+    rng = np.random.RandomState(0)
+    residues = np.array(list("ACDEFGHIKLMNPQRSTVWYDEKRHCY"))
+    seqs = ["".join(rng.choice(residues, size=rng.randint(1, 40))) for _ in range(500)] + \
+        ["DDDDEEE", "KKKRRRHHH", "AAAAAA"]
+    counts = features.residue_counts(*sequences.encode_sequences(seqs))
+
+    kwargs = {} if pK is None else {"pK": pK}
+    expected = [electrochem.pI(sequence, **kwargs) for sequence in seqs]
+    assert np.allclose(features.isoelectric_points(counts, pK=pK), expected, atol=1e-9)
+
+
+def test_isoelectric_points_long():
+    # large counts use the row-wise unique fallback, unknown labels (modifications) are skipped
+    seqs = ["DECYHKR" * 700, "PEPTIDEK", "DECYHKR" * 700]
+    pK = dict(electrochem.pK_lehninger, pS=[(5.6, -1)])
+    counts = features.residue_counts(*sequences.encode_sequences(seqs))
+
+    expected = [electrochem.pI(sequence) for sequence in seqs]
+    assert np.allclose(features.isoelectric_points(counts, pK=pK), expected, atol=1e-9)
+
+
+def test_hydropathy():
+    seqs = ["PEPTIDE", "KRRAWF", "ELVISLIVES", "PEPTIXE"]
+    counts = features.residue_counts(*sequences.encode_sequences(seqs))
+    charged = dict.fromkeys(parser.std_amino_acids, 0.0)
+    charged.update({"K": 1.0, "R": 1.0})
+    values = features.hydropathy(counts, ["gravy", "hopp_woods", charged])
+
+    assert values.shape == (4, 3)
+    assert np.allclose(values[:3, 0], [electrochem.gravy(sequence) for sequence in seqs[:3]])
+    # residues without value (X) give no average
+    assert np.isnan(values[3, 0])
+    assert np.all(np.isnan(values[3]))
+    assert list(values[:3, 2]) == [0, 0.5, 0]
+
+
+def test_protein_hydropathy():
+    proteins_df = entrapment.fasta2dataframe(os.path.join(fixtures_loc, "eight_sequences.fasta"))
+    df_comp = entrapment.compute_composition_df(proteins_df)
+    df_hydropathy = features.protein_hydropathy(df_comp, ["gravy", "eisenberg"])
+
+    assert list(df_hydropathy.columns) == ["gravy", "eisenberg"]
+    assert np.allclose(df_hydropathy.loc[proteins_df.index, "gravy"],
+                       [electrochem.gravy(sequence) for sequence in proteins_df["sequence"]])
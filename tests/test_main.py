@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pytrapment
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, *args], check=True, env=env, capture_output=True,
+                          text=True).stdout
+
+
+def test_cli_imports_are_lazy():
+    # the heavy dependencies are only imported when a pipeline stage needs them
+    loaded = run_python("-c", "import sys, pytrapment.__main__; print(' '.join(sys.modules))")
+    for module in ["pandas", "scipy", "matplotlib", "seaborn", "pyteomics"]:
+        assert module not in loaded.split()
+
+
+def test_cli_version():
+    assert run_python("-m", "pytrapment", "--version").strip() == pytrapment.__version__
+    assert "pytrapment" in run_python("-m", "pytrapment", "--help")
+
+
+def test_package_attributes():
+    assert "entrapment" in pytrapment.__all__
+    assert isinstance(pytrapment.__version__, str)
+    with pytest.raises(AttributeError):
+        pytrapment.missing_attribute
+
+
+def test_package_all_lists_modules():
+    # every public module on disk is exported, the list is static to keep the import cheap
+    package_dir = os.path.dirname(pytrapment.__file__)
+    modules = [name[:-3] for name in os.listdir(package_dir)
+               if name.endswith(".py") and not name.startswith("_")]
+    assert sorted(pytrapment.__all__) == sorted(modules)
@@ -0,0 +1,179 @@
+import os
+
+import numpy as np
+import pytest
+
+from pytrapment import entrapment, neighbors
+
+# fixtures is used to store files used for the tests only
+fixtures_loc = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def mock_compositions(n_host=40, n_trap=300, seed=0):
+    # small integer counts produce many exact distance ties
+    rng = np.random.RandomState(seed)
+    return rng.randint(0, 3, size=(n_host, 5)), rng.randint(0, 3, size=(n_trap, 5))
+
+
+@pytest.mark.parametrize("k", [1, 3])
+def test_kdtree_engine_matches_cdist(k):
+    host, trap = mock_compositions()
+    ref_dist, ref_idx = neighbors.CdistEngine().fit(trap).kneighbors(host, k=k)
+    dist, idx = neighbors.KDTreeEngine(candidates=1).fit(trap).kneighbors(host, k=k)
+
+    assert np.all(idx == ref_idx)
+    assert np.allclose(dist, ref_dist)
+
+
+@pytest.mark.parametrize("k", [1, 3])
+def test_blocked_kneighbors_matches_cdist(k):
+    host, trap = mock_compositions()
+    ref_dist, ref_idx = neighbors.CdistEngine().fit(trap).kneighbors(host, k=k)
+    # a tiny budget forces many host and trap tiles
+    dist, idx = neighbors.blocked_kneighbors(host, trap, k=k, memory_budget=4096)
+
+    assert np.all(idx == ref_idx)
+    assert np.allclose(dist, ref_dist)
+
+
+def test_blocked_engine_small_trap():
+    host, trap = mock_compositions(n_trap=2)
+    dist, idx = neighbors.BlockedEngine().fit(trap).kneighbors(host, k=5)
+
+    assert idx.shape == (40, 2)
+
+
+def test_tie_breaking_first_row():
+    trap = np.array([[1, 0], [0, 1], [1, 0]])
+    dist, idx = neighbors.KDTreeEngine().fit(trap).kneighbors([[0, 0]], k=1)
+
+    assert idx[0, 0] == 0
+    assert dist[0, 0] == 1
+
+
+def test_get_engine():
+    engine = neighbors.KDTreeEngine()
+    assert neighbors.get_engine(engine) is engine
+    assert isinstance(neighbors.get_engine("cdist"), neighbors.CdistEngine)
+    with pytest.raises(ValueError):
+        neighbors.get_engine("unknown")
+
+
+@pytest.mark.parametrize("engine", ["kdtree", "blocked"])
+def test_get_nearest_neighbor_proteins_engines(engine):
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    ref_df = entrapment.get_nearest_neighbor_proteins(fasta_host, fasta_trap, engine="cdist")
+    test_df = entrapment.get_nearest_neighbor_proteins(fasta_host, fasta_trap, engine=engine)
+
+    assert np.all(ref_df.index == test_df.index)
+    assert np.allclose(ref_df["distance"].dropna(), test_df["distance"].dropna())
+
+
+def test_ivf_engine_recall():
+    host, trap = mock_compositions(n_host=50, n_trap=500)
+    engine = neighbors.IVFEngine(n_lists=10, n_probe=3, recall_sample=20).fit(trap)
+    dist, idx = engine.kneighbors(host, k=2)
+
+    assert idx.shape == (50, 2)
+    assert 0 <= engine.recall_ <= 1
+    assert engine.measure_recall(host, k=2, sample_size=20) == engine.recall_
+    assert engine.recall_counts_[1] == 40
+    assert engine.recall_ == engine.recall_counts_[0] / 40
+
+
+def test_ivf_engine_all_lists_is_exact():
+    host, trap = mock_compositions()
+    ref_dist, ref_idx = neighbors.blocked_kneighbors(host, trap, k=3)
+    engine = neighbors.IVFEngine(n_lists=6, n_probe=6).fit(trap)
+    dist, idx = engine.kneighbors(host, k=3)
+
+    assert np.all(idx == ref_idx)
+    assert np.allclose(dist, ref_dist)
+    # too few probed members for k neighbors fall back to exact search
+    dist, idx = neighbors.IVFEngine(n_lists=300, n_probe=1).fit(trap).kneighbors(host, k=3)
+    assert np.all(np.isfinite(dist))
+
+
+@pytest.mark.parametrize("max_uses", [1, 2])
+def test_assign_unique(max_uses):
+    host, trap = mock_compositions(n_host=60, n_trap=70)
+    dist, idx = neighbors.assign_unique(host, trap, max_uses=max_uses, k=2)
+
+    assert np.all(idx >= 0)
+    assert np.bincount(idx).max() <= max_uses
+    assert np.allclose(dist, np.sqrt(((host - trap[idx]) ** 2).sum(axis=1)))
+
+
+def test_assign_unique_fits_once(monkeypatch):
+    host, trap = mock_compositions(n_host=60, n_trap=70)
+    ref_dist, ref_idx = neighbors.assign_unique(host, trap, engine="cdist", max_uses=1, k=2)
+    calls = []
+    fit, kneighbors = neighbors.KDTreeEngine.fit, neighbors.KDTreeEngine.kneighbors
+
+    def record_fit(self, trap_matrix):
+        calls.append("fit")
+        return fit(self, trap_matrix)
+
+    def record_kneighbors(self, host_matrix, k=1):
+        calls.append("kneighbors")
+        return kneighbors(self, host_matrix, k=k)
+
+    monkeypatch.setattr(neighbors.KDTreeEngine, "fit", record_fit)
+    monkeypatch.setattr(neighbors.KDTreeEngine, "kneighbors", record_kneighbors)
+    dist, idx = neighbors.assign_unique(host, trap, engine="kdtree", max_uses=1, k=2)
+
+    # later rounds query the same engine and skip the used trap proteins
+    assert calls.count("fit") == 1
+    assert calls.count("kneighbors") > 1
+    assert np.all(idx == ref_idx)
+    assert np.allclose(dist, ref_dist)
+
+
+def test_assign_unique_recall(monkeypatch):
+    host, trap = mock_compositions(n_host=60, n_trap=70)
+    engine = neighbors.IVFEngine(n_lists=4, n_probe=1, recall_sample=30)
+    counts = []
+    kneighbors = neighbors.IVFEngine.kneighbors
+
+    def record_counts(self, host_matrix, k=1):
+        result = kneighbors(self, host_matrix, k=k)
+        counts.append(self.recall_counts_)
+        return result
+
+    monkeypatch.setattr(neighbors.IVFEngine, "kneighbors", record_counts)
+    neighbors.assign_unique(host, trap, engine=engine, max_uses=1, k=2)
+
+    # the recall covers the candidate queries of all rounds
+    assert len(counts) > 1
+    assert engine.recall_ == sum(hits for hits, _ in counts) / sum(total for _, total in counts)
+
+
+def test_assign_unique_capacity():
+    host, trap = mock_compositions(n_host=60, n_trap=40)
+    with pytest.raises(ValueError):
+        neighbors.assign_unique(host, trap, max_uses=1)
+
+
+def test_get_nearest_neighbor_proteins_max_uses():
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    final_df = entrapment.get_nearest_neighbor_proteins(fasta_host, fasta_trap, max_uses=1)
+
+    assert final_df[final_df["db_type"] == "trap"].index.is_unique
+
+
+def test_kneighbors_excluding():
+    host, trap = mock_compositions()
+    excluded = np.zeros(len(trap), dtype=bool)
+    excluded[::3] = True
+    allowed = np.flatnonzero(~excluded)
+    ref_dist, ref_idx = neighbors.CdistEngine().fit(trap[allowed]).kneighbors(host, k=2)
+
+    # with no extra candidates many host proteins need the exact fallback
+    engine = neighbors.KDTreeEngine().fit(trap)
+    for candidates in [0, 16]:
+        dist, idx = neighbors.kneighbors_excluding(engine, host, trap, excluded, k=2,
+                                                   candidates=candidates)
+        assert np.all(idx == allowed[ref_idx])
+        assert np.allclose(dist, ref_dist)
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from pytrapment import peptides, sequences
+
+
+def random_peptides(n, seed, max_length=20):
+    rng = np.random.RandomState(seed)
+    residues = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+    return ["".join(rng.choice(residues, size=rng.randint(1, max_length)))
+            for _ in range(n)]
+
+
+def test_peptide_keys():
+    seqs = ["ELVISK", "ELVLSK", "ELVISKLIVESRAK", "ELVLSKLLVESRAK", "ELVISX", ""]
+    keys = peptides.peptide_keys(*sequences.encode_sequences(seqs))
+
+    # I/L-normalized peptides get the same key, short peptides are packed exactly
+    assert keys[0] == keys[1]
+    assert keys[2] == keys[3]
+    assert keys[0] < peptides.HASH_FLAG
+    assert keys[2] >= peptides.HASH_FLAG
+    assert keys[4] < peptides.HASH_FLAG
+    assert len(np.unique(keys)) == 4
+    assert len(peptides.peptide_keys(*sequences.encode_sequences([]))) == 0
+
+
+def test_peptide_keys_empty_peptides():
+    seqs = ["ELVISK", "", "PEPTIDEK", "ELVISKLIVESR", ""]
+    keys = peptides.peptide_keys(*sequences.encode_sequences(seqs))
+
+    # empty peptides do not change the keys of their neighbors
+    for seq, key in zip(seqs, keys):
+        assert key == peptides.peptide_keys(*sequences.encode_sequences([seq]))[0]
+    assert keys[1] == keys[4]
+
+
+def test_shared_peptides():
+    host = random_peptides(2000, 1, max_length=8) + random_peptides(2000, 2)
+    trap = random_peptides(1000, 1, max_length=8)[::2] + random_peptides(2000, 3) + host[-500:]
+    shared = peptides.shared_peptides(*sequences.encode_sequences(trap),
+                                      *sequences.encode_sequences(host))
+
+    host_set = {peptide.replace("I", "L") for peptide in host}
+    expected = np.array([peptide.replace("I", "L") in host_set for peptide in trap])
+    assert np.all(shared == expected)
+
+
+def test_shared_peptides_collisions():
+    host = ["PEPTIDEPEPTIDEK", "ELVISLIVESELVISK", "ANDTHENSOMEMORER"]
+    trap = ["ELVLSLLVESELVLSK", "NOTINTHEHOSTATALLK"]
+    host_buffer, host_offsets = sequences.encode_sequences(host)
+    trap_buffer, trap_offsets = sequences.encode_sequences(trap)
+
+    # all peptides share the same hash, only the exact comparison tells them apart
+    colliding = np.full(3, peptides.HASH_FLAG)
+    shared = peptides.shared_peptides(trap_buffer, trap_offsets, host_buffer, host_offsets,
+                                      query_keys=colliding[:2], ref_keys=colliding)
+    assert np.all(shared == [True, False])
+
+
+def test_bloom_filter():
+    rng = np.random.RandomState(0)
+    keys = rng.randint(0, 2 ** 62, size=20000, dtype=np.int64).astype(np.uint64)
+    bloom = peptides.BloomFilter(10000, fp_rate=0.01).add(keys[:10000])
+
+    # no false negatives, false positives close to the target rate
+    assert np.all(bloom.contains(keys[:10000]))
+    assert bloom.contains(keys[10000:]).mean() < 0.02
+    assert bloom.nbytes * 8 == bloom.n_bits
+
+    with pytest.raises(ValueError):
+        peptides.BloomFilter(10, fp_rate=1)
+
+
+@pytest.mark.parametrize("fp_rate", [0.001, 0.3])
+def test_shared_peptides_bloom(fp_rate):
+    host = random_peptides(2000, 1, max_length=8) + random_peptides(2000, 2)
+    trap = random_peptides(4000, 3) + host[::4]
+    trap_peptides = sequences.encode_sequences(trap)
+    host_peptides = sequences.encode_sequences(host)
+
+    metrics = {}
+    shared = peptides.shared_peptides(*trap_peptides, *host_peptides, bloom_fp_rate=fp_rate,
+                                      metrics=metrics)
+    assert np.all(shared == peptides.shared_peptides(*trap_peptides, *host_peptides))
+    assert metrics["bloom_fp_rate"] < 2 * fp_rate
+    assert metrics["bloom_bytes"] > 0
+
+
+def test_peptide_lookup_chunks(monkeypatch):
+    host = random_peptides(2000, 1, max_length=8) + random_peptides(2000, 2)
+    trap = random_peptides(3000, 3) + host[::4]
+    trap_buffer, trap_offsets = sequences.encode_sequences(trap)
+    host_peptides = sequences.encode_sequences(host)
+    expected = peptides.shared_peptides(trap_buffer, trap_offsets, *host_peptides)
+    keys = peptides.peptide_keys(trap_buffer, trap_offsets)
+
+    # keys are computed in kernel chunks, the lookup is queried in several blocks
+    monkeypatch.setattr(sequences, "CHUNK_RESIDUES", 1000)
+    assert len(sequences.chunk_bounds(trap_offsets)) > 3
+    assert np.all(peptides.peptide_keys(trap_buffer, trap_offsets) == keys)
+    lookup = peptides.PeptideLookup(*host_peptides, bloom_fp_rate=0.01)
+    bounds = [0, 1000, 1001, len(trap)]
+    shared = np.concatenate([lookup.shared(trap_buffer[trap_offsets[start]:trap_offsets[end]],
+                                           trap_offsets[start:end + 1] - trap_offsets[start])
+                             for start, end in zip(bounds[:-1], bounds[1:])])
+    assert np.all(shared == expected)
+    assert lookup.n_queries == len(trap)
+    assert lookup.nbytes > 0
+    metrics = {}
+    lookup.update_metrics(metrics)
+    assert metrics["bloom_fp_rate"] < 0.02
@@ -0,0 +1,59 @@
+import os
+import pstats
+import time
+
+from pytrapment import entrapment, profiling, runmetrics
+
+# fixtures is used to store files used for the tests only
+fixtures_loc = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_profile_enabled(monkeypatch):
+    monkeypatch.delenv(profiling.PROFILE_ENV, raising=False)
+    assert not profiling.profile_enabled()
+    assert profiling.profile_enabled(True)
+    monkeypatch.setenv(profiling.PROFILE_ENV, "1")
+    assert profiling.profile_enabled()
+    monkeypatch.setenv(profiling.PROFILE_ENV, "0")
+    assert not profiling.profile_enabled()
+
+
+def test_stack_sampler():
+    sampler = profiling.StackSampler(interval=0.001).start()
+    busy_loop(0.1)
+    sampler.stop()
+    assert sum(sampler.stacks.values()) > 0
+    # stacks are written root first with the sampled function as leaf
+    assert any(stack.split(";")[-1].startswith("busy_loop") for stack in sampler.stacks)
+    line = sampler.collapsed().splitlines()[0]
+    assert int(line.rsplit(" ", 1)[1]) > 0
+
+
+def test_stage_profiler(tmpdir):
+    profiler = profiling.StageProfiler(str(tmpdir), interval=0.001)
+    metrics = runmetrics.RunMetrics(profiler=profiler)
+    for _ in range(2):
+        with metrics.stage("loop"):
+            busy_loop(0.05)
+    pstats_file, collapsed_file = profiler.paths("loop")
+    stats = pstats.Stats(pstats_file)
+    # both runs of the stage are accumulated
+    assert any(func[2] == "busy_loop" and stat[0] == 2 for func, stat in stats.stats.items())
+    with open(collapsed_file) as cfile:
+        assert "busy_loop" in cfile.read()
+    assert metrics.stages["loop"]["calls"] == 2
+
+
+def test_profile_matching(tmpdir):
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    metrics = runmetrics.RunMetrics(profiler=profiling.StageProfiler(str(tmpdir)))
+    entrapment.match_proteins(fasta_host, fasta_trap, metrics=metrics)
+    for stage in ["parse", "composition", "digestion", "filtering", "nn_search"]:
+        assert all(os.path.isfile(path) for path in metrics.profiler.paths(stage))
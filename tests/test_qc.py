@@ -1,5 +1,9 @@
 import os
 
+import numpy as np
+import pandas as pd
+import pytest
+
 from pytrapment import entrapment, qc
 
 # fixtures is used to store files used for the tests only
@@ -17,6 +21,18 @@ def test_compute_peptide_features():
     assert features_df.shape[1] == 10
 
 
+def test_compute_peptide_features_custom_scale():
+    peptides_df = pd.DataFrame({"sequence": ["PEPTIDEK", "AAAAK"]})
+    # every residue of a custom scale counts 1, so the average is 1
+    custom = {aa: 1.0 for aa in "ACDEFGHIKLMNPQRSTVWY"}
+    features_df = qc.compute_sequence_features(peptides_df, scales=("hopp_woods", custom))
+
+    assert list(features_df["scale_1"]) == [1.0, 1.0]
+    assert features_df["hopp_woods"].notna().all()
+    with pytest.raises(ValueError):
+        qc.compute_sequence_features(peptides_df, scales=("unknown",))
+
+
 def test_qc_peptides(tmpdir):
     fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
     fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
@@ -35,3 +51,55 @@ def test_qc_peptides(tmpdir):
     p = tmpdir.mkdir("pytrament_test")
     qc.qc_peptides(features_df_host, features_df_trap, p)
     assert True
+
+
+def test_qc_peptides_summary(tmpdir):
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    result = entrapment.match_proteins(fasta_host, fasta_trap)
+
+    features_df_host = qc.compute_sequence_features(result.peptide_df("host"))
+    features_df_trap = qc.compute_sequence_features(result.peptide_df("trap"))
+    summary = qc.qc_peptides(features_df_host, features_df_trap, str(tmpdir), kind="violin",
+                             formats=["png", "svg"])
+    assert os.path.isfile(os.path.join(str(tmpdir), "qc_plot.png"))
+    assert os.path.isfile(os.path.join(str(tmpdir), "qc_plot.svg"))
+    assert summary.types == ["host", "trap"]
+    assert summary["host", "length"].count == len(features_df_host)
+    assert summary["trap", "gravy"].mean == pytest.approx(features_df_trap["gravy"].mean())
+    assert summary["host", "KR"].histogram.sum() == len(features_df_host)
+
+    # streaming over small protein chunks gives the same moments and histograms
+    streamed = qc.summarize_peptides(result.iter_peptide_dfs("host", chunk_size=2), "host")
+    streamed = qc.summarize_peptides(result.iter_peptide_dfs("trap", chunk_size=2), "trap",
+                                     streamed)
+    for db_type in ["host", "trap"]:
+        for feature in qc.QC_FEATURES:
+            assert streamed[db_type, feature].count == summary[db_type, feature].count
+            assert streamed[db_type, feature].mean == pytest.approx(summary[db_type,
+                                                                            feature].mean)
+            np.testing.assert_array_equal(streamed[db_type, feature].histogram,
+                                          summary[db_type, feature].histogram)
+    assert list(streamed.to_frame()["feature"].unique()) == qc.QC_FEATURES
+
+
+def test_summarize_peptide_arrays():
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    result = entrapment.match_proteins(fasta_host, fasta_trap)
+
+    # the buffers hold the rows of the peptide tables, the features need no strings
+    for db_type in ["host", "trap"]:
+        peptides_df = result.peptide_df(db_type)
+        buffers = list(result.iter_peptide_arrays(db_type, chunk_size=2))
+        assert sum(len(offsets) - 1 for _, offsets in buffers) == len(peptides_df)
+        observed = pd.concat([qc.peptide_features(*chunk) for chunk in buffers],
+                             ignore_index=True)
+        expected = qc.compute_sequence_features(peptides_df)
+        pd.testing.assert_frame_equal(observed, expected[list(observed.columns)])
+
+        streamed = qc.summarize_peptide_arrays(buffers, db_type)
+        reference = qc.summarize_features(expected, db_type)
+        for feature in qc.QC_FEATURES:
+            np.testing.assert_array_equal(streamed[db_type, feature].histogram,
+                                          reference[db_type, feature].histogram)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pytrapment import render, summaries
+
+
+def make_summary():
+    summary = summaries.QCSummary({"length": np.arange(-0.5, 51), "gravy": np.linspace(-4, 4, 81)})
+    rng = np.random.RandomState(0)
+    for db_type in ["host", "trap"]:
+        summary.update(pd.DataFrame({"length": rng.randint(6, 40, 5000),
+                                     "gravy": rng.normal(0, 1, 5000)}), db_type)
+    return summary
+
+
+def test_box_stats():
+    summary = make_summary()
+    stats = render.box_stats(summary["host", "length"], "host")
+    assert stats["label"] == "host"
+    assert summary["host", "length"].min <= stats["whislo"] <= stats["q1"] <= stats["med"]
+    assert stats["med"] <= stats["q3"] <= stats["whishi"] <= summary["host", "length"].max
+
+
+def test_violin_outline():
+    feature_summary = summaries.FeatureSummary(np.arange(0, 6)).update([1.5, 2.5, 2.5, 3.5])
+    positions, half_widths = render.violin_outline(feature_summary, width=1)
+    # empty bins at the ends are trimmed
+    assert positions[0] == 1 and positions[-1] == 4
+    assert half_widths.max() == 0.5
+    assert len(render.violin_outline(summaries.FeatureSummary([0, 1]))[0]) == 0
+
+
+def test_violin_outline_overflow():
+    # e.g. peptides longer than the last length edge
+    feature_summary = summaries.FeatureSummary(np.arange(0, 6)).update([1.5, 2.5, 8, 10])
+    positions, half_widths = render.violin_outline(feature_summary, width=1)
+    assert feature_summary.overflow == 2
+    assert positions[-1] == 10
+    # the overflow bin holds 2 values over a width of 5
+    assert half_widths[-1] == pytest.approx(0.5 * 2 / 5)
+
+
+def test_render_violin_overflow(tmpdir):
+    summary = summaries.QCSummary({"length": np.arange(-0.5, 11)})
+    summary.update(pd.DataFrame({"length": [-3, 2, 5, 5, 40]}), "host")
+    out_file = render.render_summary(summary, str(tmpdir.join("qc.svg")), kind="violin")
+    with open(out_file) as ofile:
+        plot = ofile.read()
+    # the labels of the values outside the edges are drawn
+    assert "1 &gt; 10.5" in plot or "1 > 10.5" in plot
+
+
+@pytest.mark.parametrize("kind", render.PLOT_KINDS)
+@pytest.mark.parametrize("plot_format", render.PLOT_FORMATS)
+def test_render_summary(tmpdir, kind, plot_format):
+    summary = make_summary()
+    # an empty feature of a type is skipped
+    summary.update(pd.DataFrame({"length": [], "gravy": []}), "decoy")
+    out_file = render.render_summary(summary, str(tmpdir.join(f"qc.{plot_format}")), kind=kind,
+                                     ncols=3)
+    with open(out_file, "rb") as ofile:
+        assert len(ofile.read()) > 1000
+
+
+def test_render_summary_errors(tmpdir):
+    summary = make_summary()
+    with pytest.raises(ValueError):
+        render.render_summary(summary, str(tmpdir.join("qc.png")), kind="swarm")
+    with pytest.raises(ValueError):
+        render.render_summary(summary, str(tmpdir.join("qc.jpg")))
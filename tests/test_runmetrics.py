@@ -0,0 +1,39 @@
+import json
+import os
+
+import numpy as np
+
+from pytrapment import runmetrics
+
+
+def test_stage():
+    metrics = runmetrics.RunMetrics()
+    with metrics.stage("compute", items=1000):
+        np.ones(2 ** 20).sum()
+    with metrics.stage("compute") as stage:
+        stage["items"] = 500
+    with metrics.stage("untimed"):
+        pass
+
+    stage = metrics.stages["compute"]
+    assert stage["calls"] == 2
+    assert stage["items"] == 1500
+    assert stage["wall_time"] > 0
+    assert stage["cpu_time"] >= 0
+    assert stage["items_per_second"] == stage["items"] / stage["wall_time"]
+    assert stage["peak_rss"] >= runmetrics.peak_rss() > 0
+    assert stage["peak_rss_delta"] >= 0
+    assert metrics.stages["untimed"]["items_per_second"] is None
+    assert list(metrics.stages) == ["compute", "untimed"]
+    assert len(metrics.report().splitlines()) == 3
+
+
+def test_write(tmpdir):
+    metrics = runmetrics.RunMetrics(bloom_bytes=64)
+    with metrics.stage("parse", items=3):
+        pass
+    path = metrics.write(os.path.join(str(tmpdir), "run_metrics.json"))
+    with open(path) as mfile:
+        loaded = json.load(mfile)
+    assert loaded["bloom_bytes"] == 64
+    assert loaded["stages"]["parse"]["items"] == 3
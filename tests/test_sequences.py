@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from pyteomics import parser
+
+from pytrapment import entrapment, sequences
+
+# fixtures is used to store files used for the tests only
+fixtures_loc = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_encode_sequences():
+    buffer, offsets = sequences.encode_sequences(["PEPTIDE", "", "KR"])
+
+    assert buffer.dtype == np.uint8
+    assert offsets.tolist() == [0, 7, 7, 9]
+    assert bytes(buffer[offsets[2]:offsets[3]]) == b"KR"
+
+
+def test_peptide_hashes():
+    seqs = ["ELVISK", "", "ELLVISKR", "ELVLSK", ""]
+    hashes = sequences.peptide_hashes(*sequences.encode_sequences(seqs))
+
+    # I/L-normalized peptides share a hash, empty peptides do not change their neighbors
+    assert hashes[0] == hashes[3]
+    assert hashes[1] == hashes[4]
+    for seq, value in zip(seqs, hashes):
+        assert value == sequences.peptide_hashes(*sequences.encode_sequences([seq]))[0]
+
+
+def test_composition_matrix_matches_pyteomics(monkeypatch):
+    # small chunks to cover proteins spread over several chunks
+    monkeypatch.setattr(sequences, "CHUNK_RESIDUES", 1000)
+    proteins_df = entrapment.fasta2dataframe(os.path.join(fixtures_loc, "UP000321567.fasta"))
+    buffer, offsets = sequences.encode_sequences(proteins_df["sequence"])
+    matrix = sequences.composition_matrix(buffer, offsets)
+
+    ref_df = pd.DataFrame(list(proteins_df["sequence"].apply(parser.amino_acid_composition)))
+    ref_df = ref_df.reindex(columns=sequences.composition_columns("separate")).fillna(0)
+    assert matrix.dtype == np.float32
+    assert np.all(matrix == ref_df.values)
+
+
+def test_composition_matrix_nonstandard():
+    buffer, offsets = sequences.encode_sequences(["PEPXBZUO", "pep*"])
+
+    separate = sequences.composition_matrix(buffer, offsets, nonstandard="separate")
+    assert separate.shape == (2, 25)
+    assert separate[0, 20:].tolist() == [1, 1, 1, 1, 1]
+    assert separate[1].sum() == 3
+
+    ignore = sequences.composition_matrix(buffer, offsets, nonstandard="ignore")
+    assert ignore.shape == (2, 20)
+    assert np.all(ignore == separate[:, :20])
+
+    with pytest.raises(ValueError):
+        sequences.composition_matrix(buffer, offsets, nonstandard="raise")
+    with pytest.raises(ValueError):
+        sequences.composition_columns("unknown")
+
+
+def test_sequence_store_shuffle_matches_sample():
+    fasta_file = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    store = sequences.SequenceStore.from_fasta(fasta_file)
+    shuffled = store.shuffle(random_state=42)
+    proteins_df = entrapment.fasta2dataframe(fasta_file)
+
+    # shuffling only permutes the order index, the buffer is shared
+    assert shuffled.buffer is store.buffer
+    assert np.all(shuffled.ids == proteins_df.index)
+    assert shuffled.sequences() == proteins_df["sequence"].tolist()
+
+
+def test_sequence_store_take_drop_composition():
+    store = sequences.SequenceStore.from_records([("a", "PEPTIDEK"), ("b", "KR"), ("c", "XA")])
+    subset = store.take([2, 0, 0]).drop(["c"])
+
+    assert len(subset) == 2
+    assert subset.ids.tolist() == ["a", "a"]
+    assert np.all(subset.composition() == store.composition()[[0, 0]])
+    assert np.all(entrapment.compute_composition_df(subset).index == ["a", "a"])
+
+
+def test_sequence_store_write_fasta(tmpdir):
+    fasta_file = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    store = sequences.SequenceStore.from_fasta(fasta_file)
+    out_file = str(tmpdir.join("store.fasta"))
+    store.take([3, 1]).write_fasta(out_file)
+
+    written = sequences.SequenceStore.from_fasta(out_file)
+    assert written.ids.tolist() == store.take([3, 1]).ids.tolist()
+    assert written.sequences() == store.take([3, 1]).sequences()
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pytrapment import summaries
+
+
+def rank_error(values, estimates, qs):
+    # distance between the requested and the achieved rank of the estimates
+    ranks = np.searchsorted(np.sort(values), estimates) / len(values)
+    return np.abs(ranks - qs).max()
+
+
+def test_quantile_sketch():
+    values = np.random.RandomState(0).lognormal(size=200000)
+    qs = np.linspace(0.01, 0.99, 50)
+    sketch = summaries.QuantileSketch(k=512)
+    for chunk in np.array_split(values, 13):
+        sketch.update(chunk)
+    assert sketch.count == len(values)
+    assert sum(len(level) for level in sketch.levels) < 512 * 10
+    assert rank_error(values, sketch.quantile(qs), qs) < 0.01
+
+    # merging sketches of parts equals a sketch of the whole
+    left = summaries.QuantileSketch(k=512).update(values[:70000])
+    right = summaries.QuantileSketch(k=512).update(values[70000:])
+    merged = left.merge(right)
+    assert merged.count == len(values)
+    assert rank_error(values, merged.quantile(qs), qs) < 0.01
+
+
+def test_quantile_sketch_small():
+    sketch = summaries.QuantileSketch().update([3., np.nan, 1., 2.])
+    assert sketch.count == 3
+    assert sketch.quantile(0.5) == 2
+    assert np.isnan(summaries.QuantileSketch().quantile([0.5])).all()
+
+
+def test_feature_summary():
+    values = np.random.RandomState(1).normal(5, 2, size=10000)
+    values[::100] = np.nan
+    summary = summaries.FeatureSummary(np.arange(0, 11))
+    other = summaries.FeatureSummary(np.arange(0, 11))
+    for chunk in np.array_split(values[:6000], 7):
+        summary.update(chunk)
+    other.update(values[6000:])
+    summary.merge(other)
+
+    valid = values[~np.isnan(values)]
+    assert summary.count == len(valid)
+    assert summary.missing == 100
+    assert summary.mean == pytest.approx(valid.mean())
+    assert summary.variance == pytest.approx(valid.var(ddof=1))
+    assert (summary.min, summary.max) == (valid.min(), valid.max())
+    np.testing.assert_array_equal(summary.histogram, np.histogram(valid, np.arange(0, 11))[0])
+    assert summary.underflow == (valid < 0).sum()
+    assert summary.overflow == (valid > 10).sum()
+    assert summary.histogram.sum() + summary.underflow + summary.overflow == len(valid)
+
+    stats = summary.to_dict()
+    assert stats["q50"] == pytest.approx(np.median(valid), abs=0.05)
+    assert stats["histogram"]["counts"] == summary.histogram.tolist()
+    assert summaries.FeatureSummary([0, 1]).to_dict()["mean"] is None
+
+
+def test_qc_summary():
+    summary = summaries.QCSummary({"length": np.arange(0, 30)}, k=64)
+    summary.update(pd.DataFrame({"length": [7, 8, 9]}), "host")
+    summary.update(pd.DataFrame({"length": [10, 20]}), "trap")
+    summary.update(pd.DataFrame({"length": [11]}), "host")
+
+    assert summary.types == ["host", "trap"]
+    assert summary.features == ["length"]
+    assert summary["host", "length"].count == 4
+    table = summary.to_frame()
+    assert table.shape[0] == 2
+    assert table.set_index("Type").loc["trap", "max"] == 20
+    assert summary.to_dict()["host"]["length"]["min"] == 7
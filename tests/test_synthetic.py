@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from pytrapment import entrapment, fastaio, peptides, sequences, synthetic
+
+
+def test_generate_records():
+    records = list(synthetic.generate_records(300, random_state=1, prefix="TEST"))
+    assert len(records) == 300
+    assert records[0][0].startswith(b"sp|TEST0000000|")
+    assert all(sequence[:1] == b"M" for _, sequence in records)
+    # seeded and independent of other streams
+    assert records == list(synthetic.generate_records(300, random_state=1, prefix="TEST"))
+    assert records != list(synthetic.generate_records(300, random_state=1, prefix="TEST",
+                                                      stream=1))
+
+    lengths = np.array([len(sequence) for _, sequence in records])
+    assert lengths.min() >= synthetic.LENGTH_RANGE[0]
+    assert 200 < np.median(lengths) < 400
+    residues = np.frombuffer(b"".join(sequence for _, sequence in records), dtype=np.uint8)
+    leucine = (residues == ord("L")).mean()
+    assert abs(leucine - synthetic.RESIDUE_FREQUENCIES["L"] / 100) < 0.01
+
+
+def test_spike_peptides():
+    rng = np.random.RandomState(0)
+    seqs = [b"MAAAAPAAAAAAAAAA"] * 4
+    spiked = synthetic.spike_peptides(seqs, [b"PEPTIDEK"], 0.5, rng)
+    for sequence, spike in zip(seqs, spiked):
+        assert (b"KPEPTIDEK" in sequence) == spike
+        # the peptide is not followed by a proline, so it is cleaved out
+        assert b"KPEPTIDEKP" not in sequence
+    assert not synthetic.spike_peptides(seqs, [], 0.5, rng).any()
+
+
+def test_remove_shared():
+    rng = np.random.RandomState(0)
+    host = [b"MAAAKGPEPTIDEKGGGGGGR"]
+    seqs = [b"MCCCCKGPEPTLDEKWWWWWWR", b"MCCCCCKNNNNNNR"]
+    host_keys = np.unique(synthetic.tryptic_keys(host))
+    assert np.isin(synthetic.tryptic_keys(seqs), host_keys).any()
+    assert synthetic.remove_shared(seqs, host_keys, rng) >= 1
+    assert not np.isin(synthetic.tryptic_keys(seqs), host_keys).any()
+    # the cleavage sites are kept
+    assert [sequence.count(b"K") + sequence.count(b"R") for sequence in seqs] == [3, 2]
+    assert seqs[1] == b"MCCCCCKNNNNNNR"
+
+
+def test_write_proteomes(tmpdir):
+    fasta_host = os.path.join(str(tmpdir), "host.fasta")
+    fasta_trap = os.path.join(str(tmpdir), "trap.fasta")
+    synthetic.write_proteomes(fasta_host, fasta_trap, 400, 1000, shared_rate=0.1,
+                              random_state=3)
+    host = fastaio.load_store(fasta_host)
+    trap = fastaio.load_store(fasta_trap)
+    assert (len(host), len(trap)) == (400, 1000)
+
+    # only the spiked entrapment proteins share peptides with the host
+    host_peptides = entrapment.digest_protein_df(host)
+    trap_peptides = entrapment.digest_protein_df(trap)
+    shared = np.isin(
+        peptides.peptide_keys(*sequences.encode_sequences(trap_peptides["sequence"].values)),
+        peptides.peptide_keys(*sequences.encode_sequences(host_peptides["sequence"].values)))
+    rate = trap_peptides["protein"][shared].nunique() / len(trap)
+    assert 0.07 < rate < 0.13
@@ -0,0 +1,110 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from pytrapment import entrapment, fastaio, runmetrics, trapindex
+
+# fixtures is used to store files used for the tests only
+fixtures_loc = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+@pytest.mark.parametrize("max_uses", [None, 1])
+def test_index_matches_fasta(tmpdir, max_uses):
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    index_dir = str(tmpdir.join("index"))
+    trap_index = trapindex.build_index(fasta_trap, index_dir)
+
+    assert trapindex.is_index(index_dir)
+    assert not trapindex.is_index(fasta_trap)
+    assert len(trap_index) == 19
+
+    ref_df = entrapment.get_nearest_neighbor_proteins(fasta_host, fasta_trap, max_uses=max_uses)
+    index_df = entrapment.get_nearest_neighbor_proteins(fasta_host, index_dir, max_uses=max_uses)
+    assert np.all(ref_df.index == index_df.index)
+    assert np.all(ref_df["fasta_record"] == index_df["fasta_record"])
+    assert np.allclose(ref_df["distance"].dropna(), index_df["distance"].dropna())
+
+
+def test_index_records_and_filter(tmpdir):
+    fasta_host = os.path.join(fixtures_loc, "one_sequence_host.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "two_sequences_trap.fasta")
+    index_dir = str(tmpdir.join("index"))
+    build_metrics = runmetrics.RunMetrics()
+    trap_index = trapindex.build_index(fasta_trap, index_dir, engine="blocked",
+                                       metrics=build_metrics)
+    assert list(build_metrics.stages) == ["parse", "composition", "digestion", "index_build"]
+
+    # the host shares peptides with the R-variant of the mock protein only
+    final_df = entrapment.get_nearest_neighbor_proteins(fasta_host, index_dir)
+    assert np.all(final_df.index == ["mock1_host_R", "mock1_unique_Ks"])
+    metrics = {}
+    bloom_df = entrapment.get_nearest_neighbor_proteins(fasta_host, index_dir, bloom_fp_rate=0.01,
+                                                        metrics=metrics)
+    assert np.all(bloom_df.index == final_df.index)
+    assert metrics["bloom_hashes"] > 0
+    assert "index_load" in metrics["stages"]
+    assert trap_index.engine.name == "blocked"
+
+    with fastaio.IndexedFasta(fasta_trap, index_file=str(tmpdir.join("trap.pti"))) as reader:
+        assert list(trapindex.select_records(index_dir, [1, 0])) == \
+            list(reader.records([1, 0]))
+
+
+def test_index_version(tmpdir):
+    index_dir = str(tmpdir.join("index"))
+    trapindex.build_index(os.path.join(fixtures_loc, "two_sequences_trap.fasta"), index_dir)
+    meta_file = os.path.join(index_dir, "meta.json")
+    with open(meta_file) as mfile:
+        meta = json.load(mfile)
+    meta["format_version"] = -1
+    with open(meta_file, "w") as mfile:
+        json.dump(meta, mfile)
+
+    with pytest.raises(ValueError):
+        trapindex.TrapIndex(index_dir)
+
+
+def test_index_decodes_selected_headers(tmpdir, monkeypatch):
+    from pytrapment import sequences
+
+    fasta_host = os.path.join(fixtures_loc, "eight_sequences.fasta")
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    trap_index = trapindex.build_index(fasta_trap, str(tmpdir.join("index")))
+    full_df = trap_index.composition_df()
+    subset_df = trap_index.composition_df([3, 0])
+    assert list(subset_df.index) == list(full_df.index[[3, 0]])
+    assert np.all(subset_df.values == full_df.values[[3, 0]])
+
+    # a run decodes the headers of the selected entrapment proteins only
+    decoded = []
+    ids = sequences.SequenceStore.ids
+
+    def count_ids(store):
+        decoded.append(len(store))
+        return ids.fget(store)
+
+    monkeypatch.setattr(sequences.SequenceStore, "ids", property(count_ids))
+    entrapment.match_proteins(fasta_host, trap_index.index_dir)
+    assert decoded and len(trap_index) not in decoded
+
+
+@pytest.mark.parametrize("engine", ["kdtree", "ivf"])
+def test_index_engine_from_arrays(tmpdir, engine):
+    from pytrapment import neighbors
+
+    fasta_trap = os.path.join(fixtures_loc, "multiple_sequences.fasta")
+    index_dir = str(tmpdir.join("index"))
+    trap_index = trapindex.build_index(fasta_trap, index_dir, engine=engine)
+    # the pickled engine holds the parameters only, not a copy of the composition matrix
+    assert os.path.getsize(os.path.join(index_dir, "engine.pkl")) < 1024
+
+    ref_engine = neighbors.get_engine(engine).fit(trap_index.composition)
+    nn_engine = trapindex.TrapIndex(index_dir).engine
+    for name in nn_engine.fitted_arrays:
+        assert isinstance(getattr(nn_engine, name), np.memmap)
+    host = np.asarray(trap_index.composition)[::2] + 1
+    for ref, result in zip(ref_engine.kneighbors(host, k=3), nn_engine.kneighbors(host, k=3)):
+        assert np.allclose(ref, result)